@@ -0,0 +1,495 @@
+"""
+ArchivePartitions: Per-month SQLite files for archived donations and requests.
+
+Rows moved to the cold tables by the expiry sweeper are flushed into one
+database file per month of `created_at` (`partitions/<db>-YYYY-MM.sqlite`
+next to the main database) and catalogued in the `archive_partitions` table.
+`open` attaches the partitions to a connection and replaces the
+`donations_all` / `requests_all` views with TEMP views over the hot tables,
+the staged archive rows and every attached month. Given a time window it only
+attaches the months that overlap it and filters every branch to the window,
+so a bounded report never opens the rest of history.
+
+SQLite caps the number of attached databases per connection (10 in most
+builds), so once there are more partitions than can be attached at once the
+oldest months are compacted into a single range partition.
+
+Flush and compaction change the catalog under connections that already have
+partitions attached. `refresh` re-reads the catalog when another connection
+has committed since the last check (PRAGMA data_version) and re-attaches if
+the partitions changed; connections opened with `PartitionedConnection` call
+it before every statement. `open` holds a shared lock on every file it
+attaches, and files dropped from the catalog by compaction are only removed
+once no connection holds that lock.
+
+Flush staged rows into monthly partitions and list them with:
+    python agents/archivePartitions.py --db database/foodcycle.sqlite --flush --list
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows, where a file SQLite has open cannot be removed anyway
+    fcntl = None
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.coldStorage import DONATION_FIELDS, REQUEST_FIELDS, create_archive_tables, create_cold_storage
+
+# Attach slots kept free for the two files flush and compaction work on
+RESERVED_ATTACH_SLOTS = 2
+DEFAULT_ATTACH_LIMIT = 10
+
+
+def month_of(value):
+    """Return the 'YYYY-MM' month of a date, datetime or timestamp string."""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m')
+    return str(value)[:7]
+
+
+def format_bound(value):
+    """Normalize a window bound to a 'YYYY-MM-DD HH:MM:SS' literal, or None."""
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value))
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def lock_shared(path):
+    """Open path and take a shared lock on it; returns the descriptor, or None without fcntl."""
+    if fcntl is None:
+        return None
+    fd = os.open(path, os.O_RDONLY)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    return fd
+
+
+def file_in_use(path):
+    """Return True if any process holds the shared lock `open` takes on a partition file."""
+    if fcntl is None:
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+class PartitionedConnection(sqlite3.Connection):
+    """A connection that re-attaches its archive partitions when the catalog changes.
+
+    Pass as sqlite3.connect(..., factory=PartitionedConnection). Once
+    ArchivePartitions.open has attached partitions, every statement run
+    through the connection or its cursors first calls ArchivePartitions.refresh.
+    """
+    partitions = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or PartitionedCursor)
+
+    def refresh_partitions(self):
+        if self.partitions is not None:
+            self.partitions.refresh()
+
+    def execute(self, sql, parameters=()):
+        self.refresh_partitions()
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        self.refresh_partitions()
+        return super().executemany(sql, parameters)
+
+    def close(self):
+        super().close()
+        if self.partitions is not None:
+            self.partitions.connection_closed()
+
+
+class PartitionedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        self.connection.refresh_partitions()
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        self.connection.refresh_partitions()
+        return super().executemany(sql, parameters)
+
+
+class ArchivePartitions:
+    def __init__(self, conn, db_path, partition_dir=None):
+        """Initialize the partition catalog for the database at db_path."""
+        self.conn = conn
+        # A plain cursor, so the catalog checks do not trigger refresh themselves
+        self.cursor = conn.cursor(sqlite3.Cursor)
+        self.db_path = db_path
+        self.partition_dir = partition_dir or self.default_partition_dir(db_path)
+        self.db_name = os.path.splitext(os.path.basename(db_path))[0]
+        self.attached = []
+        # Shared-lock descriptors of the attached files
+        self.locks = []
+        # The [since, until) window of the last open, None while closed
+        self.window = None
+        self.catalog = None
+        self.data_version = None
+        try:
+            attach_limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        except AttributeError:  # Connection.getlimit needs Python 3.11
+            attach_limit = DEFAULT_ATTACH_LIMIT
+        self.max_partitions = max(1, attach_limit - RESERVED_ATTACH_SLOTS)
+        create_cold_storage(self.cursor)
+        self.create_tables()
+
+    @staticmethod
+    def default_partition_dir(db_path):
+        """Return the directory partition files live in by default: <db dir>/partitions."""
+        return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'partitions')
+
+    def create_tables(self):
+        """Create the partition catalog if it does not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archive_partitions (
+                name TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                first_month TEXT NOT NULL,
+                last_month TEXT NOT NULL,
+                donation_count INTEGER NOT NULL DEFAULT 0,
+                request_count INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+
+    def list_partitions(self, since=None, until=None):
+        """Return catalog rows, oldest first, for partitions overlapping [since, until)."""
+        query = "SELECT * FROM archive_partitions WHERE 1 = 1"
+        params = []
+        if since:
+            query += " AND last_month >= ?"
+            params.append(month_of(since))
+        if until:
+            # until is exclusive, so a bound at midnight on the 1st ends with the previous month
+            last = until if isinstance(until, datetime) else datetime.fromisoformat(str(until))
+            query += " AND first_month <= ?"
+            params.append(month_of(last - timedelta(microseconds=1)))
+        self.cursor.execute(query + " ORDER BY first_month", params)
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def open(self, since=None, until=None):
+        """Attach the partitions overlapping [since, until) and point the *_all views at them.
+
+        Must be called outside a transaction. Without a window every partition
+        is attached and the views cover the full history.
+        """
+        self.close()
+        self.window = (since, until)
+        since = format_bound(since)
+        until = format_bound(until)
+        self.data_version = self._data_version()
+        partitions = self.list_partitions(since, until)
+        self.catalog = self.catalog_version()
+
+        for i, partition in enumerate(partitions):
+            schema = f"archive_{i}"
+            path = os.path.join(self.partition_dir, partition['filename'])
+            self.cursor.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            self.attached.append(schema)
+            self.locks.append(lock_shared(path))
+
+        if self.catalog_version() != self.catalog:
+            # Compacted while attaching: a merged file may be gone already
+            return self.open(*self.window)
+
+        window = []
+        if since:
+            window.append(f"created_at >= '{since}'")
+        if until:
+            window.append(f"created_at < '{until}'")
+        where = f" WHERE {' AND '.join(window)}" if window else ""
+
+        for view, fields, hot, staged in (
+            ('donations_all', DONATION_FIELDS, 'donations', 'donations_archive'),
+            ('requests_all', REQUEST_FIELDS, 'requests', 'requests_archive')
+        ):
+            branches = [f"SELECT {fields} FROM main.{hot}{where}", f"SELECT {fields} FROM main.{staged}{where}"]
+            branches += [f"SELECT {fields} FROM {schema}.{hot}{where}" for schema in self.attached]
+            self.cursor.execute(f"DROP VIEW IF EXISTS temp.{view}")
+            self.cursor.execute(f"CREATE TEMP VIEW {view} AS " + " UNION ALL ".join(branches))
+        if isinstance(self.conn, PartitionedConnection):
+            self.conn.partitions = self
+        return [partition['name'] for partition in partitions]
+
+    def refresh(self):
+        """Re-attach the partitions if the catalog changed since `open`. Returns True if it did.
+
+        Checking costs a PRAGMA data_version unless another connection has
+        committed since the last check. Skipped inside a transaction, where
+        SQLite cannot detach; and if a partition is still being read by an
+        unfinished statement, the views fall back to the hot and staged rows
+        until a later refresh succeeds.
+        """
+        if self.window is None or self.conn.in_transaction:
+            return False
+        data_version = self._data_version()
+        if data_version == self.data_version:
+            return False
+        self.data_version = data_version
+        if self.catalog_version() == self.catalog:
+            return False
+        window = self.window
+        try:
+            self.open(*window)
+        except sqlite3.OperationalError:
+            # Retried on the next check
+            self.window = window
+            self.data_version = None
+            if isinstance(self.conn, PartitionedConnection):
+                self.conn.partitions = self
+            return False
+        return True
+
+    def catalog_version(self):
+        """Return a value that changes whenever partitions are added, merged or removed."""
+        self.cursor.execute("SELECT name, filename, first_month, last_month FROM archive_partitions ORDER BY name")
+        return [tuple(row) for row in self.cursor.fetchall()]
+
+    def _data_version(self):
+        self.cursor.execute("PRAGMA data_version")
+        return self.cursor.fetchone()[0]
+
+    def close(self):
+        """Drop the partition views and detach every attached partition."""
+        if isinstance(self.conn, PartitionedConnection) and self.conn.partitions is self:
+            self.conn.partitions = None
+        self.window = None
+        # Without the TEMP views queries read the main views over the hot and staged rows
+        self.cursor.execute("DROP VIEW IF EXISTS temp.donations_all")
+        self.cursor.execute("DROP VIEW IF EXISTS temp.requests_all")
+        while self.attached:
+            self.cursor.execute(f"DETACH DATABASE {self.attached[-1]}")
+            self.attached.pop()
+            fd = self.locks.pop()
+            if fd is not None:
+                os.close(fd)
+
+    def connection_closed(self):
+        """Forget the partitions of a closed connection and release their file locks."""
+        self.attached = []
+        self.window = None
+        while self.locks:
+            fd = self.locks.pop()
+            if fd is not None:
+                os.close(fd)
+
+    def flush(self):
+        """Move staged archive rows into their monthly partition files.
+
+        Each month moves in one transaction across the main database and its
+        partition. Returns {month: (donations, requests)} for the months moved.
+        """
+        self.remove_retired()
+        self.cursor.execute(
+            """
+            SELECT strftime('%Y-%m', created_at) as month FROM donations_archive WHERE created_at IS NOT NULL
+            UNION
+            SELECT strftime('%Y-%m', created_at) as month FROM requests_archive WHERE created_at IS NOT NULL
+            ORDER BY month
+            """
+        )
+        months = [row['month'] for row in self.cursor.fetchall() if row['month']]
+
+        moved = {}
+        for month in months:
+            partition = self._partition_for(month)
+            with self._attached(partition['filename']) as schema:
+                counts = []
+                for hot, staged, fields in (
+                    ('donations', 'donations_archive', DONATION_FIELDS),
+                    ('requests', 'requests_archive', REQUEST_FIELDS)
+                ):
+                    self.cursor.execute(
+                        f"""
+                        INSERT OR REPLACE INTO {schema}.{hot} ({fields}, archived_at)
+                        SELECT {fields}, archived_at FROM main.{staged}
+                        WHERE strftime('%Y-%m', created_at) = ?
+                        """,
+                        (month,)
+                    )
+                    self.cursor.execute(
+                        f"DELETE FROM main.{staged} WHERE strftime('%Y-%m', created_at) = ?",
+                        (month,)
+                    )
+                    counts.append(self.cursor.rowcount)
+                self._update_counts(partition['name'], schema)
+                self.conn.commit()
+            moved[month] = tuple(counts)
+
+        self.compact()
+        if self.window is not None:
+            # PRAGMA data_version only reflects other connections' commits
+            self.open(*self.window)
+        return moved
+
+    def compact(self):
+        """Merge the oldest partitions into one range partition while there are too many to attach."""
+        partitions = self.list_partitions()
+        if len(partitions) <= self.max_partitions:
+            return None
+
+        merged = partitions[:len(partitions) - self.max_partitions + 1]
+        name = f"{merged[0]['first_month']}_{merged[-1]['last_month']}"
+        filename = f"{self.db_name}-{name}.sqlite"
+        with self._attached(filename) as target:
+            for partition in merged:
+                with self._attached(partition['filename'], 'archive_source') as source:
+                    for table, fields in (('donations', DONATION_FIELDS), ('requests', REQUEST_FIELDS)):
+                        self.cursor.execute(
+                            f"""
+                            INSERT OR REPLACE INTO {target}.{table} ({fields}, archived_at)
+                            SELECT {fields}, archived_at FROM {source}.{table}
+                            """
+                        )
+                    self.conn.commit()
+
+            self.cursor.executemany(
+                "DELETE FROM archive_partitions WHERE name = ?",
+                [(partition['name'],) for partition in merged]
+            )
+            self.cursor.execute(
+                """
+                INSERT INTO archive_partitions (name, filename, first_month, last_month)
+                VALUES (?, ?, ?, ?)
+                """,
+                (name, filename, merged[0]['first_month'], merged[-1]['last_month'])
+            )
+            self._update_counts(name, target)
+            self.conn.commit()
+
+        # Connections that still have the merged files attached keep reading them until they refresh
+        self.remove_retired()
+        return name
+
+    def remove_retired(self):
+        """Delete partition files that are no longer catalogued and no connection has attached.
+
+        Returns the names of the files removed; the others are retried on the
+        next flush or compaction.
+        """
+        if not os.path.isdir(self.partition_dir):
+            return []
+        catalogued = {partition['filename'] for partition in self.list_partitions()}
+        pattern = re.compile(re.escape(self.db_name) + r'-\d{4}-\d{2}(_\d{4}-\d{2})?\.sqlite')
+        removed = []
+        for filename in sorted(os.listdir(self.partition_dir)):
+            if filename in catalogued or not pattern.fullmatch(filename):
+                continue
+            path = os.path.join(self.partition_dir, filename)
+            try:
+                if file_in_use(path):
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            removed.append(filename)
+        return removed
+
+    def migrate(self):
+        """Bring every partition file's tables and indexes up to the current schema.
+
+        Partitions are otherwise only migrated when flush or compact next
+        writes to them. Must be called outside a transaction.
+        """
+        for partition in self.list_partitions():
+            with self._attached(partition['filename']):
+                self.conn.commit()
+
+    def _partition_for(self, month):
+        """Return the catalog row covering month, creating a monthly partition if none does."""
+        self.cursor.execute(
+            "SELECT * FROM archive_partitions WHERE first_month <= ? AND last_month >= ?",
+            (month, month)
+        )
+        row = self.cursor.fetchone()
+        if row:
+            return dict(row)
+
+        partition = {
+            "name": month,
+            "filename": f"{self.db_name}-{month}.sqlite",
+            "first_month": month,
+            "last_month": month
+        }
+        self.cursor.execute(
+            "INSERT INTO archive_partitions (name, filename, first_month, last_month) VALUES (?, ?, ?, ?)",
+            (partition['name'], partition['filename'], month, month)
+        )
+        self.conn.commit()
+        return partition
+
+    def _update_counts(self, name, schema):
+        """Refresh a partition's row counts in the catalog from its attached file."""
+        self.cursor.execute(
+            f"""
+            UPDATE archive_partitions SET
+                donation_count = (SELECT COUNT(*) FROM {schema}.donations),
+                request_count = (SELECT COUNT(*) FROM {schema}.requests),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE name = ?
+            """,
+            (name,)
+        )
+
+    @contextmanager
+    def _attached(self, filename, schema='archive_target'):
+        """Attach a partition file, creating its tables, for the duration of a with block."""
+        os.makedirs(self.partition_dir, exist_ok=True)
+        self.cursor.execute(f"ATTACH DATABASE ? AS {schema}", (os.path.join(self.partition_dir, filename),))
+        try:
+            create_archive_tables(self.cursor, schema, 'donations', 'requests')
+            yield schema
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.cursor.execute(f"DETACH DATABASE {schema}")
+
+
+# Archive maintenance entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage monthly archive partitions.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database")
+    parser.add_argument('--partition-dir', help="Directory for partition files (default: partitions/ next to the database)")
+    parser.add_argument('--flush', action='store_true', help="Move staged archive rows into monthly partitions")
+    parser.add_argument('--list', action='store_true', help="List partitions")
+    parser.add_argument('--migrate', action='store_true', help="Apply the current table and index schema to every partition")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    partitions = ArchivePartitions(conn, args.db, args.partition_dir)
+
+    if args.flush:
+        for month, (donations, requests) in partitions.flush().items():
+            print(f"Archived {donations} donations and {requests} requests from {month}")
+    if args.migrate:
+        partitions.migrate()
+        print("Partitions migrated")
+    if args.list or not (args.flush or args.migrate):
+        for partition in partitions.list_partitions():
+            print(f"{partition['name']}: {partition['donation_count']} donations, "
+                  f"{partition['request_count']} requests ({partition['filename']})")
+    conn.close()
@@ -0,0 +1,256 @@
+"""
+AvailabilityFeed: Push donation availability changes to the socket layer.
+
+Clients otherwise learn about new, reserved, expired and deleted donations
+only by re-fetching `/donations`, which re-runs the full listing query. The
+feed is a change-log consumer: once per tick it reads the donation events
+written since its offset (by the agents, the Node backend or the expiry
+sweeper), coalesces them to one delta per donation and publishes the batch as
+a single newline-delimited JSON message on a local Unix socket. The Node server
+subscribes to that socket and re-emits each batch to its Socket.IO clients,
+which apply the deltas to the list they already hold.
+
+Coalescing keeps only each donation's final state in the tick. A donation
+that was created and reserved within the same tick is never sent, because no
+client has seen it. A batch is published before the offset is committed, so
+after a crash the last batch may be sent again; clients can ignore batches
+whose offset is not past the last one they applied. Every subscriber gets a
+`hello` message with the current offset on connect, which is the point to
+fetch the full list once.
+
+The socket lives next to the database (database/foodcycle-availability.sock
+by default), not in a world-writable directory such as /tmp where any local
+user could bind it or inject lines.
+
+Run the feed next to the Node server with:
+    python agents/availabilityFeed.py --db database/foodcycle.sqlite
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import stat
+import sys
+import time
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.changeLog import ChangeLog
+
+CONSUMER = 'availability_feed'
+
+# Socket file name, created in the database's directory
+SOCKET_NAME = 'foodcycle-availability.sock'
+# Seconds between polls of the change log; also the longest a delta waits
+DEFAULT_TICK_SECONDS = 0.25
+# Seconds a subscriber may block a send before it is dropped
+SEND_TIMEOUT_SECONDS = 1.0
+
+# Delta event names by final status
+STATUS_EVENTS = {
+    'available': 'available',
+    'reserved': 'reserved',
+    'completed': 'completed',
+    'expired': 'expired',
+    'deleted': 'deleted'
+}
+
+
+def default_socket_path(db_path):
+    """Return the feed's socket path in the directory of the database at db_path."""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), SOCKET_NAME)
+
+
+def remove_stale_socket(path):
+    """Remove a socket left behind at path by a feed that is no longer running.
+
+    Raises OSError if path is not a socket or another process is still
+    listening on it.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"Another process is listening on {path}")
+
+
+class UnixSocketPublisher:
+    """Fan newline-delimited JSON messages out to every process connected to a Unix socket."""
+
+    def __init__(self, path):
+        self.path = path
+        remove_stale_socket(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.subscribers = []
+
+    def accept(self, greeting=None):
+        """Accept pending subscribers, sending each the greeting message. Returns the number accepted."""
+        accepted = 0
+        while True:
+            try:
+                subscriber, _ = self.server.accept()
+            except BlockingIOError:
+                return accepted
+            subscriber.settimeout(SEND_TIMEOUT_SECONDS)
+            if greeting is None or self._send(subscriber, greeting):
+                self.subscribers.append(subscriber)
+                accepted += 1
+
+    def publish(self, message):
+        """Send a message to every subscriber, dropping any that have gone away or stalled."""
+        self.subscribers = [s for s in self.subscribers if self._send(s, message)]
+
+    def _send(self, subscriber, message):
+        try:
+            subscriber.sendall(json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n')
+            return True
+        except OSError:
+            subscriber.close()
+            return False
+
+    def close(self):
+        for subscriber in self.subscribers:
+            subscriber.close()
+        self.subscribers = []
+        self.server.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class AvailabilityFeed:
+    def __init__(self, conn):
+        """Initialize the feed on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        if self.changes.get_offset(CONSUMER) is None:
+            # Start from now: a new subscriber fetches the full list on hello anyway
+            self.changes.set_offset(CONSUMER, self.changes.head())
+            self.conn.commit()
+
+    def offset(self):
+        return self.changes.get_offset(CONSUMER)
+
+    def pending_deltas(self):
+        """Return (deltas, last offset) for the donation events since the feed's offset.
+
+        Does not advance the offset; call `commit` once the deltas are published.
+        """
+        final = {}
+        created = set()
+        last_offset = self.offset()
+        for event in self.changes.read(last_offset, limit=-1, table_name='donations'):
+            final[event['row_id']] = 'deleted' if event['operation'] == 'delete' else event['new_status']
+            if event['operation'] == 'insert':
+                created.add(event['row_id'])
+            last_offset = event['offset']
+
+        # Created and taken within one tick: no client has seen it
+        changed = {
+            donation_id: status for donation_id, status in final.items()
+            if status == 'available' or donation_id not in created
+        }
+        if not changed:
+            return [], last_offset
+
+        available_ids = [donation_id for donation_id, status in changed.items() if status == 'available']
+        rows = {}
+        if available_ids:
+            # Same columns as the /donations listing, so clients can insert the row as is
+            self.cursor.execute(
+                f"""
+                SELECT d.*, u.name as donor_name
+                FROM donations d
+                JOIN users u ON d.donor_id = u.id
+                WHERE d.id IN ({','.join('?' * len(available_ids))}) AND d.status = 'available'
+                """,
+                available_ids
+            )
+            rows = {row['id']: dict(row) for row in self.cursor.fetchall()}
+
+        deltas = []
+        for donation_id in sorted(changed):
+            status = changed[donation_id]
+            if status == 'available':
+                if donation_id not in rows:
+                    # Taken after the events were read; the next tick carries its new status
+                    continue
+                event = 'created' if donation_id in created else 'available'
+                deltas.append({"event": event, "id": donation_id, "donation": rows[donation_id]})
+            else:
+                deltas.append({"event": STATUS_EVENTS.get(status, status), "id": donation_id})
+        return deltas, last_offset
+
+    def commit(self, offset):
+        """Record that every event up to offset has been published."""
+        self.changes.set_offset(CONSUMER, offset)
+        self.conn.commit()
+
+    def tick(self, publisher):
+        """Publish one coalesced batch if anything changed. Returns the number of deltas sent."""
+        publisher.accept({"type": "hello", "offset": self.offset()})
+        deltas, last_offset = self.pending_deltas()
+        if deltas:
+            publisher.publish({"type": "donation_availability", "offset": last_offset, "deltas": deltas})
+        if last_offset != self.offset():
+            self.commit(last_offset)
+        return len(deltas)
+
+    def run(self, publisher, tick_seconds=DEFAULT_TICK_SECONDS):
+        """Publish batches every tick until interrupted."""
+        while True:
+            started = time.monotonic()
+            try:
+                self.tick(publisher)
+            except sqlite3.Error as e:
+                # Usually a busy database; the events are retried next tick
+                self.conn.rollback()
+                print(f"Availability feed error: {e}")
+            time.sleep(max(0.0, tick_seconds - (time.monotonic() - started)))
+
+
+# Feed entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish donation availability deltas to the socket layer.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database path")
+    parser.add_argument('--socket', help=f"Unix socket to publish on (default: {SOCKET_NAME} next to the database)")
+    parser.add_argument('--tick', type=float, default=DEFAULT_TICK_SECONDS, help="Seconds between batches")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    socket_path = args.socket or default_socket_path(args.db)
+    try:
+        publisher = UnixSocketPublisher(socket_path)
+    except OSError as e:
+        print(f"Availability feed error: {e}")
+        conn.close()
+        sys.exit(1)
+    try:
+        feed = AvailabilityFeed(conn)
+        print(f"Publishing donation availability on {socket_path} every {args.tick}s")
+        feed.run(publisher, args.tick)
+    except KeyboardInterrupt:
+        pass
+    except sqlite3.Error as e:
+        print(f"Availability feed error: {e}")
+    finally:
+        publisher.close()
+        conn.close()
@@ -0,0 +1,127 @@
+"""
+Bulk suggestions: Every donor's suggestions and recommendations in one pass.
+
+Calling `DonorAgent.generate_suggestions` and
+`RecommendationAgent.generate_donor_recommendations` once per donor re-runs
+the same community-wide queries (pending needs, expiring-soon count, supply
+forecasts, supply/demand gap, trends) for every donor, plus a history query
+or two per donor. This job computes the community context once. It then
+reads every donor's donations in a single scan ordered by
+(donor_id, created_at DESC), builds each donor's profile and recent foods as
+their rows stream past, and writes one JSON line per donor:
+
+    {"donor_id": ..., "patterns": ..., "suggestions": [...], "recommendations": [...]}
+
+Memory is bounded by one donor's history. Each line is written as soon as
+its donor's rows have been read. Registered donors without any donations are
+merged into the stream and get the first-time suggestion. Profiles are
+derived from the scan and not written back, so the job only reads.
+
+Write the weekly digest input with:
+    python agents/bulkSuggestions.py --db database/foodcycle.sqlite --out suggestions.jsonl
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import time
+from itertools import groupby
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.donorAgent import DonorAgent
+from agents.donorProfiles import profile_from_history
+from agents.recommendationAgent import RecommendationAgent
+
+# Rows fetched from each cursor at a time
+FETCH_SIZE = 1000
+# Recent donations used for diversification, as in generate_donor_recommendations
+RECENT_DONATIONS = 10
+
+
+def stream_rows(cursor):
+    """Yield a cursor's rows, fetched FETCH_SIZE at a time."""
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def donor_histories(conn):
+    """Yield (donor_id, donations newest first) for every donor, in donor_id order.
+
+    Registered donors without donations are yielded with an empty list.
+    """
+    donations = conn.cursor()
+    donations.execute(
+        """
+        SELECT donor_id, id, food_name, created_at
+        FROM donations_all
+        ORDER BY donor_id, created_at DESC, id DESC
+        """
+    )
+    donors = conn.cursor()
+    donors.execute("SELECT id as donor_id FROM users WHERE user_type = 'donor' ORDER BY id")
+
+    # A donor's donation rows sort before their users row, which is then skipped
+    merged = heapq.merge(
+        ((row['donor_id'], 0, row) for row in stream_rows(donations)),
+        ((row['donor_id'], 1, None) for row in stream_rows(donors)),
+        key=lambda item: item[:2]
+    )
+    for donor_id, items in groupby(merged, key=lambda item: item[0]):
+        yield donor_id, [row for _, _, row in items if row is not None]
+
+
+def generate_all_suggestions(donor_agent, recommendation_agent, out):
+    """Write every donor's suggestions and recommendations to out as JSON lines. Returns the donor count."""
+    with recommendation_agent.memo.scope():
+        # Community-wide inputs, computed once for all donors
+        suggestion_context = donor_agent.community_context()
+        recommendation_context = recommendation_agent.donor_recommendation_context()
+
+        count = 0
+        for donor_id, rows in donor_histories(donor_agent.conn):
+            patterns = donor_agent.patterns_from_profile(profile_from_history(donor_id, rows))
+            suggestions = donor_agent.build_suggestions(
+                donor_id, patterns, suggestion_context, donor_agent.forecast_next_donation(donor_id)
+            )
+            recommendations = recommendation_agent.build_donor_recommendations(
+                recommendation_context, [row['food_name'] for row in rows[:RECENT_DONATIONS]]
+            )
+            suggestions["recommendations"] = recommendations["recommendations"]
+            out.write(json.dumps(suggestions, separators=(',', ':')) + '\n')
+            count += 1
+        return count
+
+
+# Bulk job entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate every donor's suggestions as JSON lines.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database path")
+    parser.add_argument('--out', default='-', help="Output file, or - for stdout")
+    args = parser.parse_args()
+
+    # The agents report progress with print; keep stdout for the JSON lines
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    donor_agent = DonorAgent(args.db)
+    recommendation_agent = RecommendationAgent(args.db)
+    out = stdout if args.out == '-' else open(args.out, 'w')
+    try:
+        start = time.perf_counter()
+        count = generate_all_suggestions(donor_agent, recommendation_agent, out)
+        print(f"Wrote suggestions for {count} donors in {time.perf_counter() - start:.2f}s")
+    except sqlite3.Error as e:
+        print(f"Bulk suggestion error: {e}")
+    finally:
+        if out is not stdout:
+            out.close()
+        donor_agent.close_connection()
+        recommendation_agent.close_connection()
@@ -0,0 +1,116 @@
+"""
+DonationCategoryCounts: Maintained per-category donation counts.
+
+Keeps, for the extended food taxonomy, the number of donations per category
+overall ('all') and currently available ('available'). Counts advance from
+the change log, so community-needs and trend reports read a few rows instead
+of categorizing every donation on each call.
+"""
+
+from agents.changeLog import ChangeLog
+from agents.foodCategories import categorize_extended
+
+CONSUMER = 'donation_category_counts'
+SCOPES = ('all', 'available')
+
+
+class DonationCategoryCounts:
+    def __init__(self, conn):
+        """Initialize the counts on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        self.create_table()
+
+    def create_table(self):
+        """Create the donation_category_counts table if it does not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS donation_category_counts (
+                scope TEXT NOT NULL,
+                category TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (scope, category)
+            )
+            """
+        )
+
+    def counts(self, scope='all', sync=True):
+        """Return {category: donation count} for a scope, most common first.
+
+        With sync=False the stored counts are read as they are, e.g. on a
+        read-only replica. The caller is responsible for committing the
+        catch-up writes.
+        """
+        if sync:
+            self.sync()
+        self.cursor.execute(
+            """
+            SELECT category, count FROM donation_category_counts
+            WHERE scope = ? AND count > 0
+            ORDER BY count DESC
+            """,
+            (scope,)
+        )
+        return {row['category']: row['count'] for row in self.cursor.fetchall()}
+
+    def sync(self):
+        """Apply donation events from the change log. Returns the number of events read."""
+        if self.changes.get_offset(CONSUMER) is None:
+            self.rebuild()
+            return 0
+        return self.changes.consume(CONSUMER, self._apply_events, table_name='donations')
+
+    def _apply_events(self, events):
+        """Adjust counts for a batch of donation insert, status and delete events."""
+        # Rows deleted later in the batch still need their food name
+        rows = self.changes.rows('donations', 'id, food_name', {event['row_id'] for event in events},
+                                 events[0]['offset'] - 1)
+        food_names = {row['id']: row['food_name'] for row in rows}
+
+        deltas = {}
+        for event in events:
+            food_name = food_names.get(event['row_id'])
+            if food_name is None:
+                continue
+            category = categorize_extended(food_name)
+
+            if event['operation'] == 'insert':
+                deltas[('all', category)] = deltas.get(('all', category), 0) + 1
+                if event['new_status'] == 'available':
+                    deltas[('available', category)] = deltas.get(('available', category), 0) + 1
+            elif event['operation'] == 'delete':
+                deltas[('all', category)] = deltas.get(('all', category), 0) - 1
+                if event['old_status'] == 'available':
+                    deltas[('available', category)] = deltas.get(('available', category), 0) - 1
+            elif event['old_status'] == 'available':
+                deltas[('available', category)] = deltas.get(('available', category), 0) - 1
+            elif event['new_status'] == 'available':
+                deltas[('available', category)] = deltas.get(('available', category), 0) + 1
+
+        self.cursor.executemany(
+            """
+            INSERT INTO donation_category_counts (scope, category, count) VALUES (?, ?, ?)
+            ON CONFLICT (scope, category) DO UPDATE SET count = count + excluded.count
+            """,
+            [(scope, category, delta) for (scope, category), delta in deltas.items() if delta]
+        )
+
+    def rebuild(self):
+        """Recount every scope from the donations table and reset the log offset."""
+        # Deleting first takes the write lock, so the log head matches the rows read below
+        self.cursor.execute("DELETE FROM donation_category_counts")
+        self.changes.set_offset(CONSUMER, self.changes.head())
+
+        self.cursor.execute("SELECT food_name, status FROM donations_all")
+        counts = {}
+        for row in self.cursor.fetchall():
+            category = categorize_extended(row['food_name'])
+            counts[('all', category)] = counts.get(('all', category), 0) + 1
+            if row['status'] == 'available':
+                counts[('available', category)] = counts.get(('available', category), 0) + 1
+
+        self.cursor.executemany(
+            "INSERT INTO donation_category_counts (scope, category, count) VALUES (?, ?, ?)",
+            [(scope, category, count) for (scope, category), count in counts.items()]
+        )
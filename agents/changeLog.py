@@ -0,0 +1,415 @@
+"""
+ChangeLog: Append-only change-data-capture log of donation and request changes.
+
+SQLite triggers append an event for every insert into `donations` or
+`requests`, for every status transition and for every delete, so writes from
+any process (the Python agents or the Node backend) are captured. Derived
+stores register as named consumers and advance from their last committed
+offset, which makes keeping them fresh cost O(changes) instead of O(table).
+
+A delete event carries the deleted row as JSON in `row_data`, since the row
+can no longer be read. Rows moved into the cold archive are not deleted as
+far as the log is concerned: they stay visible through the *_all views, so
+no event is written for them. `rows` reads the rows a batch refers to from
+the views and, for rows deleted since, from their delete events.
+`request_transitions` turns a batch into changes of the requests-donations
+join, so consumers of the join also drop the requests of a deleted donation.
+
+Prune events every consumer has already processed with:
+    python agents/changeLog.py --db database/foodcycle.sqlite --prune
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.coldStorage import DONATION_FIELDS, REQUEST_FIELDS, create_archive_tables
+
+# Tracked table: the columns recorded for a deleted row
+TRACKED_TABLES = {
+    'donations': DONATION_FIELDS,
+    'requests': REQUEST_FIELDS
+}
+
+
+def columns(fields):
+    """Split a comma-separated field list into column names."""
+    return [field.strip() for field in fields.split(',')]
+
+
+class ChangeLog:
+    def __init__(self, conn):
+        """Initialize the change log on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.install()
+
+    def install(self):
+        """Create the log tables and capture triggers if they do not exist."""
+        self.migrate()
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS change_log (
+                offset INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                operation TEXT CHECK(operation IN ('insert', 'status', 'delete')) NOT NULL,
+                old_status TEXT,
+                new_status TEXT,
+                row_data TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        # Finds the later events of a row when rolling it back to an earlier offset
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_id, offset)"
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS change_log_consumers (
+                consumer TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        # The delete triggers tell archiving from deleting by the archive tables
+        create_archive_tables(self.cursor)
+        for table, fields in TRACKED_TABLES.items():
+            self.cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS change_log_{table}_insert
+                AFTER INSERT ON {table}
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, operation, new_status)
+                    VALUES ('{table}', NEW.id, 'insert', NEW.status);
+                END
+                """
+            )
+            self.cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS change_log_{table}_status
+                AFTER UPDATE OF status ON {table}
+                WHEN OLD.status IS NOT NEW.status
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, operation, old_status, new_status)
+                    VALUES ('{table}', NEW.id, 'status', OLD.status, NEW.status);
+                END
+                """
+            )
+            row_json = ', '.join(f"'{column}', OLD.{column}" for column in columns(fields))
+            self.cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS change_log_{table}_delete
+                AFTER DELETE ON {table}
+                WHEN NOT EXISTS (SELECT 1 FROM {table}_archive WHERE id = OLD.id)
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, operation, old_status, row_data)
+                    VALUES ('{table}', OLD.id, 'delete', OLD.status, json_object({row_json}));
+                END
+                """
+            )
+
+    def migrate(self):
+        """Rebuild a change_log created before delete events, keeping its events and offsets.
+
+        SQLite cannot alter a CHECK constraint, so the table is recreated. The
+        triggers that write to it are dropped first and recreated by install.
+        """
+        self.cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'change_log'")
+        row = self.cursor.fetchone()
+        if row is None or "'delete'" in row['sql']:
+            return
+
+        self.cursor.execute("SAVEPOINT change_log_migration")
+        try:
+            for table in TRACKED_TABLES:
+                for operation in ('insert', 'status', 'delete'):
+                    self.cursor.execute(f"DROP TRIGGER IF EXISTS change_log_{table}_{operation}")
+            # Another process may have migrated the table before the write lock was taken
+            self.cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'change_log'")
+            if "'delete'" not in self.cursor.fetchone()['sql']:
+                # Dropping the table drops its AUTOINCREMENT high-water mark, so keep it
+                head = self.head()
+                self.cursor.execute("ALTER TABLE change_log RENAME TO change_log_migrating")
+                self.cursor.execute(
+                    """
+                    CREATE TABLE change_log (
+                        offset INTEGER PRIMARY KEY AUTOINCREMENT,
+                        table_name TEXT NOT NULL,
+                        row_id INTEGER NOT NULL,
+                        operation TEXT CHECK(operation IN ('insert', 'status', 'delete')) NOT NULL,
+                        old_status TEXT,
+                        new_status TEXT,
+                        row_data TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                    """
+                )
+                self.cursor.execute(
+                    """
+                    INSERT INTO change_log (offset, table_name, row_id, operation, old_status, new_status, created_at)
+                    SELECT offset, table_name, row_id, operation, old_status, new_status, created_at
+                    FROM change_log_migrating
+                    """
+                )
+                self.cursor.execute("DROP TABLE change_log_migrating")
+                self.cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'change_log'")
+                self.cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)", (head,))
+            self.cursor.execute("RELEASE change_log_migration")
+        except sqlite3.Error:
+            self.cursor.execute("ROLLBACK TO change_log_migration")
+            self.cursor.execute("RELEASE change_log_migration")
+            raise
+
+    def head(self):
+        """Return the offset of the newest event ever written, or 0 if none."""
+        # sqlite_sequence keeps the high-water mark even after the log is pruned
+        self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+        row = self.cursor.fetchone()
+        return row['seq'] if row else 0
+
+    def read(self, after_offset, limit=1000, table_name=None):
+        """Return up to limit events with an offset greater than after_offset."""
+        if table_name:
+            self.cursor.execute(
+                """
+                SELECT * FROM change_log
+                WHERE offset > ? AND table_name = ?
+                ORDER BY offset
+                LIMIT ?
+                """,
+                (after_offset, table_name, limit)
+            )
+        else:
+            self.cursor.execute(
+                "SELECT * FROM change_log WHERE offset > ? ORDER BY offset LIMIT ?",
+                (after_offset, limit)
+            )
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def rows(self, table_name, fields, row_ids, after_offset):
+        """Return the rows with these ids, including those deleted after after_offset.
+
+        fields is the select list; it may use any column of the table's *_all
+        view. Every row also has deleted_offset: None for a row that still
+        exists, otherwise the offset of its delete event.
+        """
+        row_ids = list(row_ids)
+        if not row_ids:
+            return []
+        placeholders = ','.join('?' * len(row_ids))
+        deleted = ', '.join(
+            f"json_extract(row_data, '$.{column}') as {column}" for column in columns(TRACKED_TABLES[table_name])
+        )
+        self.cursor.execute(
+            f"""
+            SELECT {fields}, NULL as deleted_offset FROM {table_name}_all WHERE id IN ({placeholders})
+            UNION ALL
+            SELECT {fields}, deleted_offset FROM (
+                SELECT {deleted}, offset as deleted_offset FROM change_log
+                WHERE table_name = ? AND operation = 'delete' AND offset > ? AND row_id IN ({placeholders})
+            )
+            """,
+            [*row_ids, table_name, after_offset, *row_ids]
+        )
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def deleted_rows(self, table_name, fields, where, params, after_offset):
+        """Return rows deleted after after_offset whose recorded data matches a condition.
+
+        where is an SQL condition over the table's columns, as in `rows`.
+        """
+        deleted = ', '.join(
+            f"json_extract(row_data, '$.{column}') as {column}" for column in columns(TRACKED_TABLES[table_name])
+        )
+        self.cursor.execute(
+            f"""
+            SELECT {fields}, deleted_offset FROM (
+                SELECT {deleted}, offset as deleted_offset FROM change_log
+                WHERE table_name = ? AND operation = 'delete' AND offset > ?
+            )
+            WHERE {where}
+            """,
+            [table_name, after_offset, *params]
+        )
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def as_of(self, table_name, rows, offset):
+        """Return rows as they were right after offset.
+
+        rows are dicts with id, status and deleted_offset (see `rows`). Rows
+        inserted after offset or deleted by then are left out; the others get
+        the status they had at offset.
+        """
+        rows = [row for row in rows if row['deleted_offset'] is None or row['deleted_offset'] > offset]
+        if not rows:
+            return []
+        row_ids = [row['id'] for row in rows]
+        self.cursor.execute(
+            f"""
+            SELECT row_id, operation, old_status FROM change_log
+            WHERE table_name = ? AND row_id IN ({','.join('?' * len(row_ids))}) AND offset > ?
+            ORDER BY offset
+            """,
+            [table_name, *row_ids, offset]
+        )
+        first = {}
+        for event in self.cursor.fetchall():
+            first.setdefault(event['row_id'], event)
+
+        result = []
+        for row in rows:
+            event = first.get(row['id'])
+            if event is None:
+                result.append(row)
+            elif event['operation'] != 'insert':
+                result.append(dict(row, status=event['old_status']))
+        return result
+
+    def request_transitions(self, events, donation_fields='id'):
+        """Return how a batch of events changed the requests joined with their donations.
+
+        A request counts towards a requests-donations join while both rows
+        exist. Returns [(event, request, donation, old_status, new_status)] in
+        event order, where old_status is the request's status before the
+        event and new_status after it, None meaning it was not in the join.
+        Request events on a donation already deleted do not change the join;
+        deleting a donation takes out every request it had at that point.
+        donation_fields is the donation select list and must include id.
+        """
+        if not events:
+            return []
+        after_offset = events[0]['offset'] - 1
+        requests = self.rows(
+            'requests', REQUEST_FIELDS,
+            {e['row_id'] for e in events if e['table_name'] == 'requests'}, after_offset
+        )
+        requests = {row['id']: row for row in requests}
+
+        deletes = [e for e in events if e['table_name'] == 'donations' and e['operation'] == 'delete']
+        lost = {}
+        if deletes:
+            # Requests on the deleted donations, including requests deleted since
+            donation_ids = list({e['row_id'] for e in deletes})
+            placeholders = ','.join('?' * len(donation_ids))
+            self.cursor.execute(
+                f"SELECT {REQUEST_FIELDS}, NULL as deleted_offset FROM requests_all WHERE donation_id IN ({placeholders})",
+                donation_ids
+            )
+            candidates = [dict(row) for row in self.cursor.fetchall()]
+            candidates += self.deleted_rows(
+                'requests', REQUEST_FIELDS, f"donation_id IN ({placeholders})", donation_ids, after_offset
+            )
+            for event in deletes:
+                on_donation = [row for row in candidates if row['donation_id'] == event['row_id']]
+                lost[event['offset']] = self.as_of('requests', on_donation, event['offset'])
+
+        donations = self.rows(
+            'donations', donation_fields,
+            {row['donation_id'] for row in requests.values()} | {e['row_id'] for e in deletes}, after_offset
+        )
+        donations = {row['id']: row for row in donations}
+
+        transitions = []
+        for event in events:
+            if event['table_name'] == 'donations':
+                if event['operation'] == 'delete' and event['row_id'] in donations:
+                    donation = donations[event['row_id']]
+                    transitions += [(event, request, donation, request['status'], None)
+                                    for request in lost[event['offset']]]
+                continue
+
+            request = requests.get(event['row_id'])
+            donation = donations.get(request['donation_id']) if request else None
+            if donation is None or (donation['deleted_offset'] is not None
+                                    and donation['deleted_offset'] < event['offset']):
+                continue
+            if event['operation'] == 'insert':
+                transitions.append((event, request, donation, None, event['new_status']))
+            elif event['operation'] == 'status':
+                transitions.append((event, request, donation, event['old_status'], event['new_status']))
+            else:
+                transitions.append((event, request, donation, event['old_status'], None))
+        return transitions
+
+    def get_offset(self, consumer):
+        """Return a consumer's last processed offset, or None if it is not registered."""
+        self.cursor.execute(
+            "SELECT offset FROM change_log_consumers WHERE consumer = ?",
+            (consumer,)
+        )
+        row = self.cursor.fetchone()
+        return row['offset'] if row else None
+
+    def set_offset(self, consumer, offset):
+        """Record that a consumer has processed every event up to offset."""
+        self.cursor.execute(
+            """
+            INSERT OR REPLACE INTO change_log_consumers (consumer, offset, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            """,
+            (consumer, offset)
+        )
+
+    def consume(self, consumer, handler, table_name=None, batch_size=1000):
+        """Feed a registered consumer every event after its offset, in batches.
+
+        handler(events) is called once per batch and the consumer's offset
+        advances after each batch. The caller is responsible for committing,
+        so handler writes and offset updates land in the same transaction.
+        Returns the number of events processed.
+        """
+        offset = self.get_offset(consumer)
+        if offset is None:
+            raise ValueError(f"Change log consumer '{consumer}' is not registered")
+
+        processed = 0
+        while True:
+            events = self.read(offset, batch_size, table_name)
+            if not events:
+                break
+            handler(events)
+            offset = events[-1]['offset']
+            processed += len(events)
+            if len(events) < batch_size:
+                break
+
+        if processed:
+            self.set_offset(consumer, offset)
+        return processed
+
+    def prune(self):
+        """Delete events that every registered consumer has already processed."""
+        self.cursor.execute("SELECT MIN(offset) as low FROM change_log_consumers")
+        low = self.cursor.fetchone()['low']
+        if low is None:
+            return 0
+        self.cursor.execute("DELETE FROM change_log WHERE offset <= ?", (low,))
+        return self.cursor.rowcount
+
+
+# Maintenance entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or prune the change log.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database")
+    parser.add_argument('--prune', action='store_true', help="Delete events all consumers have processed")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    log = ChangeLog(conn)
+    if args.prune:
+        print(f"Pruned {log.prune()} change log events")
+    conn.commit()
+
+    print(f"Change log head: {log.head()}")
+    for row in conn.execute("SELECT consumer, offset FROM change_log_consumers ORDER BY consumer"):
+        print(f"  {row['consumer']}: {row['offset']}")
+    conn.close()
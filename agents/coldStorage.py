@@ -0,0 +1,131 @@
+"""
+Cold storage: archive tables for finished donations and requests.
+
+Old completed/expired donations and accepted/rejected requests are moved out
+of the hot `donations` and `requests` tables into `donations_archive` and
+`requests_archive`, so the tables the matching paths scan stay proportional
+to live inventory. History and analytics queries read the `donations_all`
+and `requests_all` views, which union the hot and cold rows.
+"""
+
+DONATION_FIELDS = 'id, donor_id, food_name, quantity, expiry_date, description, location, status, created_at'
+REQUEST_FIELDS = 'id, recipient_id, donation_id, status, created_at'
+
+# Statuses after which a row is never updated again
+ARCHIVABLE_DONATION_STATUSES = ('completed', 'expired')
+ARCHIVABLE_REQUEST_STATUSES = ('accepted', 'rejected')
+
+
+def create_cold_storage(cursor):
+    """Create the archive tables and the hot+cold union views if they do not exist."""
+    create_archive_tables(cursor)
+    create_union_views(cursor)
+
+
+def create_archive_tables(cursor, schema='main', donations_table='donations_archive',
+                          requests_table='requests_archive'):
+    """Create a pair of archive tables in schema; also used for attached partitions."""
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.{donations_table} (
+            id INTEGER PRIMARY KEY,
+            donor_id INTEGER NOT NULL,
+            food_name TEXT NOT NULL,
+            quantity TEXT NOT NULL,
+            expiry_date TEXT,
+            description TEXT,
+            location TEXT,
+            status TEXT,
+            created_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.{requests_table} (
+            id INTEGER PRIMARY KEY,
+            recipient_id INTEGER NOT NULL,
+            donation_id INTEGER NOT NULL,
+            status TEXT,
+            created_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    # (user, created_at) indexes let history pages seek in every branch of the *_all views
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_{donations_table}_donor_created "
+        f"ON {donations_table} (donor_id, created_at)"
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_{requests_table}_recipient_created "
+        f"ON {requests_table} (recipient_id, created_at)"
+    )
+    cursor.execute(f"DROP INDEX IF EXISTS {schema}.idx_{donations_table}_donor_id")
+    cursor.execute(f"DROP INDEX IF EXISTS {schema}.idx_{requests_table}_recipient_id")
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_{requests_table}_donation_id ON {requests_table} (donation_id)"
+    )
+
+
+def create_union_views(cursor):
+    """Create the donations_all and requests_all views over hot and cold rows."""
+    cursor.execute(
+        f"""
+        CREATE VIEW IF NOT EXISTS donations_all AS
+        SELECT {DONATION_FIELDS} FROM donations
+        UNION ALL
+        SELECT {DONATION_FIELDS} FROM donations_archive
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE VIEW IF NOT EXISTS requests_all AS
+        SELECT {REQUEST_FIELDS} FROM requests
+        UNION ALL
+        SELECT {REQUEST_FIELDS} FROM requests_archive
+        """
+    )
+
+
+def drop_union_views(cursor):
+    """Drop the union views, e.g. while a base table is being rebuilt."""
+    cursor.execute("DROP VIEW IF EXISTS donations_all")
+    cursor.execute("DROP VIEW IF EXISTS requests_all")
+
+
+def archive_batch(cursor, table, older_than, batch_size=500):
+    """Move up to batch_size finished rows created before older_than into the archive.
+
+    table is 'donations' or 'requests'. The caller is responsible for
+    committing. Returns the number of rows moved.
+    """
+    if table == 'donations':
+        fields, statuses = DONATION_FIELDS, ARCHIVABLE_DONATION_STATUSES
+    elif table == 'requests':
+        fields, statuses = REQUEST_FIELDS, ARCHIVABLE_REQUEST_STATUSES
+    else:
+        raise ValueError(f"Cannot archive table: {table}")
+
+    status_placeholders = ','.join('?' * len(statuses))
+    cursor.execute(
+        f"""
+        SELECT id FROM {table}
+        WHERE status IN ({status_placeholders}) AND created_at < ?
+        ORDER BY id
+        LIMIT ?
+        """,
+        (*statuses, older_than, batch_size)
+    )
+    ids = [row['id'] for row in cursor.fetchall()]
+    if not ids:
+        return 0
+
+    id_placeholders = ','.join('?' * len(ids))
+    cursor.execute(
+        f"INSERT INTO {table}_archive ({fields}) SELECT {fields} FROM {table} WHERE id IN ({id_placeholders})",
+        ids
+    )
+    cursor.execute(f"DELETE FROM {table} WHERE id IN ({id_placeholders})", ids)
+    return len(ids)
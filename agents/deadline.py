@@ -0,0 +1,32 @@
+"""
+Deadline: A time budget for latency-bounded agent requests.
+
+A caller that must answer within an SLA passes `budget_ms`; the agent checks
+`expired()` between steps and at intervals inside long loops, and drops or
+shortens optional work once the budget is spent. `Deadline(None)` never
+expires, so the same code path serves unbounded requests.
+"""
+
+import time
+
+
+class Deadline:
+    def __init__(self, budget_ms=None):
+        """Start the clock; budget_ms=None means no deadline."""
+        self.budget_ms = budget_ms
+        self.started = time.monotonic()
+
+    @property
+    def bounded(self):
+        return self.budget_ms is not None
+
+    def elapsed_ms(self):
+        return (time.monotonic() - self.started) * 1000
+
+    def remaining_ms(self):
+        if self.budget_ms is None:
+            return float('inf')
+        return self.budget_ms - self.elapsed_ms()
+
+    def expired(self):
+        return self.remaining_ms() <= 0
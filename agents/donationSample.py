@@ -0,0 +1,349 @@
+"""
+StratifiedDonationSample: Maintained stratified reservoir sample of donations.
+
+The exact InsightsAgent metrics (kg totals, the shelf-life distribution,
+location percentages) scan every donation in the window. Interactive
+dashboards redraw them on every slider move and do not need exact figures.
+This store keeps, for every (status, extended food category) stratum, the
+stratum's population and a uniform random sample of at most RESERVOIR_SIZE
+of its donations. Each sampled donation carries the fields those metrics
+need: created_at, kg estimates, shelf life and location.
+
+The sample advances from the change log. A status change deletes the
+donation from one stratum and inserts it into another, and deleting the
+donation removes it from its stratum. Random pairing keeps each reservoir a
+uniform sample under deletions: a deletion is remembered as in-sample or
+out-of-sample, and later insertions fill those deletions in proportion
+before the reservoir resumes ordinary reservoir sampling.
+
+Estimates use the stratified estimator over the sample rows. A total is
+sum(N_h * mean_h) with variance sum(N_h^2 (1 - n_h/N_h) s_h^2 / n_h), and a
+ratio uses the linearized variance. Windowed estimates restrict each
+stratum's sample to the window (domain estimation), so every estimate
+reads a bounded number of rows whatever the table size. Intervals are
+normal-approximation 95% intervals.
+
+Rebuild the sample and print a few estimates with:
+    python agents/donationSample.py --db database/foodcycle.sqlite --rebuild
+"""
+
+import argparse
+import math
+import os
+import random
+import sqlite3
+import sys
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.archivePartitions import ArchivePartitions
+from agents.changeLog import ChangeLog
+from agents.foodCategories import categorize_extended
+from agents.quantities import estimate_quantity_kg, estimate_quantity_kg_simple
+
+CONSUMER = 'donation_sample'
+# Donations sampled per (status, category) stratum
+RESERVOIR_SIZE = 256
+# Two-sided 95% normal quantile
+CONFIDENCE = 0.95
+CONFIDENCE_Z = 1.96
+
+SAMPLE_FIELDS = (
+    "id, food_name, quantity, location, status, created_at, expiry_date IS NOT NULL as has_expiry, "
+    "julianday(expiry_date) - julianday(created_at) as shelf_life_days"
+)
+
+
+class StratifiedDonationSample:
+    def __init__(self, conn, size=RESERVOIR_SIZE, seed=None):
+        """Initialize the sample on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        self.size = size
+        self.random = random.Random(seed)
+        self.create_tables()
+
+    def create_tables(self):
+        """Create the sample tables if they do not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS donation_sample_strata (
+                status TEXT NOT NULL,
+                category TEXT NOT NULL,
+                population INTEGER NOT NULL DEFAULT 0,
+                in_sample_deletions INTEGER NOT NULL DEFAULT 0,
+                out_sample_deletions INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (status, category)
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS donation_sample (
+                donation_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                category TEXT NOT NULL,
+                created_at TEXT,
+                kg REAL NOT NULL,
+                kg_simple REAL NOT NULL,
+                has_expiry INTEGER NOT NULL,
+                shelf_life_days REAL,
+                location TEXT
+            )
+            """
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_donation_sample_stratum ON donation_sample (status, category)"
+        )
+
+    def sync(self):
+        """Apply donation events from the change log.
+
+        Returns the number of events read. The caller is responsible for committing.
+        """
+        if self.changes.get_offset(CONSUMER) is None:
+            self.rebuild()
+            return 0
+        return self.changes.consume(CONSUMER, self._apply_events, table_name='donations')
+
+    def _apply_events(self, events):
+        """Move a batch of inserted, re-statused and deleted donations between strata and reservoirs."""
+        rows = self.changes.rows('donations', SAMPLE_FIELDS, {event['row_id'] for event in events},
+                                 events[0]['offset'] - 1)
+        rows = {row['id']: row for row in rows}
+
+        self.cursor.execute("SELECT * FROM donation_sample_strata")
+        strata = {(row['status'], row['category']): dict(row) for row in self.cursor.fetchall()}
+        members = {}
+        loaded = set()
+
+        def reservoir(stratum):
+            # Sampled ids of a stratum, loaded on first touch
+            if stratum not in members:
+                self.cursor.execute(
+                    "SELECT donation_id FROM donation_sample WHERE status = ? AND category = ?", stratum
+                )
+                members[stratum] = {row['donation_id'] for row in self.cursor.fetchall()}
+                loaded.update(members[stratum])
+            return members[stratum]
+
+        for event in events:
+            row = rows.get(event['row_id'])
+            if row is None:
+                continue
+            category = categorize_extended(row['food_name'])
+            if event['operation'] != 'insert':
+                self._delete(strata, reservoir, (event['old_status'], category), row['id'])
+            if event['operation'] != 'delete':
+                self._insert(strata, reservoir, (event['new_status'], category), row['id'])
+
+        self.cursor.executemany(
+            """
+            INSERT OR REPLACE INTO donation_sample_strata
+                (status, category, population, in_sample_deletions, out_sample_deletions)
+            VALUES (:status, :category, :population, :in_sample_deletions, :out_sample_deletions)
+            """,
+            list(strata.values())
+        )
+        sampled = {donation_id: stratum for stratum, ids in members.items() for donation_id in ids}
+        self.cursor.executemany(
+            "DELETE FROM donation_sample WHERE donation_id = ?",
+            [(donation_id,) for donation_id in loaded if donation_id not in sampled]
+        )
+        # Only event rows joined a reservoir or changed stratum, so only they need (re)writing
+        self.cursor.executemany(
+            """
+            INSERT OR REPLACE INTO donation_sample
+                (donation_id, status, category, created_at, kg, kg_simple, has_expiry, shelf_life_days, location)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [self._sample_row(rows[donation_id], sampled[donation_id]) for donation_id in rows if donation_id in sampled]
+        )
+
+    def _insert(self, strata, reservoir, stratum, donation_id):
+        """Random-pairing insertion of a donation into a stratum."""
+        state = strata.setdefault(stratum, {
+            "status": stratum[0], "category": stratum[1],
+            "population": 0, "in_sample_deletions": 0, "out_sample_deletions": 0
+        })
+        state['population'] += 1
+        ids = reservoir(stratum)
+        pending = state['in_sample_deletions'] + state['out_sample_deletions']
+        if pending:
+            # Pair the insertion with an earlier deletion
+            if self.random.random() < state['in_sample_deletions'] / pending:
+                ids.add(donation_id)
+                state['in_sample_deletions'] -= 1
+            else:
+                state['out_sample_deletions'] -= 1
+        elif len(ids) < self.size:
+            ids.add(donation_id)
+        elif self.random.random() < self.size / state['population']:
+            ids.remove(self.random.choice(sorted(ids)))
+            ids.add(donation_id)
+
+    def _delete(self, strata, reservoir, stratum, donation_id):
+        """Random-pairing deletion of a donation from a stratum."""
+        state = strata.get(stratum)
+        if state is None or state['population'] == 0:
+            return
+        state['population'] -= 1
+        ids = reservoir(stratum)
+        if donation_id in ids:
+            ids.remove(donation_id)
+            state['in_sample_deletions'] += 1
+        else:
+            state['out_sample_deletions'] += 1
+
+    @staticmethod
+    def _sample_row(row, stratum):
+        return (
+            row['id'], stratum[0], stratum[1], row['created_at'], estimate_quantity_kg(row['quantity']),
+            estimate_quantity_kg_simple(row['quantity']), row['has_expiry'], row['shelf_life_days'], row['location']
+        )
+
+    def rebuild(self):
+        """Resample every stratum from the donations and reset the log offset."""
+        # Deleting first takes the write lock, so the log head matches the rows read below
+        self.cursor.execute("DELETE FROM donation_sample")
+        self.cursor.execute("DELETE FROM donation_sample_strata")
+        self.changes.set_offset(CONSUMER, self.changes.head())
+
+        category_of = {}
+        reservoirs = {}
+        populations = {}
+        self.cursor.execute(f"SELECT {SAMPLE_FIELDS} FROM donations_all")
+        for row in self.cursor:
+            food_name = row['food_name']
+            category = category_of.get(food_name)
+            if category is None:
+                category = category_of[food_name] = categorize_extended(food_name)
+            stratum = (row['status'], category)
+            seen = populations[stratum] = populations.get(stratum, 0) + 1
+            sample = reservoirs.setdefault(stratum, [])
+            # Algorithm R
+            if seen <= self.size:
+                sample.append(row)
+            else:
+                slot = self.random.randrange(seen)
+                if slot < self.size:
+                    sample[slot] = row
+
+        self.cursor.executemany(
+            "INSERT INTO donation_sample_strata (status, category, population) VALUES (?, ?, ?)",
+            [(status, category, population) for (status, category), population in populations.items()]
+        )
+        self.cursor.executemany(
+            """
+            INSERT INTO donation_sample
+                (donation_id, status, category, created_at, kg, kg_simple, has_expiry, shelf_life_days, location)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [self._sample_row(row, stratum) for stratum, sample in reservoirs.items() for row in sample]
+        )
+
+    def strata(self, statuses=None, since=None, until=None):
+        """Return [(population, sample size, sample rows in [since, until))] per stratum.
+
+        statuses limits the strata to those statuses; None reads every stratum.
+        """
+        query = "SELECT * FROM donation_sample_strata WHERE population > 0"
+        params = []
+        if statuses is not None:
+            query += f" AND status IN ({','.join('?' * len(statuses))})"
+            params += list(statuses)
+        self.cursor.execute(query, params)
+        populations = {(row['status'], row['category']): row['population'] for row in self.cursor.fetchall()}
+
+        self.cursor.execute("SELECT * FROM donation_sample")
+        samples = {stratum: [] for stratum in populations}
+        sizes = dict.fromkeys(populations, 0)
+        for row in self.cursor.fetchall():
+            stratum = (row['status'], row['category'])
+            if stratum not in samples:
+                continue
+            sizes[stratum] += 1
+            # Out-of-window rows still count towards the stratum's sample size (domain estimation)
+            created_at = row['created_at']
+            if (since and (created_at is None or created_at < since)) or (until and (created_at is None or created_at >= until)):
+                continue
+            samples[stratum].append(dict(row))
+        return [(populations[s], sizes[s], samples[s]) for s in populations]
+
+    @staticmethod
+    def estimate_totals(strata, values):
+        """Estimate population totals of {name: value(row)} over the strata's in-window rows.
+
+        Returns {name: (estimate, interval half-width)}.
+        """
+        results = {}
+        for name, value in values.items():
+            total = 0.0
+            variance = 0.0
+            for population, size, rows in strata:
+                if size == 0:
+                    continue
+                # Rows outside the window or the metric's domain count as zeros
+                ys = [value(row) for row in rows] + [0.0] * (size - len(rows))
+                mean = sum(ys) / size
+                total += population * mean
+                if size > 1:
+                    s2 = sum((y - mean) ** 2 for y in ys) / (size - 1)
+                    variance += population ** 2 * (1 - size / population) * s2 / size
+            results[name] = (total, CONFIDENCE_Z * math.sqrt(max(variance, 0.0)))
+        return results
+
+    @staticmethod
+    def estimate_ratios(strata, numerators, denominator):
+        """Estimate {name: total(numerator) / total(denominator)} with linearized intervals.
+
+        Returns {name: (ratio, interval half-width)}; ratios are None when the
+        denominator is estimated as zero.
+        """
+        total_x = StratifiedDonationSample.estimate_totals(strata, {'x': denominator})['x'][0]
+        results = {}
+        for name, numerator in numerators.items():
+            total_y = StratifiedDonationSample.estimate_totals(strata, {'y': numerator})['y'][0]
+            if total_x <= 0:
+                results[name] = (None, None)
+                continue
+            ratio = total_y / total_x
+            residuals = {'z': lambda row: numerator(row) - ratio * denominator(row)}
+            half_width = StratifiedDonationSample.estimate_totals(strata, residuals)['z'][1] / total_x
+            results[name] = (ratio, half_width)
+        return results
+
+    def sample_size(self):
+        """Return the number of sampled donations."""
+        self.cursor.execute("SELECT COUNT(*) as count FROM donation_sample")
+        return self.cursor.fetchone()['count']
+
+
+# Sample maintenance entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the stratified donation sample.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database path")
+    parser.add_argument('--rebuild', action='store_true', help="Resample from scratch instead of catching up")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        # Archived months live in partition files
+        ArchivePartitions(conn, args.db).open()
+        sample = StratifiedDonationSample(conn)
+        if args.rebuild:
+            sample.rebuild()
+        else:
+            print(f"Applied {sample.sync()} change log events")
+        conn.commit()
+        strata = sample.strata(('completed',))
+        kg, half_width = sample.estimate_totals(strata, {'kg': lambda row: row['kg']})['kg']
+        print(f"{sample.sample_size()} donations sampled; completed kg ~ {kg:.1f} +/- {half_width:.1f}")
+    except sqlite3.Error as e:
+        print(f"Sample error: {e}")
+    finally:
+        conn.close()
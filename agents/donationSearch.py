@@ -0,0 +1,226 @@
+"""
+DonationSearchIndex: Full-text search over available donations.
+
+An FTS5 table (`donation_search`) indexes the food_name and description of
+every available donation, so its size follows the available donations, not
+the whole history. It advances from the change log like the other derived
+stores: each insert or status event re-reads the donation and indexes it
+while it is available, so reserved, completed, expired and deleted donations
+drop out of search on the next sync. Edits to an existing donation's text or
+expiry date are not in the change log; `rebuild` picks them up.
+
+The FTS rowid is a search key, (expiry day << 32) | donation id, so FTS5
+returns matches in expiry order. Donation ids must therefore stay below
+2**32, which agents/regionShards.py keeps to when handing out id blocks. `search` seeks past donations that have
+already expired, takes a bounded pool of the soonest-expiring matches,
+scores only that pool with BM25 (food_name weighted above description) and
+re-ranks it by a blend of normalized relevance and expiry urgency. Scoring
+and sorting every match of a common word would grow with the index; the pool
+keeps that part of a query constant.
+
+Search from the command line with:
+    python agents/donationSearch.py --db database/foodcycle.sqlite --query "gluten free bread"
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.changeLog import ChangeLog
+
+CONSUMER = 'donation_search'
+
+# BM25 column weights: food_name, description
+COLUMN_WEIGHTS = (2.0, 1.0)
+# Share of the final score that comes from expiry urgency rather than relevance
+EXPIRY_WEIGHT = 0.3
+# Days over which urgency halves: a donation expiring in 7 days scores 0.5
+URGENCY_HALF_LIFE_DAYS = 7
+# Soonest-expiring matches scored per search, at least this many or 10x the limit
+MIN_CANDIDATES = 200
+
+# FTS rowid of a donation; donations without a (valid) expiry date sort last
+SEARCH_KEY = "((CAST(COALESCE(julianday(expiry_date), julianday('9999-12-31')) AS INTEGER) << 32) | id)"
+DONATION_ID_MASK = 0xFFFFFFFF
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: every word must match, the last as a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation typed by a user are
+    searched for literally instead of being parsed. Returns None if the text
+    has no words.
+    """
+    words = TOKEN_PATTERN.findall(text.lower())
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def expiry_urgency(expiry_date, now=None):
+    """Return 0..1, higher the sooner a donation expires; 0 without a date or once past it."""
+    if not expiry_date:
+        return 0.0
+    try:
+        expiry = datetime.strptime(expiry_date[:10], '%Y-%m-%d')
+    except ValueError:
+        return 0.0
+    days_left = (expiry - (now or datetime.now())).total_seconds() / 86400
+    if days_left < 0:
+        return 0.0
+    return 1 / (1 + days_left / URGENCY_HALF_LIFE_DAYS)
+
+
+class DonationSearchIndex:
+    def __init__(self, conn):
+        """Initialize the index on an open database connection.
+
+        Raises sqlite3.OperationalError if SQLite was built without FTS5.
+        """
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        self.create_table()
+
+    def create_table(self):
+        """Create the donation_search FTS5 table if it does not exist."""
+        self.cursor.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS donation_search USING fts5(
+                food_name, description, tokenize = 'porter unicode61', prefix = '2 3'
+            )
+            """
+        )
+
+    def sync(self):
+        """Apply donation events from the change log. Returns the number of events read.
+
+        The caller is responsible for committing the catch-up writes.
+        """
+        if self.changes.get_offset(CONSUMER) is None:
+            self.rebuild()
+            return 0
+        return self.changes.consume(CONSUMER, self._apply_events, table_name='donations')
+
+    def _apply_events(self, events):
+        """Re-index the donations touched by a batch of events from their current rows."""
+        # Deleted donations come back from their delete events, so they can be unindexed
+        rows = self.changes.rows(
+            'donations', f"{SEARCH_KEY} as search_key, food_name, description, status",
+            {event['row_id'] for event in events}, events[0]['offset'] - 1
+        )
+        self.cursor.executemany("DELETE FROM donation_search WHERE rowid = ?", [(row['search_key'],) for row in rows])
+        self.cursor.executemany(
+            "INSERT INTO donation_search (rowid, food_name, description) VALUES (?, ?, ?)",
+            [
+                (row['search_key'], row['food_name'], row['description'] or '')
+                for row in rows if row['status'] == 'available' and row['deleted_offset'] is None
+            ]
+        )
+
+    def rebuild(self):
+        """Re-index every available donation and reset the log offset."""
+        # Deleting first takes the write lock, so the log head matches the rows read below
+        self.cursor.execute("DELETE FROM donation_search")
+        self.changes.set_offset(CONSUMER, self.changes.head())
+        self.cursor.execute(
+            f"""
+            INSERT INTO donation_search (rowid, food_name, description)
+            SELECT {SEARCH_KEY}, food_name, COALESCE(description, '') FROM donations
+            WHERE status = 'available'
+            """
+        )
+        # Merge the segments written by the bulk insert into one b-tree
+        self.cursor.execute("INSERT INTO donation_search (donation_search) VALUES ('optimize')")
+
+    def today_key(self, now):
+        """Return the smallest search key of a donation that has not expired by now."""
+        self.cursor.execute("SELECT CAST(julianday(?) AS INTEGER) << 32", (now.strftime('%Y-%m-%d'),))
+        return self.cursor.fetchone()[0]
+
+    def search(self, text, limit=20, sync=True):
+        """Return available donations matching text, best first, with donor_name and search_score.
+
+        The caller is responsible for committing the catch-up writes.
+        """
+        match = build_match_query(text)
+        if match is None:
+            return []
+        if sync:
+            self.sync()
+
+        now = datetime.now()
+        self.cursor.execute(
+            f"""
+            SELECT d.*, u.name as donor_name, s.relevance
+            FROM (
+                SELECT rowid, -bm25(donation_search, {COLUMN_WEIGHTS[0]}, {COLUMN_WEIGHTS[1]}) as relevance
+                FROM donation_search
+                WHERE donation_search MATCH ? AND rowid >= ?
+                ORDER BY rowid
+                LIMIT ?
+            ) s
+            JOIN donations d ON d.id = s.rowid & {DONATION_ID_MASK}
+            JOIN users u ON d.donor_id = u.id
+            WHERE d.status = 'available'
+            """,
+            (match, self.today_key(now), max(MIN_CANDIDATES, limit * 10))
+        )
+        # An entry left behind by an edited expiry date can repeat a donation
+        candidates = list({row['id']: dict(row) for row in self.cursor.fetchall()}.values())
+        if not candidates:
+            return []
+
+        # BM25 is unbounded, so scale it by the best candidate before blending
+        best = max(row['relevance'] for row in candidates) or 1.0
+        for row in candidates:
+            relevance = row.pop('relevance') / best
+            urgency = expiry_urgency(row['expiry_date'], now)
+            row['search_score'] = round((1 - EXPIRY_WEIGHT) * relevance + EXPIRY_WEIGHT * urgency, 4)
+        candidates.sort(key=lambda row: (-row['search_score'], row['id']))
+        return candidates[:limit]
+
+
+# Search entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search available donations.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database path")
+    parser.add_argument('--query', help="Words to search for")
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--rebuild', action='store_true', help="Re-index every available donation")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        index = DonationSearchIndex(conn)
+        if args.rebuild:
+            index.rebuild()
+            conn.commit()
+            print("Search index rebuilt")
+        if args.query:
+            index.sync()
+            conn.commit()
+            start = time.perf_counter()
+            results = index.search(args.query, args.limit, sync=False)
+            elapsed = (time.perf_counter() - start) * 1000
+            for row in results:
+                print(f"{row['search_score']:.3f}  #{row['id']} {row['food_name']} "
+                      f"(expires {row['expiry_date']}) - {row['description'] or ''}")
+            print(f"{len(results)} results in {elapsed:.2f} ms")
+    except sqlite3.Error as e:
+        print(f"Search error: {e}")
+    finally:
+        conn.close()
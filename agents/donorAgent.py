@@ -9,124 +9,149 @@ import os
 import sys
 from datetime import datetime, timedelta
 
-# Add parent directory to path to access shared modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-class DonorAgent:
-    def __init__(self, db_path='database/foodcycle.sqlite'):
-        """Initialize the donor agent with database connection."""
+from agents.archivePartitions import ArchivePartitions, PartitionedConnection
+from agents.donorProfiles import DonorProfileStore
+from agents.interestIndex import RecipientInterestIndex
+from agents.lazyConnection import LazyConnection
+from agents.pagination import DEFAULT_PAGE_SIZE, decode_page_token, encode_page_token, page_size
+from agents.pendingFoodCounts import PendingFoodCounts
+from agents.storage import create_storage
+
+class DonorAgent(LazyConnection):
+    lazy_attributes = {
+        **dict.fromkeys(('conn', 'cursor', 'partitions', 'profiles', 'pending_foods', 'interests', 'storage'),
+                        'connect_db'),
+        'forecaster': 'init_forecaster'
+    }
+
+    def __init__(self, db_path='database/foodcycle.sqlite', storage_engine='sqlite'):
+        """Initialize the donor agent; the database is opened on first use.
+        
+        storage_engine selects the backend for donation history reads:
+        'sqlite' or 'memory' (see agents/storage.py).
+        """
         self.db_path = db_path
-        self.connect_db()
+        self.storage_engine = storage_engine
     
     def connect_db(self):
         """Connect to the SQLite database."""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = sqlite3.connect(self.db_path, factory=PartitionedConnection)
             self.conn.row_factory = sqlite3.Row  # Return rows as dictionaries
             self.cursor = self.conn.cursor()
+            self.partitions = ArchivePartitions(self.conn, self.db_path)
+            self.partitions.open()
+            self.profiles = DonorProfileStore(self.conn)
+            self.pending_foods = PendingFoodCounts(self.conn)
+            self.interests = RecipientInterestIndex(self.conn)
+            self.storage = create_storage(self.conn, self.storage_engine)
             print(f"Connected to database: {self.db_path}")
         except sqlite3.Error as e:
             print(f"Database connection error: {e}")
             sys.exit(1)
     
+    def init_forecaster(self):
+        """Create the supply forecaster, or None if NumPy is not installed."""
+        try:
+            # Imported here so NumPy is only loaded when suggestions are generated
+            from agents.supplyForecast import SupplyForecaster
+        except ImportError:
+            print("NumPy is not installed; suggestions will not use supply forecasts")
+            self.forecaster = None
+            return
+        self.forecaster = SupplyForecaster(self.conn)
+    
     def close_connection(self):
         """Close the database connection."""
-        if hasattr(self, 'conn'):
+        if self.is_loaded('conn'):
             self.conn.close()
             print("Database connection closed")
     
     def get_donor_donations(self, donor_id):
         """Retrieve all donations made by a specific donor."""
         try:
-            self.cursor.execute(
-                "SELECT * FROM donations WHERE donor_id = ? ORDER BY created_at DESC",
-                (donor_id,)
-            )
-            donations = [dict(row) for row in self.cursor.fetchall()]
+            donations = self.storage.donor_donations(donor_id)
             print(f"Retrieved {len(donations)} donations for donor {donor_id}")
             return donations
         except sqlite3.Error as e:
             print(f"Error retrieving donations: {e}")
             return []
     
+    def get_donor_donations_page(self, donor_id, limit=DEFAULT_PAGE_SIZE, page_token=None):
+        """Retrieve one page of a donor's donations, newest first.
+        
+        Pass the returned next_page_token to get the following page; it is
+        None on the last page.
+        """
+        listing = f"donor_donations:{donor_id}"
+        try:
+            after = decode_page_token(page_token, listing)
+            donations, next_key = self.storage.donor_donations_page(donor_id, page_size(limit), after)
+            return {
+                "donations": donations,
+                "next_page_token": encode_page_token(listing, next_key) if next_key else None
+            }
+        except ValueError as e:
+            return {
+                "status": "error",
+                "message": f"Invalid page token: {e}"
+            }
+        except sqlite3.Error as e:
+            print(f"Error retrieving donations: {e}")
+            return {
+                "status": "error",
+                "message": f"Failed to retrieve donations: {str(e)}"
+            }
+    
     def analyze_donation_patterns(self, donor_id):
-        """Analyze donation patterns for a specific donor."""
-        donations = self.get_donor_donations(donor_id)
+        """Analyze donation patterns for a specific donor from their stored profile."""
+        try:
+            profile = self.profiles.refresh(donor_id)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error retrieving donor profile: {e}")
+            profile = None
         
-        if not donations:
+        return self.patterns_from_profile(profile)
+    
+    @staticmethod
+    def patterns_from_profile(profile):
+        """Describe a donor profile (see agents/donorProfiles.py) as donation patterns."""
+        if not profile:
             return {
                 "total_donations": 0,
                 "message": "No donation history found."
             }
         
-        # Analyze donation frequency
-        dates = [datetime.strptime(d['created_at'], '%Y-%m-%dT%H:%M:%SZ') 
-                 if 'T' in d['created_at'] else 
-                 datetime.strptime(d['created_at'], '%Y-%m-%d %H:%M:%S') 
-                 for d in donations]
-        
-        if len(dates) > 1:
-            date_diffs = [(dates[i] - dates[i+1]).days for i in range(len(dates)-1)]
-            avg_frequency = sum(date_diffs) / len(date_diffs) if date_diffs else 0
-        else:
-            avg_frequency = 0
-        
-        # Analyze food types
-        food_types = {}
-        for donation in donations:
-            food_name = donation['food_name'].lower()
-            if 'vegetable' in food_name or 'veg' in food_name:
-                category = 'vegetables'
-            elif 'fruit' in food_name:
-                category = 'fruits'
-            elif 'bread' in food_name or 'bakery' in food_name:
-                category = 'bakery'
-            elif 'canned' in food_name:
-                category = 'canned goods'
-            elif 'dairy' in food_name or 'milk' in food_name or 'cheese' in food_name:
-                category = 'dairy'
-            else:
-                category = 'other'
-            
-            food_types[category] = food_types.get(category, 0) + 1
-        
+        avg_frequency = profile['mean_interval_days']
+        food_types = profile['category_counts']
         most_common_category = max(food_types.items(), key=lambda x: x[1])[0] if food_types else 'none'
         
-        # Calculate impact
-        total_donations = len(donations)
-        
         return {
-            "total_donations": total_donations,
+            "total_donations": profile['donation_count'],
             "donation_frequency": f"Approximately every {round(avg_frequency)} days" if avg_frequency else "First donation",
             "most_common_food": most_common_category,
             "food_distribution": food_types,
-            "next_predicted_donation": (dates[0] + timedelta(days=avg_frequency)).strftime('%Y-%m-%d') if avg_frequency else "Unknown"
+            "next_predicted_donation": profile['next_predicted_donation'] or "Unknown"
         }
     
-    def generate_suggestions(self, donor_id):
-        """Generate donation suggestions based on donor history and community needs."""
-        # Get donor's donation patterns
-        patterns = self.analyze_donation_patterns(donor_id)
-        
-        # Check current needs in the system
+    def community_context(self):
+        """Compute the community-wide inputs to suggestions, shared by every donor."""
+        # Check current needs in the system: foods with the most pending requests
         try:
-            self.cursor.execute("""
-                SELECT food_name, COUNT(*) as request_count 
-                FROM requests r
-                JOIN donations d ON r.donation_id = d.id
-                WHERE r.status = 'pending'
-                GROUP BY food_name
-                ORDER BY request_count DESC
-                LIMIT 5
-            """)
-            needs = [dict(row) for row in self.cursor.fetchall()]
+            needs = [{"food_name": food_name, "request_count": count}
+                     for food_name, count in self.pending_foods.top(5)]
+            self.conn.commit()
         except sqlite3.Error as e:
             print(f"Error retrieving community needs: {e}")
             needs = []
         
         # Check for soon-to-expire foods in the system
         try:
-            today = datetime.now().strftime('%Y-%m-%d')
             self.cursor.execute("""
                 SELECT COUNT(*) as count
                 FROM donations
@@ -139,6 +164,47 @@ class DonorAgent:
             print(f"Error retrieving expiration data: {e}")
             expiring_soon = 0
         
+        # Category shortfalls from the supply forecasts, which are refitted
+        # only when new data arrives; the catch-all 'other' is no suggestion
+        shortfalls = []
+        try:
+            if self.forecaster is not None:
+                shortfalls = [
+                    c for c in self.forecaster.category_outlook(days=7)
+                    if c['shortfall'] > 0 and c['category'] != 'other'
+                ][:3]
+        except sqlite3.Error as e:
+            print(f"Error forecasting supply: {e}")
+        
+        return {
+            "needs": needs,
+            "expiring_soon": expiring_soon,
+            "shortfalls": shortfalls
+        }
+    
+    def forecast_next_donation(self, donor_id):
+        """Return the forecast date of a donor's next donation, or None."""
+        try:
+            if self.forecaster is not None:
+                return self.forecaster.donor_next_donation(donor_id)
+        except sqlite3.Error as e:
+            print(f"Error forecasting supply: {e}")
+        return None
+    
+    def generate_suggestions(self, donor_id):
+        """Generate donation suggestions based on donor history and community needs."""
+        # Get donor's donation patterns
+        patterns = self.analyze_donation_patterns(donor_id)
+        return self.build_suggestions(
+            donor_id, patterns, self.community_context(), self.forecast_next_donation(donor_id)
+        )
+    
+    def build_suggestions(self, donor_id, patterns, context, next_donation=None):
+        """Combine a donor's patterns with the community context into suggestions."""
+        needs = context['needs']
+        shortfalls = context['shortfalls']
+        expiring_soon = context['expiring_soon']
+        
         # Generate personalized suggestions
         suggestions = []
         
@@ -160,16 +226,23 @@ class DonorAgent:
                     "message": f"You've been donating a lot of {patterns['most_common_food']}. Consider diversifying with other food categories."
                 })
             
+            if shortfalls:
+                suggestions.append({
+                    "type": "forecast_shortfall",
+                    "message": f"Next week, requests are expected to outpace donations for: {', '.join(c['category'] for c in shortfalls)}"
+                })
+            
             if expiring_soon > 0:
                 suggestions.append({
                     "type": "expiring",
                     "message": f"There are {expiring_soon} donations expiring soon. Consider donating items with longer shelf life."
                 })
             
-            if 'next_predicted_donation' in patterns and patterns['next_predicted_donation'] != 'Unknown':
+            next_donation = next_donation or patterns.get('next_predicted_donation', 'Unknown')
+            if next_donation != 'Unknown':
                 suggestions.append({
                     "type": "schedule",
-                    "message": f"Based on your history, we expect your next donation around {patterns['next_predicted_donation']}. Schedule it in advance!"
+                    "message": f"Based on your history, we expect your next donation around {next_donation}. Schedule it in advance!"
                 })
         
         return {
@@ -197,20 +270,29 @@ class DonorAgent:
                     donation_data.get('location', '')
                 )
             )
-            self.conn.commit()
             donation_id = self.cursor.lastrowid
             
+            # Fold the new donation into the donor's profile and queue notifications
+            # for interested recipients in the same transaction
+            self.profiles.refresh(donation_data['donor_id'])
+            notified = self.interests.notify_new_donation(
+                donation_id, donation_data['food_name'], donation_data.get('location', '')
+            )
+            self.conn.commit()
+            
             # Generate feedback and recommendations
             feedback = {
                 "donation_id": donation_id,
                 "status": "success",
                 "message": f"Thank you for donating {donation_data['quantity']} of {donation_data['food_name']}!",
                 "impact": "Your donation can help feed up to 5 people in need.",
+                "notified_recipients": len(notified),
                 "recommendations": self.generate_suggestions(donation_data['donor_id'])['suggestions']
             }
             
             return feedback
         except sqlite3.Error as e:
+            self.conn.rollback()
             print(f"Error processing donation: {e}")
             return {
                 "status": "error",
@@ -0,0 +1,216 @@
+"""
+DonorProfileStore: Maintains incremental per-donor donation profiles.
+
+Each donor has a single row in `donor_profiles` holding the running totals
+needed by `DonorAgent.analyze_donation_patterns`, so the analysis reads one
+row instead of re-parsing the donor's whole donation history.
+
+New donations are folded in above a per-profile id watermark. Deleted
+donations cannot be seen that way, so the store also follows donation delete
+events in the change log and rebuilds the profiles they touch.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from agents.changeLog import ChangeLog
+from agents.foodCategories import categorize_basic
+
+CONSUMER = 'donor_profiles'
+
+
+def parse_timestamp(value):
+    """Parse a SQLite or ISO-8601 `created_at` timestamp."""
+    if 'T' in value:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+    # fromisoformat parses SQLite's 'YYYY-MM-DD HH:MM:SS' many times faster than strptime
+    return datetime.fromisoformat(value)
+
+
+def profile_from_history(donor_id, rows):
+    """Build a donor's profile dict from their donations, newest first.
+
+    rows need id, food_name and created_at. Returns None for an empty history.
+    """
+    if not rows:
+        return None
+
+    dates = [parse_timestamp(row['created_at']) for row in rows]
+    interval_total = sum((dates[i] - dates[i + 1]).days for i in range(len(dates) - 1))
+
+    categories = {}
+    for row in rows:
+        category = categorize_basic(row['food_name'])
+        categories[category] = categories.get(category, 0) + 1
+
+    last_donation_id = max(row['id'] for row in rows)
+    return make_profile(donor_id, len(rows), last_donation_id, rows[0]['created_at'], interval_total, categories)
+
+
+def make_profile(donor_id, count, last_donation_id, last_donation_at, interval_total, categories):
+    """Return a profile dict, deriving the mean interval and the next predicted donation."""
+    mean_interval = interval_total / (count - 1) if count > 1 else 0
+    if mean_interval:
+        next_predicted = (parse_timestamp(last_donation_at) + timedelta(days=mean_interval)).strftime('%Y-%m-%d')
+    else:
+        next_predicted = None
+
+    return {
+        "donor_id": donor_id,
+        "donation_count": count,
+        "last_donation_id": last_donation_id,
+        "last_donation_at": last_donation_at,
+        "interval_total_days": interval_total,
+        "mean_interval_days": mean_interval,
+        "category_counts": categories,
+        "next_predicted_donation": next_predicted
+    }
+
+
+class DonorProfileStore:
+    def __init__(self, conn):
+        """Initialize the profile store on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        self.create_table()
+
+    def create_table(self):
+        """Create the donor_profiles table if it does not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS donor_profiles (
+                donor_id INTEGER PRIMARY KEY,
+                donation_count INTEGER NOT NULL DEFAULT 0,
+                last_donation_id INTEGER NOT NULL DEFAULT 0,
+                last_donation_at TEXT,
+                interval_total_days INTEGER NOT NULL DEFAULT 0,
+                mean_interval_days REAL NOT NULL DEFAULT 0,
+                category_counts TEXT NOT NULL DEFAULT '{}',
+                next_predicted_donation TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        # Serves the watermark catch-up, per-donor history lookups and history
+        # pages, which seek on (created_at, id); it supersedes the donor_id index
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_donations_donor_created ON donations (donor_id, created_at)"
+        )
+        self.cursor.execute("DROP INDEX IF EXISTS idx_donations_donor_id")
+
+    def get_profile(self, donor_id):
+        """Return the stored profile for a donor, or None if not yet built."""
+        self.cursor.execute(
+            "SELECT * FROM donor_profiles WHERE donor_id = ?",
+            (donor_id,)
+        )
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        profile = dict(row)
+        profile['category_counts'] = json.loads(profile['category_counts'])
+        return profile
+
+    def refresh(self, donor_id):
+        """Fold any donations newer than the stored profile into it and return it.
+
+        Only rows with an id above the profile's watermark are read, so a
+        refresh after a single insert touches one donation row. Donations
+        written by other processes (e.g. the Node backend) are picked up the
+        same way. The caller is responsible for committing.
+        """
+        self.apply_deletes()
+        profile = self.get_profile(donor_id)
+        if profile is None:
+            return self.rebuild(donor_id)
+
+        self.cursor.execute(
+            "SELECT id, food_name, created_at FROM donations_all WHERE donor_id = ? AND id > ? ORDER BY id",
+            (donor_id, profile['last_donation_id'])
+        )
+        new_rows = self.cursor.fetchall()
+        if not new_rows:
+            return profile
+
+        count = profile['donation_count']
+        interval_total = profile['interval_total_days']
+        last_donation_at = profile['last_donation_at']
+        categories = profile['category_counts']
+
+        for row in new_rows:
+            created = parse_timestamp(row['created_at'])
+            last = parse_timestamp(last_donation_at)
+            if created < last:
+                # Back-dated rows change the gap sequence; recompute exactly.
+                return self.rebuild(donor_id)
+
+            count += 1
+            interval_total += (created - last).days
+            last_donation_at = row['created_at']
+            category = categorize_basic(row['food_name'])
+            categories[category] = categories.get(category, 0) + 1
+
+        return self._save(
+            make_profile(donor_id, count, new_rows[-1]['id'], last_donation_at, interval_total, categories)
+        )
+
+    def apply_deletes(self):
+        """Rebuild the stored profiles of donors whose donations were deleted since the last call.
+
+        Returns the number of change log events read. The caller is
+        responsible for committing.
+        """
+        if self.changes.get_offset(CONSUMER) is None:
+            # Profiles may predate the consumer, so replay every delete still in the log
+            self.changes.set_offset(CONSUMER, 0)
+        return self.changes.consume(CONSUMER, self._apply_deletes, table_name='donations')
+
+    def _apply_deletes(self, events):
+        """Rebuild the stored profiles of the donors of deleted donations in a batch."""
+        deleted = [event for event in events if event['operation'] == 'delete']
+        if not deleted:
+            return
+        donor_ids = {json.loads(event['row_data'])['donor_id'] for event in deleted}
+        self.cursor.execute(
+            f"SELECT donor_id FROM donor_profiles WHERE donor_id IN ({','.join('?' * len(donor_ids))})",
+            list(donor_ids)
+        )
+        for row in self.cursor.fetchall():
+            self.rebuild(row['donor_id'])
+
+    def rebuild(self, donor_id):
+        """Rebuild a donor's profile from their full donation history."""
+        self.cursor.execute(
+            "SELECT id, food_name, created_at FROM donations_all WHERE donor_id = ? ORDER BY created_at DESC",
+            (donor_id,)
+        )
+        profile = profile_from_history(donor_id, self.cursor.fetchall())
+        if profile is None:
+            self.cursor.execute("DELETE FROM donor_profiles WHERE donor_id = ?", (donor_id,))
+            return None
+        return self._save(profile)
+
+    def rebuild_all(self):
+        """Rebuild every donor's profile from the donations table."""
+        self.cursor.execute("SELECT DISTINCT donor_id FROM donations_all")
+        donor_ids = [row['donor_id'] for row in self.cursor.fetchall()]
+        for donor_id in donor_ids:
+            self.rebuild(donor_id)
+        self.conn.commit()
+        return len(donor_ids)
+
+    def _save(self, profile):
+        """Write a profile row and return the profile."""
+        self.cursor.execute(
+            """
+            INSERT OR REPLACE INTO donor_profiles (
+                donor_id, donation_count, last_donation_id, last_donation_at, interval_total_days,
+                mean_interval_days, category_counts, next_predicted_donation, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            (profile['donor_id'], profile['donation_count'], profile['last_donation_id'],
+             profile['last_donation_at'], profile['interval_total_days'], profile['mean_interval_days'],
+             json.dumps(profile['category_counts']), profile['next_predicted_donation'])
+        )
+        return profile
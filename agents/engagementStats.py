@@ -0,0 +1,470 @@
+"""
+UserEngagementStore: Maintained engagement counters, weekly cohorts and time to first request.
+
+`InsightsAgent.generate_user_engagement_metrics` used to group every donation
+and request by user and count every message on each report. This store keeps
+compact tables that advance from the change log instead:
+
+- `user_activity`: per donor and per recipient, their donation or request
+  count and their first and last activity
+- `user_weekly_activity`: one row per user and week they were active
+- `donation_first_request`: each requested donation's creation time and its
+  first request
+- `engagement_counters`: the message count, with the last message id counted
+  as its watermark (messages are append-only and not in the change log)
+
+Each sync reads only the events after the store's offset. Status changes do
+not affect any of these, so only insert and delete events are applied; a
+delete re-reads the first and last activity and active weeks of the user it
+affects. Weekly retention
+cohorts and time-to-first-request percentiles are computed from the compact
+tables with window functions, so their cost follows the number of active
+user-weeks and requested donations, not the whole history.
+
+Weeks start on Monday and are numbered from the Unix epoch.
+
+Rebuild the store with:
+    python agents/engagementStats.py --db database/foodcycle.sqlite --rebuild
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.changeLog import ChangeLog
+
+CONSUMER = 'user_engagement'
+ROLES = {
+    # role: (source table, user column)
+    'donor': ('donations', 'donor_id'),
+    'recipient': ('requests', 'recipient_id')
+}
+
+# Monday-based week number of a timestamp; 1970-01-01 was a Thursday, hence the 3 days
+WEEK_OF = "CAST((julianday(date({column})) - 2440587.5 + 3) / 7 AS INTEGER)"
+# First day (Monday) of a week number
+WEEK_START = "date(({week}) * 7 - 3 + 2440587.5)"
+
+
+class UserEngagementStore:
+    def __init__(self, conn):
+        """Initialize the store on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        self.create_tables()
+
+    def create_tables(self):
+        """Create the engagement tables if they do not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_activity (
+                role TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                activity_count INTEGER NOT NULL DEFAULT 0,
+                first_at TEXT,
+                last_at TEXT,
+                PRIMARY KEY (role, user_id)
+            )
+            """
+        )
+        # Top users and the recurring-user count read this index in order
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_user_activity_count ON user_activity (role, activity_count DESC)"
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_weekly_activity (
+                role TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                week INTEGER NOT NULL,
+                PRIMARY KEY (role, user_id, week)
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS donation_first_request (
+                donation_id INTEGER PRIMARY KEY,
+                donation_created_at TEXT,
+                first_request_at TEXT NOT NULL
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS engagement_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0,
+                watermark INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+
+    def sync(self):
+        """Apply insert events from the change log and count new messages.
+
+        Returns the number of events read. The caller is responsible for committing.
+        """
+        if self.changes.get_offset(CONSUMER) is None:
+            self.rebuild()
+            return 0
+        self._count_new_messages()
+        return self.changes.consume(CONSUMER, self._apply_events)
+
+    def _apply_events(self, events):
+        """Fold a batch of donation and request inserts and deletes into the counters."""
+        for role, (table, user_column) in ROLES.items():
+            table_events = [e for e in events if e['table_name'] == table and e['operation'] != 'status']
+            if not table_events:
+                continue
+            # Rows deleted later in the batch still count until their delete event
+            rows = self.changes.rows(
+                table, f"id, {user_column} as user_id, created_at, {WEEK_OF.format(column='created_at')} as week"
+                + (", donation_id" if role == 'recipient' else ""),
+                {e['row_id'] for e in table_events}, table_events[0]['offset'] - 1
+            )
+            rows = {row['id']: row for row in rows}
+            inserted = [rows[e['row_id']] for e in table_events if e['operation'] == 'insert' and e['row_id'] in rows]
+            deleted = [rows[e['row_id']] for e in table_events if e['operation'] == 'delete' and e['row_id'] in rows]
+
+            self.cursor.executemany(
+                """
+                INSERT INTO user_activity (role, user_id, activity_count, first_at, last_at)
+                VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT (role, user_id) DO UPDATE SET
+                    activity_count = activity_count + 1,
+                    first_at = MIN(first_at, excluded.first_at),
+                    last_at = MAX(last_at, excluded.last_at)
+                """,
+                [(role, row['user_id'], row['created_at'], row['created_at']) for row in inserted]
+            )
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO user_weekly_activity (role, user_id, week) VALUES (?, ?, ?)",
+                [(role, row['user_id'], row['week']) for row in inserted]
+            )
+            if deleted:
+                self._remove_activity(role, table, user_column, deleted)
+            if role == 'recipient':
+                self._record_first_requests(inserted)
+                if deleted:
+                    self._recompute_first_requests({row['donation_id'] for row in deleted})
+
+        # The rebuild leaves a deleted donation's creation time unknown
+        self.cursor.executemany(
+            "UPDATE donation_first_request SET donation_created_at = NULL WHERE donation_id = ?",
+            [(e['row_id'],) for e in events if e['table_name'] == 'donations' and e['operation'] == 'delete']
+        )
+
+    def _remove_activity(self, role, table, user_column, rows):
+        """Take deleted rows out of their users' counts, activity span and active weeks."""
+        self.cursor.executemany(
+            "UPDATE user_activity SET activity_count = activity_count - 1 WHERE role = ? AND user_id = ?",
+            [(role, row['user_id']) for row in rows]
+        )
+        # First and last activity and the active weeks are re-read from the user's remaining rows
+        for user_id in {row['user_id'] for row in rows}:
+            self.cursor.execute(
+                f"""
+                UPDATE user_activity SET
+                    first_at = (SELECT MIN(created_at) FROM {table}_all WHERE {user_column} = :user_id),
+                    last_at = (SELECT MAX(created_at) FROM {table}_all WHERE {user_column} = :user_id)
+                WHERE role = :role AND user_id = :user_id
+                """,
+                {"role": role, "user_id": user_id}
+            )
+            self.cursor.execute(
+                "DELETE FROM user_weekly_activity WHERE role = ? AND user_id = ?",
+                (role, user_id)
+            )
+            self.cursor.execute(
+                f"""
+                INSERT INTO user_weekly_activity (role, user_id, week)
+                SELECT DISTINCT ?, {user_column}, {WEEK_OF.format(column='created_at')}
+                FROM {table}_all WHERE {user_column} = ?
+                """,
+                (role, user_id)
+            )
+        self.cursor.execute("DELETE FROM user_activity WHERE role = ? AND activity_count <= 0", (role,))
+
+    def _record_first_requests(self, requests):
+        """Record the earliest of requests on each donation they requested."""
+        firsts = {}
+        for row in requests:
+            first = firsts.get(row['donation_id'])
+            if row['created_at'] is not None and (first is None or row['created_at'] < first):
+                firsts[row['donation_id']] = row['created_at']
+        # Donation creation times looked up by id; joining donations_all would materialize the view
+        self.cursor.executemany(
+            """
+            INSERT INTO donation_first_request (donation_id, donation_created_at, first_request_at)
+            VALUES (?, (SELECT created_at FROM donations_all WHERE id = ?), ?)
+            ON CONFLICT (donation_id) DO UPDATE SET
+                first_request_at = MIN(first_request_at, excluded.first_request_at)
+            """,
+            [(donation_id, donation_id, first_request_at) for donation_id, first_request_at in firsts.items()]
+        )
+
+    def _recompute_first_requests(self, donation_ids):
+        """Re-read the first request of donations that lost a request, dropping those left with none."""
+        for donation_id in donation_ids:
+            self.cursor.execute(
+                "SELECT MIN(created_at) as first_request_at FROM requests_all WHERE donation_id = ?",
+                (donation_id,)
+            )
+            first_request_at = self.cursor.fetchone()['first_request_at']
+            if first_request_at is None:
+                self.cursor.execute("DELETE FROM donation_first_request WHERE donation_id = ?", (donation_id,))
+            else:
+                self.cursor.execute(
+                    "UPDATE donation_first_request SET first_request_at = ? WHERE donation_id = ?",
+                    (first_request_at, donation_id)
+                )
+
+    def _count_new_messages(self):
+        """Add messages written since the message watermark to the message count."""
+        self.cursor.execute("SELECT watermark FROM engagement_counters WHERE name = 'messages'")
+        row = self.cursor.fetchone()
+        watermark = row['watermark'] if row else 0
+        self.cursor.execute(
+            "SELECT COUNT(*) as count, MAX(id) as max_id FROM messages WHERE id > ?",
+            (watermark,)
+        )
+        row = self.cursor.fetchone()
+        if row['count']:
+            self.cursor.execute(
+                """
+                INSERT INTO engagement_counters (name, value, watermark) VALUES ('messages', ?, ?)
+                ON CONFLICT (name) DO UPDATE SET value = value + excluded.value, watermark = excluded.watermark
+                """,
+                (row['count'], row['max_id'])
+            )
+
+    def rebuild(self):
+        """Recompute every table from the full history and reset the log offset."""
+        # Deleting first takes the write lock, so the log head matches the rows read below
+        for table in ('user_activity', 'user_weekly_activity', 'donation_first_request', 'engagement_counters'):
+            self.cursor.execute(f"DELETE FROM {table}")
+        self.changes.set_offset(CONSUMER, self.changes.head())
+
+        for role, (table, user_column) in ROLES.items():
+            self.cursor.execute(
+                f"""
+                INSERT INTO user_activity (role, user_id, activity_count, first_at, last_at)
+                SELECT ?, {user_column}, COUNT(*), MIN(created_at), MAX(created_at)
+                FROM {table}_all GROUP BY {user_column}
+                """,
+                (role,)
+            )
+            self.cursor.execute(
+                f"""
+                INSERT INTO user_weekly_activity (role, user_id, week)
+                SELECT DISTINCT ?, {user_column}, {WEEK_OF.format(column='created_at')}
+                FROM {table}_all
+                """,
+                (role,)
+            )
+        self.cursor.execute(
+            """
+            INSERT INTO donation_first_request (donation_id, first_request_at)
+            SELECT donation_id, MIN(created_at) FROM requests_all GROUP BY donation_id
+            """
+        )
+        self.cursor.execute(
+            """
+            UPDATE donation_first_request
+            SET donation_created_at = (SELECT created_at FROM donations_all WHERE id = donation_id)
+            """
+        )
+        self.cursor.execute(
+            """
+            INSERT INTO engagement_counters (name, value, watermark)
+            SELECT 'messages', COUNT(*), COALESCE(MAX(id), 0) FROM messages
+            """
+        )
+
+    def role_summary(self, role, top=5):
+        """Return (user count, total activity, recurring users, [(user_id, count)] of the top users)."""
+        self.cursor.execute(
+            """
+            SELECT COUNT(*) as users, COALESCE(SUM(activity_count), 0) as total,
+                   COUNT(*) FILTER (WHERE activity_count > 1) as recurring
+            FROM user_activity WHERE role = ? AND activity_count > 0
+            """,
+            (role,)
+        )
+        row = self.cursor.fetchone()
+        self.cursor.execute(
+            """
+            SELECT user_id, activity_count FROM user_activity
+            WHERE role = ? AND activity_count > 0
+            ORDER BY activity_count DESC, user_id
+            LIMIT ?
+            """,
+            (role, top)
+        )
+        top_users = [(r['user_id'], r['activity_count']) for r in self.cursor.fetchall()]
+        return row['users'], row['total'], row['recurring'], top_users
+
+    def activity_counts(self, role):
+        """Return {user_id: activity count} for the active users of a role, most active first."""
+        self.cursor.execute(
+            """
+            SELECT user_id, activity_count FROM user_activity
+            WHERE role = ? AND activity_count > 0
+            ORDER BY activity_count DESC, user_id
+            """,
+            (role,)
+        )
+        return {row['user_id']: row['activity_count'] for row in self.cursor.fetchall()}
+
+    def message_count(self):
+        self.cursor.execute("SELECT value FROM engagement_counters WHERE name = 'messages'")
+        row = self.cursor.fetchone()
+        return row['value'] if row else 0
+
+    def retention_cohorts(self, role, weeks=12, since=None, until=None):
+        """Return weekly cohorts of users by first active week, with the share active in each later week.
+
+        Cohorts start in [since, until) when given; each lists its size and
+        retention for week offsets 0..weeks.
+        """
+        # Cohorts are labelled by the date their week starts
+        since = since and str(since)[:10]
+        until = until and str(until)[:10]
+        self.cursor.execute(
+            f"""
+            WITH activity AS (
+                SELECT user_id, week, MIN(week) OVER (PARTITION BY user_id) as cohort
+                FROM user_weekly_activity WHERE role = ?
+            ),
+            cohort_weeks AS (
+                SELECT cohort, week - cohort as week_offset, COUNT(*) as active
+                FROM activity
+                GROUP BY cohort, week_offset
+            )
+            SELECT
+                {WEEK_START.format(week='cohort')} as cohort_week,
+                week_offset,
+                active,
+                FIRST_VALUE(active) OVER (PARTITION BY cohort ORDER BY week_offset) as cohort_size
+            FROM cohort_weeks
+            WHERE week_offset <= ?
+            ORDER BY cohort, week_offset
+            """,
+            (role, weeks)
+        )
+        cohorts = {}
+        for row in self.cursor.fetchall():
+            if (since and row['cohort_week'] < since) or (until and row['cohort_week'] >= until):
+                continue
+            cohort = cohorts.setdefault(row['cohort_week'], {
+                "cohort_week": row['cohort_week'],
+                "size": row['cohort_size'],
+                "retention": [0.0] * (weeks + 1)
+            })
+            cohort["retention"][row['week_offset']] = round(row['active'] / row['cohort_size'] * 100, 1)
+        return list(cohorts.values())
+
+    def time_to_first_request(self, since=None, until=None, weeks=12):
+        """Return percentiles of hours from a donation's creation to its first request.
+
+        Overall and for each of the last `weeks` donation weeks, over donations
+        created in [since, until) when given.
+        """
+        window = []
+        params = []
+        if since:
+            window.append("donation_created_at >= ?")
+            params.append(since)
+        if until:
+            window.append("donation_created_at < ?")
+            params.append(until)
+        where = ' AND '.join(['donation_created_at IS NOT NULL'] + window)
+
+        self.cursor.execute(
+            f"""
+            WITH delays AS (
+                SELECT
+                    {WEEK_OF.format(column='donation_created_at')} as week,
+                    MAX(0.0, (julianday(first_request_at) - julianday(donation_created_at)) * 24) as hours
+                FROM donation_first_request
+                WHERE {where}
+            ),
+            ranked AS (
+                SELECT week, hours,
+                       ROW_NUMBER() OVER (ORDER BY hours) as overall_rank,
+                       COUNT(*) OVER () as overall_count,
+                       ROW_NUMBER() OVER (PARTITION BY week ORDER BY hours) as week_rank,
+                       COUNT(*) OVER (PARTITION BY week) as week_count
+                FROM delays
+            )
+            SELECT
+                NULL as week, MAX(overall_count) as donations,
+                MAX(hours) FILTER (WHERE overall_rank = (overall_count + 1) / 2) as median_hours,
+                MAX(hours) FILTER (WHERE overall_rank = MAX(1, CAST(overall_count * 0.9 AS INTEGER))) as p90_hours
+            FROM ranked
+            UNION ALL
+            SELECT * FROM (
+                SELECT
+                    {WEEK_START.format(week='week')} as week, MAX(week_count),
+                    MAX(hours) FILTER (WHERE week_rank = (week_count + 1) / 2),
+                    MAX(hours) FILTER (WHERE week_rank = MAX(1, CAST(week_count * 0.9 AS INTEGER)))
+                FROM ranked
+                GROUP BY ranked.week
+                ORDER BY ranked.week DESC
+                LIMIT ?
+            )
+            """,
+            (*params, weeks)
+        )
+        rows = self.cursor.fetchall()
+        overall, by_week = rows[0], rows[1:]
+
+        def summary(row):
+            return {
+                "donations": row['donations'] or 0,
+                "median_hours": round(row['median_hours'], 1) if row['median_hours'] is not None else None,
+                "p90_hours": round(row['p90_hours'], 1) if row['p90_hours'] is not None else None
+            }
+
+        return {
+            **summary(overall),
+            "weekly": [{"week": row['week'], **summary(row)} for row in reversed(by_week)]
+        }
+
+
+# Maintenance entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the user engagement store.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database path")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute from the full history")
+    parser.add_argument('--weeks', type=int, default=8, help="Weeks of retention to show")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        store = UserEngagementStore(conn)
+        if args.rebuild:
+            store.rebuild()
+        else:
+            store.sync()
+        conn.commit()
+        for role in ROLES:
+            users, total, recurring, _ = store.role_summary(role)
+            print(f"{role}s: {users} active, {total} total, {recurring} recurring")
+            for cohort in store.retention_cohorts(role, args.weeks)[-args.weeks:]:
+                print(f"  {cohort['cohort_week']} ({cohort['size']:5}): "
+                      + ' '.join(f"{r:5.1f}" for r in cohort['retention']))
+        print(json.dumps(store.time_to_first_request(weeks=args.weeks), indent=2))
+    except sqlite3.Error as e:
+        print(f"Engagement store error: {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,170 @@
+"""
+ExpirySweeper: Background maintenance that keeps the hot donation tables small.
+
+Each sweep marks available donations whose expiry date has passed as
+'expired', then moves old finished donations and requests into the cold
+archive tables (see `coldStorage`). Both steps run in small id batches with a
+commit per batch, so the Node backend is never locked out for long. Status
+changes go through the normal tables, so the change log triggers keep the
+derived stores in step. The command-line job then flushes archived rows into
+monthly partition files (see `archivePartitions`).
+
+Run once, or keep running every 15 minutes:
+    python agents/expirySweeper.py --db database/foodcycle.sqlite --once
+    python agents/expirySweeper.py --db database/foodcycle.sqlite --interval 900
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.archivePartitions import ArchivePartitions
+from agents.changeLog import ChangeLog
+from agents.coldStorage import archive_batch, create_cold_storage, create_union_views, drop_union_views
+
+
+class ExpirySweeper:
+    def __init__(self, conn, batch_size=500, archive_after_days=90):
+        """Initialize the sweeper on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.batch_size = batch_size
+        self.archive_after_days = archive_after_days
+        self.migrate_status_check()
+        create_cold_storage(self.cursor)
+        # Lets each batch find the next expired available donations without a scan
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_donations_status_expiry ON donations (status, expiry_date)"
+        )
+        self.conn.commit()
+
+    def migrate_status_check(self):
+        """Allow 'expired' in the donations status CHECK constraint.
+
+        SQLite cannot alter a CHECK constraint, so the table is rebuilt with
+        the same definition, rows, indexes and triggers.
+        """
+        self.cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'donations'")
+        row = self.cursor.fetchone()
+        if row is None or "'expired'" in row['sql'] or "'completed')" not in row['sql']:
+            return
+
+        create_sql = row['sql'].replace("'completed')", "'completed', 'expired')", 1)
+        self.cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = 'donations' AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+        )
+        dependents = [r['sql'] for r in self.cursor.fetchall()]
+
+        self.conn.commit()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Dropping the table drops its AUTOINCREMENT high-water mark, so keep it
+            self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'donations'")
+            seq = self.cursor.fetchone()
+            drop_union_views(self.cursor)
+            self.cursor.execute(create_sql.replace('donations', 'donations_migrated', 1))
+            self.cursor.execute("INSERT INTO donations_migrated SELECT * FROM donations")
+            self.cursor.execute("DROP TABLE donations")
+            self.cursor.execute("ALTER TABLE donations_migrated RENAME TO donations")
+            if seq:
+                self.cursor.execute(
+                    "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'donations'",
+                    (seq['seq'],)
+                )
+            for sql in dependents:
+                self.cursor.execute(sql)
+            self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'donations_archive'")
+            if self.cursor.fetchone():
+                create_union_views(self.cursor)
+            self.conn.commit()
+            print("Migrated donations table to allow the 'expired' status")
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    def expire_batch(self, today=None):
+        """Mark up to batch_size available donations past their expiry date as expired."""
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        self.cursor.execute(
+            """
+            UPDATE donations SET status = 'expired'
+            WHERE id IN (
+                SELECT id FROM donations
+                WHERE status = 'available' AND expiry_date < ?
+                ORDER BY expiry_date
+                LIMIT ?
+            )
+            """,
+            (today, self.batch_size)
+        )
+        return self.cursor.rowcount
+
+    def sweep(self, now=None):
+        """Expire stale donations and archive old finished rows.
+
+        Returns {expired, archived_donations, archived_requests}.
+        """
+        now = now or datetime.now()
+        today = now.strftime('%Y-%m-%d')
+        cutoff = (now - timedelta(days=self.archive_after_days)).strftime('%Y-%m-%d %H:%M:%S')
+        result = {"expired": 0, "archived_donations": 0, "archived_requests": 0}
+
+        try:
+            while True:
+                count = self.expire_batch(today)
+                self.conn.commit()
+                result["expired"] += count
+                if count < self.batch_size:
+                    break
+
+            for table in ('requests', 'donations'):
+                while True:
+                    count = archive_batch(self.cursor, table, cutoff, self.batch_size)
+                    self.conn.commit()
+                    result[f"archived_{table}"] += count
+                    if count < self.batch_size:
+                        break
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error sweeping donations: {e}")
+
+        return result
+
+
+# Background entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expire stale donations and archive old rows.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database")
+    parser.add_argument('--once', action='store_true', help="Run a single sweep and exit")
+    parser.add_argument('--interval', type=int, default=900, help="Seconds between sweeps")
+    parser.add_argument('--archive-after-days', type=int, default=90,
+                        help="Archive finished rows older than this many days")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--partition-dir', help="Directory for monthly archive partitions")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    ChangeLog(conn)
+    sweeper = ExpirySweeper(conn, args.batch_size, args.archive_after_days)
+    partitions = ArchivePartitions(conn, args.db, args.partition_dir)
+
+    try:
+        while True:
+            print(f"Sweep at {datetime.now().isoformat(timespec='seconds')}: {sweeper.sweep()}")
+            for month, (donations, requests) in partitions.flush().items():
+                print(f"  Archived {donations} donations and {requests} requests from {month}")
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
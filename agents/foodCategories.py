@@ -0,0 +1,53 @@
+"""
+Food category taxonomies shared by the agents and their derived-state stores.
+
+Two keyword taxonomies are in use: the basic one applied by `DonorAgent` and
+`RecipientAgent`, and the extended one applied by `RecommendationAgent`.
+"""
+
+# Keyword lists for the extended taxonomy, checked in order
+FOOD_CATEGORIES = {
+    'vegetables': ['vegetable', 'veg', 'greens', 'lettuce', 'spinach', 'carrot', 'tomato'],
+    'fruits': ['fruit', 'apple', 'banana', 'orange', 'berry', 'berries'],
+    'dairy': ['dairy', 'milk', 'cheese', 'yogurt', 'butter', 'cream'],
+    'bakery': ['bread', 'bakery', 'cake', 'pastry', 'roll', 'bun'],
+    'canned': ['canned', 'can', 'preserved', 'jar', 'tin'],
+    'grains': ['rice', 'pasta', 'grain', 'cereal', 'oat', 'wheat'],
+    'meat': ['meat', 'beef', 'chicken', 'pork', 'fish', 'seafood', 'poultry'],
+    'ready': ['prepared', 'meal', 'cooked', 'ready', 'leftover']
+}
+
+
+def categorize_basic(food_name):
+    """Categorize food using the donor and recipient agents' keyword rules."""
+    food_name = food_name.lower()
+    if 'vegetable' in food_name or 'veg' in food_name:
+        return 'vegetables'
+    elif 'fruit' in food_name:
+        return 'fruits'
+    elif 'bread' in food_name or 'bakery' in food_name:
+        return 'bakery'
+    elif 'canned' in food_name:
+        return 'canned goods'
+    elif 'dairy' in food_name or 'milk' in food_name or 'cheese' in food_name:
+        return 'dairy'
+    return 'other'
+
+
+def categorize_extended(food_name):
+    """Categorize food using the recommendation agent's keyword lists."""
+    food_name = food_name.lower()
+
+    for category, keywords in FOOD_CATEGORIES.items():
+        for keyword in keywords:
+            if keyword in food_name:
+                return category
+
+    return 'other'
+
+
+# Taxonomy name -> categorizer, used by stores that keep per-taxonomy counts
+TAXONOMIES = {
+    'basic': categorize_basic,
+    'extended': categorize_extended
+}
@@ -8,127 +8,287 @@ import os
 import sys
 from datetime import datetime, timedelta
 
-# Add parent directory to path to access shared modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-class InsightsAgent:
-    def __init__(self, db_path='database/foodcycle.sqlite'):
-        """Initialize the insights agent with database connection."""
-        self.db_path = db_path
-        self.connect_db()
+from agents.archivePartitions import ArchivePartitions, PartitionedConnection, format_bound
+from agents.donationSample import CONFIDENCE, StratifiedDonationSample
+from agents.engagementStats import UserEngagementStore
+from agents.lazyConnection import LazyConnection
+from agents.quantities import estimate_quantity_kg, estimate_quantity_kg_simple
+from agents.readReplica import PRIMARY_METADATA, open_replica, replica_metadata
+from agents.reportRendering import compute_etag, iter_report_json
+
+# Constants for impact calculation
+IMPACT_FACTORS = {
+    'meals_per_kg': 2.5,  # Estimated number of meals per kg of food
+    'co2_per_kg': 2.5,    # Estimated kg of CO2 saved per kg of food
+    'water_per_kg': 1000   # Estimated liters of water saved per kg of food
+}
+
+# Report sections in output order: (metric method, source tables)
+REPORT_SECTIONS = {
+    'overall_impact': ('calculate_overall_impact', ('donations', 'requests')),
+    'user_engagement': ('generate_user_engagement_metrics', ('donations', 'requests', 'messages')),
+    'food_waste_prevention': ('analyze_food_waste_prevention', ('donations',)),
+    'geographic_insights': ('generate_geographic_insights', ('donations',)),
+    'time_series_data': ('generate_time_series_data', ('donations',)),
+    'retention_cohorts': ('generate_retention_cohorts', ('donations', 'requests')),
+    'time_to_first_request': ('analyze_time_to_first_request', ('donations', 'requests'))
+}
+
+# Sections computed from partial results that merge across databases (see agents/scatterGather.py):
+# (partial method, method that turns a merged partial into the section)
+MERGEABLE_SECTIONS = {
+    'overall_impact': ('overall_impact_partial', 'overall_impact_from_partial'),
+    'user_engagement': ('user_engagement_partial', 'user_engagement_from_partial'),
+    'food_waste_prevention': ('food_waste_partial', 'food_waste_from_partial'),
+    'geographic_insights': ('geographic_partial', 'geographic_from_partial'),
+    'time_series_data': ('time_series_partial', 'time_series_from_partial')
+}
+
+# Sections estimated from the stratified donation sample in approximate mode (see agents/donationSample.py)
+APPROXIMATE_SECTIONS = {
+    'overall_impact': 'approximate_overall_impact',
+    'food_waste_prevention': 'approximate_food_waste',
+    'geographic_insights': 'approximate_geographic'
+}
+
+class InsightsAgent(LazyConnection):
+    lazy_attributes = {
+        **dict.fromkeys(('conn', 'cursor', 'partitions', 'using_replica'), 'connect_db'),
+        'history_conn': 'connect_history',
+        'engagement': 'connect_engagement',
+        'donation_sample': 'connect_sample',
+        'snapshot': 'init_snapshot'
+    }
+    impact_factors = IMPACT_FACTORS
+
+    def __init__(self, db_path='database/foodcycle.sqlite', snapshot_path=None, since=None, until=None,
+                 replica_path=None, approximate=False):
+        """Initialize the insights agent; the snapshot or database is opened on first use.
         
-        # Constants for impact calculation
-        self.impact_factors = {
-            'meals_per_kg': 2.5,  # Estimated number of meals per kg of food
-            'co2_per_kg': 2.5,    # Estimated kg of CO2 saved per kg of food
-            'water_per_kg': 1000   # Estimated liters of water saved per kg of food
-        }
+        When snapshot_path points to a snapshot exported by
+        agents/columnarSnapshot.py, all analytics are computed from its
+        memory-mapped columns and the database is not opened.
+        
+        since/until restrict every metric to donations and requests created
+        in [since, until); only the archive partitions for those months are
+        opened. Snapshots cover the full history, so a windowed report always
+        runs against the database.
+        
+        replica_path points to a read replica maintained by
+        agents/readReplica.py; when it exists, queries run there instead of on
+        the primary and the report metadata carries its staleness.
+        
+        approximate estimates the APPROXIMATE_SECTIONS from the stratified
+        donation sample instead of scanning every donation; those sections
+        carry 95% confidence intervals and leave distinct counts as None.
+        """
+        self.db_path = db_path
+        self.approximate = approximate
+        self.since = since
+        self.until = until
+        self.replica_path = replica_path
+        if snapshot_path and (since or until):
+            print("Analytics snapshot covers the full history; running windowed report against the database")
+            snapshot_path = None
+        self.snapshot_path = snapshot_path
     
     def connect_db(self):
         """Connect to the SQLite database."""
         try:
-            self.conn = sqlite3.connect(self.db_path)
-            self.conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+            self.conn = open_replica(self.replica_path)
+            self.using_replica = self.conn is not None
+            if not self.using_replica:
+                if self.replica_path:
+                    print(f"Read replica {self.replica_path} not found; querying the primary database")
+                self.conn = sqlite3.connect(self.db_path, factory=PartitionedConnection)
+                self.conn.row_factory = sqlite3.Row  # Return rows as dictionaries
             self.cursor = self.conn.cursor()
-            print(f"Connected to database: {self.db_path}")
+            # Partition files are shared with the primary, so resolve them from db_path
+            self.partitions = ArchivePartitions(self.conn, self.db_path)
+            self.partitions.open(self.since, self.until)
+            print(f"Connected to database: {self.replica_path if self.using_replica else self.db_path}")
         except sqlite3.Error as e:
             print(f"Database connection error: {e}")
             sys.exit(1)
     
+    def connect_history(self):
+        """Open the full-history connection used by the maintained stores.
+        
+        The stores advance from the change log, so they need the full-history
+        views: a windowed report opens a dedicated connection for them.
+        """
+        self.history_conn = None
+        try:
+            if self.using_replica or not (self.since or self.until):
+                self.history_conn = self.conn
+            else:
+                self.history_conn = sqlite3.connect(self.db_path, factory=PartitionedConnection)
+                self.history_conn.row_factory = sqlite3.Row
+                ArchivePartitions(self.history_conn, self.db_path).open()
+        except sqlite3.Error as e:
+            print(f"Error opening full-history connection: {e}")
+            self.history_conn = None
+    
+    def connect_engagement(self):
+        """Open the maintained engagement store (see agents/engagementStats.py).
+        
+        On a read replica the store is read as replicated, without catching
+        up: refresh_replica syncs it in the copy before swapping it in.
+        """
+        self.engagement = None
+        if self.history_conn is None:
+            return
+        try:
+            self.engagement = UserEngagementStore(self.history_conn)
+            self.history_conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error opening engagement store: {e}")
+            self.engagement = None
+    
+    def synced_engagement(self):
+        """Return the engagement store caught up with the change log, or None if unavailable."""
+        if self.engagement is None:
+            return None
+        try:
+            if not self.using_replica:
+                self.engagement.sync()
+                self.history_conn.commit()
+            return self.engagement
+        except sqlite3.Error as e:
+            print(f"Error refreshing engagement store: {e}")
+            self.history_conn.rollback()
+            return None
+    
+    def connect_sample(self):
+        """Open the stratified donation sample (see agents/donationSample.py).
+        
+        On a read replica the sample is read as replicated, like the
+        engagement store; refresh_replica syncs it in the copy.
+        """
+        self.donation_sample = None
+        if self.history_conn is None:
+            return
+        try:
+            self.donation_sample = StratifiedDonationSample(self.history_conn)
+            self.history_conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error opening donation sample: {e}")
+            self.donation_sample = None
+    
+    def synced_sample(self):
+        """Return the donation sample caught up with the change log, or None if unavailable."""
+        if self.donation_sample is None:
+            return None
+        try:
+            if not self.using_replica:
+                self.donation_sample.sync()
+                self.history_conn.commit()
+            return self.donation_sample
+        except sqlite3.Error as e:
+            print(f"Error refreshing donation sample: {e}")
+            self.history_conn.rollback()
+            return None
+    
     def close_connection(self):
         """Close the database connection."""
-        if hasattr(self, 'conn'):
+        if self.is_loaded('history_conn') and self.history_conn is not None \
+                and self.history_conn is not self.conn:
+            self.history_conn.close()
+        if self.is_loaded('conn'):
             self.conn.close()
             print("Database connection closed")
     
+    def data_freshness(self):
+        """Return where the report's data came from and how stale it is."""
+        if self.snapshot is not None:
+            exported_at = self.snapshot.manifest['exported_at']
+            age = datetime.utcnow() - datetime.strptime(exported_at, '%Y-%m-%d %H:%M:%S')
+            return {
+                "source": "snapshot",
+                "refreshed_at": exported_at,
+                "staleness_seconds": max(0, int(age.total_seconds()))
+            }
+        if self.using_replica:
+            return replica_metadata(self.conn)
+        return dict(PRIMARY_METADATA)
+    
+    def init_snapshot(self):
+        """Open the snapshot named at construction."""
+        self.snapshot = self.load_snapshot(self.snapshot_path)
+    
+    def load_snapshot(self, snapshot_path):
+        """Open the columnar snapshot, or return None to query the database."""
+        if not snapshot_path:
+            return None
+        try:
+            # Imported here so NumPy is only loaded when a snapshot is used
+            from agents.columnarSnapshot import ColumnarSnapshot
+        except ImportError:
+            print("NumPy is not installed; running analytics against the database")
+            return None
+        try:
+            snapshot = ColumnarSnapshot(snapshot_path)
+            print(f"Using analytics snapshot: {snapshot_path}")
+            return snapshot
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading analytics snapshot: {e}")
+            return None
+    
     def calculate_overall_impact(self):
         """Calculate the overall impact of all successful donations."""
+        if self.snapshot is not None:
+            return self.snapshot.calculate_overall_impact(self.impact_factors)
+        
         try:
-            # Get all completed donations
-            self.cursor.execute(
-                "SELECT * FROM donations WHERE status = 'completed'"
-            )
-            donations = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Extract quantities and normalize
-            total_kg = 0
-            for donation in donations:
-                quantity = donation['quantity'].lower()
-                
-                # Basic parsing of quantity strings
-                if 'kg' in quantity:
-                    try:
-                        kg = float(quantity.split('kg')[0].strip())
-                        total_kg += kg
-                    except ValueError:
-                        pass
-                elif 'g' in quantity and 'kg' not in quantity:
-                    try:
-                        g = float(quantity.split('g')[0].strip())
-                        total_kg += g / 1000
-                    except ValueError:
-                        pass
-                elif 'lb' in quantity or 'pound' in quantity:
-                    try:
-                        if 'lb' in quantity:
-                            lb = float(quantity.split('lb')[0].strip())
-                        else:
-                            lb = float(quantity.split('pound')[0].strip())
-                        total_kg += lb * 0.453592  # Convert lb to kg
-                    except ValueError:
-                        pass
-                elif 'item' in quantity or 'piece' in quantity or 'pcs' in quantity:
-                    try:
-                        if 'item' in quantity:
-                            items = float(quantity.split('item')[0].strip())
-                        elif 'piece' in quantity:
-                            items = float(quantity.split('piece')[0].strip())
-                        else:
-                            items = float(quantity.split('pcs')[0].strip())
-                        total_kg += items * 0.2  # Assume average item weight is 200g
-                    except ValueError:
-                        pass
-                else:
-                    # Try to extract just the number
-                    try:
-                        parts = quantity.split()
-                        if parts and parts[0].replace('.', '', 1).isdigit():
-                            num = float(parts[0])
-                            if len(parts) > 1:
-                                unit = parts[1].lower()
-                                if unit in ['box', 'boxes', 'package', 'packages', 'pack', 'packs']:
-                                    total_kg += num * 0.5  # Assume average package is 500g
-                                else:
-                                    total_kg += num * 0.3  # Generic assumption for unspecified units
-                            else:
-                                total_kg += num * 0.3  # Just a number, assume kg
-                    except (ValueError, IndexError):
-                        # If we can't parse it, make a conservative estimate
-                        total_kg += 0.2
-            
-            # Calculate impact metrics
-            impact = {
-                "total_donations": len(donations),
-                "estimated_total_kg": round(total_kg, 2),
-                "estimated_meals_provided": round(total_kg * self.impact_factors['meals_per_kg']),
-                "estimated_co2_saved": round(total_kg * self.impact_factors['co2_per_kg'], 2),
-                "estimated_water_saved": round(total_kg * self.impact_factors['water_per_kg']),
-                "unique_donors": len(set(d['donor_id'] for d in donations)),
-                "unique_recipients": self.count_unique_recipients()
-            }
-            
-            return impact
+            return self.overall_impact_from_partial(self.overall_impact_partial())
         except sqlite3.Error as e:
             print(f"Error calculating overall impact: {e}")
             return {}
     
+    def overall_impact_partial(self):
+        """Read the mergeable inputs of the overall impact: counts, kg and the sets of donors and recipients."""
+        # Get all completed donations
+        self.cursor.execute(
+            "SELECT * FROM donations_all WHERE status = 'completed'"
+        )
+        donations = [dict(row) for row in self.cursor.fetchall()]
+        self.cursor.execute("SELECT DISTINCT recipient_id FROM requests_all WHERE status = 'accepted'")
+        
+        return {
+            "total_donations": len(donations),
+            # Extract quantities and normalize
+            "total_kg": sum(estimate_quantity_kg(donation['quantity']) for donation in donations),
+            "donors": set(d['donor_id'] for d in donations),
+            "recipients": set(row['recipient_id'] for row in self.cursor.fetchall())
+        }
+    
+    def overall_impact_from_partial(self, partial):
+        """Calculate the impact metrics from an overall impact partial."""
+        total_kg = partial['total_kg']
+        return {
+            "total_donations": partial['total_donations'],
+            "estimated_total_kg": round(total_kg, 2),
+            "estimated_meals_provided": round(total_kg * self.impact_factors['meals_per_kg']),
+            "estimated_co2_saved": round(total_kg * self.impact_factors['co2_per_kg'], 2),
+            "estimated_water_saved": round(total_kg * self.impact_factors['water_per_kg']),
+            "unique_donors": len(partial['donors']),
+            "unique_recipients": len(partial['recipients'])
+        }
+    
     def count_unique_recipients(self):
         """Count the number of unique recipients who received donations."""
+        if self.snapshot is not None:
+            return self.snapshot.count_unique_recipients()
+        
         try:
             self.cursor.execute(
                 """
                 SELECT COUNT(DISTINCT recipient_id) as count 
-                FROM requests 
+                FROM requests_all 
                 WHERE status = 'accepted'
                 """
             )
@@ -140,150 +300,136 @@ class InsightsAgent:
     
     def generate_time_series_data(self, period='monthly'):
         """Generate time series data for donations over time."""
+        if self.snapshot is not None:
+            return self.snapshot.generate_time_series_data(period)
+        
         try:
-            if period == 'monthly':
-                date_format = '%Y-%m'
-                sql_format = "strftime('%Y-%m', created_at)"
-            elif period == 'weekly':
-                date_format = '%Y-%W'
-                sql_format = "strftime('%Y-%W', created_at)"
-            elif period == 'daily':
-                date_format = '%Y-%m-%d'
-                sql_format = "date(created_at)"
-            else:
-                date_format = '%Y-%m'
-                sql_format = "strftime('%Y-%m', created_at)"
-            
-            # Get donation counts by period
-            self.cursor.execute(
-                f"""
-                SELECT 
-                    {sql_format} as period,
-                    COUNT(*) as donation_count
-                FROM donations
-                GROUP BY period
-                ORDER BY period
-                """
-            )
-            donation_counts = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Get request counts by period
+            return self.time_series_from_partial(self.time_series_partial(period))
+        except sqlite3.Error as e:
+            print(f"Error generating time series data: {e}")
+            return {}
+    
+    def time_series_partial(self, period='monthly'):
+        """Read donation and request counts per period as {period: count} maps."""
+        if period == 'weekly':
+            sql_format = "strftime('%Y-%W', created_at)"
+        elif period == 'daily':
+            sql_format = "date(created_at)"
+        else:
+            sql_format = "strftime('%Y-%m', created_at)"
+        
+        partial = {"period_type": period}
+        for key, table in (('donations', 'donations_all'), ('requests', 'requests_all')):
             self.cursor.execute(
                 f"""
                 SELECT 
                     {sql_format} as period,
-                    COUNT(*) as request_count
-                FROM requests
+                    COUNT(*) as count
+                FROM {table}
                 GROUP BY period
-                ORDER BY period
                 """
             )
-            request_counts = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Combine data for visualization
-            time_series_data = {
-                "period_type": period,
-                "donations": donation_counts,
-                "requests": request_counts
-            }
-            
-            return time_series_data
-        except sqlite3.Error as e:
-            print(f"Error generating time series data: {e}")
-            return {}
+            partial[key] = {row['period']: row['count'] for row in self.cursor.fetchall()}
+        return partial
+    
+    def time_series_from_partial(self, partial):
+        """Lay out a time series partial for visualization, in period order."""
+        def ordered(counts, count_key):
+            # NULL periods sort first, as in SQL
+            return [{"period": period, count_key: counts[period]}
+                    for period in sorted(counts, key=lambda p: (p is not None, p))]
+        
+        return {
+            "period_type": partial['period_type'],
+            "donations": ordered(partial['donations'], 'donation_count'),
+            "requests": ordered(partial['requests'], 'request_count')
+        }
     
     def analyze_food_waste_prevention(self):
         """Analyze how much food waste was prevented through the platform."""
+        if self.snapshot is not None:
+            return self.snapshot.analyze_food_waste_prevention(self.impact_factors)
+        
         try:
-            # Get donations that would have expired soon when they were completed
-            threshold_days = 5  # Consider food "saved" if it was completed within 5 days of expiry
-            
-            self.cursor.execute(
-                """
-                SELECT 
-                    COUNT(*) as count,
-                    julianday(expiry_date) - julianday(created_at) as shelf_life_days
-                FROM donations
-                WHERE 
-                    status = 'completed' 
-                    AND expiry_date IS NOT NULL
-                    AND julianday(expiry_date) - julianday(created_at) <= ?
-                """,
-                (threshold_days,)
-            )
-            nearly_expired = self.cursor.fetchone()
-            
-            # Get donations completed by expiry date proximity
-            self.cursor.execute(
-                """
-                SELECT 
-                    CASE
-                        WHEN julianday(expiry_date) - julianday(created_at) <= 3 THEN 'very_short'
-                        WHEN julianday(expiry_date) - julianday(created_at) <= 7 THEN 'short'
-                        WHEN julianday(expiry_date) - julianday(created_at) <= 14 THEN 'medium'
-                        ELSE 'long'
-                    END as shelf_life,
-                    COUNT(*) as count
-                FROM donations
-                WHERE 
-                    status = 'completed' 
-                    AND expiry_date IS NOT NULL
-                GROUP BY shelf_life
-                ORDER BY count DESC
-                """
-            )
-            shelf_life_distribution = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Estimate food saved from waste
-            # Assume donations completed with short shelf life would have been wasted
-            short_shelf_life_count = sum(item['count'] for item in shelf_life_distribution 
-                                        if item['shelf_life'] in ['very_short', 'short'])
-            
-            # Estimate kg saved (similar to overall impact calculation)
-            saved_kg = 0
-            self.cursor.execute(
-                """
-                SELECT quantity 
-                FROM donations 
-                WHERE status = 'completed' 
-                AND expiry_date IS NOT NULL
-                AND julianday(expiry_date) - julianday(created_at) <= 7
-                """
-            )
-            short_quantities = [row['quantity'] for row in self.cursor.fetchall()]
-            
-            # Basic parsing of quantity strings (simplified version)
-            for quantity in short_quantities:
-                quantity = quantity.lower()
-                if 'kg' in quantity:
-                    try:
-                        kg = float(quantity.split('kg')[0].strip())
-                        saved_kg += kg
-                    except ValueError:
-                        saved_kg += 0.5  # Default assumption
-                else:
-                    saved_kg += 0.5  # Default assumption
-            
-            waste_prevention = {
-                "donations_saved_from_waste": short_shelf_life_count,
-                "percentage_of_total": round((short_shelf_life_count / max(1, self.count_completed_donations())) * 100),
-                "estimated_kg_saved": round(saved_kg, 2),
-                "environmental_impact": {
-                    "co2_prevented": round(saved_kg * self.impact_factors['co2_per_kg'], 2),
-                    "water_saved": round(saved_kg * self.impact_factors['water_per_kg'])
-                },
-                "shelf_life_distribution": shelf_life_distribution
-            }
-            
-            return waste_prevention
+            return self.food_waste_from_partial(self.food_waste_partial())
         except sqlite3.Error as e:
             print(f"Error analyzing food waste prevention: {e}")
             return {}
     
+    def food_waste_partial(self):
+        """Read completed donations per shelf-life bucket, the kg saved and the completed count."""
+        # Get donations completed by expiry date proximity
+        self.cursor.execute(
+            """
+            SELECT 
+                CASE
+                    WHEN julianday(expiry_date) - julianday(created_at) <= 3 THEN 'very_short'
+                    WHEN julianday(expiry_date) - julianday(created_at) <= 7 THEN 'short'
+                    WHEN julianday(expiry_date) - julianday(created_at) <= 14 THEN 'medium'
+                    ELSE 'long'
+                END as shelf_life,
+                COUNT(*) as count
+            FROM donations_all
+            WHERE 
+                status = 'completed' 
+                AND expiry_date IS NOT NULL
+            GROUP BY shelf_life
+            ORDER BY count DESC
+            """
+        )
+        shelf_life_counts = {row['shelf_life']: row['count'] for row in self.cursor.fetchall()}
+        
+        # Estimate kg saved (similar to overall impact calculation)
+        self.cursor.execute(
+            """
+            SELECT quantity 
+            FROM donations_all 
+            WHERE status = 'completed' 
+            AND expiry_date IS NOT NULL
+            AND julianday(expiry_date) - julianday(created_at) <= 7
+            """
+        )
+        short_quantities = [row['quantity'] for row in self.cursor.fetchall()]
+        
+        return {
+            "shelf_life": shelf_life_counts,
+            # Basic parsing of quantity strings (simplified version)
+            "saved_kg": sum(estimate_quantity_kg_simple(quantity) for quantity in short_quantities),
+            "completed": self.count_completed_donations()
+        }
+    
+    def food_waste_from_partial(self, partial):
+        """Estimate the waste prevented from a food waste partial."""
+        # Most common shelf life first; a stable sort keeps a single database's order
+        shelf_life_distribution = [
+            {"shelf_life": shelf_life, "count": count}
+            for shelf_life, count in sorted(partial['shelf_life'].items(), key=lambda x: -x[1])
+        ]
+        
+        # Estimate food saved from waste
+        # Assume donations completed with short shelf life would have been wasted
+        short_shelf_life_count = sum(item['count'] for item in shelf_life_distribution 
+                                    if item['shelf_life'] in ['very_short', 'short'])
+        saved_kg = partial['saved_kg']
+        
+        return {
+            "donations_saved_from_waste": short_shelf_life_count,
+            "percentage_of_total": round((short_shelf_life_count / max(1, partial['completed'])) * 100),
+            "estimated_kg_saved": round(saved_kg, 2),
+            "environmental_impact": {
+                "co2_prevented": round(saved_kg * self.impact_factors['co2_per_kg'], 2),
+                "water_saved": round(saved_kg * self.impact_factors['water_per_kg'])
+            },
+            "shelf_life_distribution": shelf_life_distribution
+        }
+    
     def count_completed_donations(self):
         """Count the total number of completed donations."""
+        if self.snapshot is not None:
+            return self.snapshot.count_completed_donations()
+        
         try:
-            self.cursor.execute("SELECT COUNT(*) as count FROM donations WHERE status = 'completed'")
+            self.cursor.execute("SELECT COUNT(*) as count FROM donations_all WHERE status = 'completed'")
             result = self.cursor.fetchone()
             return result['count'] if result else 0
         except sqlite3.Error as e:
@@ -292,131 +438,439 @@ class InsightsAgent:
     
     def generate_geographic_insights(self):
         """Generate insights based on geographic distribution of donations."""
+        if self.snapshot is not None:
+            return self.snapshot.generate_geographic_insights()
+        
         try:
-            # Get donation counts by location
-            self.cursor.execute(
-                """
-                SELECT 
-                    location,
-                    COUNT(*) as donation_count
-                FROM donations
-                WHERE location IS NOT NULL AND location != ''
-                GROUP BY location
-                ORDER BY donation_count DESC
-                """
-            )
-            location_data = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Calculate donation density per location
-            total_donations = sum(item['donation_count'] for item in location_data)
-            
-            for item in location_data:
-                item['percentage'] = round((item['donation_count'] / total_donations) * 100, 1)
-            
-            return {
-                "location_distribution": location_data,
-                "total_locations": len(location_data),
-                "most_active_location": location_data[0]['location'] if location_data else "Unknown"
-            }
+            return self.geographic_from_partial(self.geographic_partial())
         except sqlite3.Error as e:
             print(f"Error generating geographic insights: {e}")
             return {}
     
+    def geographic_partial(self):
+        """Read donation counts per location, most active first."""
+        self.cursor.execute(
+            """
+            SELECT 
+                location,
+                COUNT(*) as donation_count
+            FROM donations_all
+            WHERE location IS NOT NULL AND location != ''
+            GROUP BY location
+            ORDER BY donation_count DESC
+            """
+        )
+        return {"locations": {row['location']: row['donation_count'] for row in self.cursor.fetchall()}}
+    
+    def geographic_from_partial(self, partial):
+        """Calculate the location distribution from a geographic partial."""
+        location_data = [
+            {"location": location, "donation_count": count}
+            for location, count in sorted(partial['locations'].items(), key=lambda x: -x[1])
+        ]
+        
+        # Calculate donation density per location
+        total_donations = sum(item['donation_count'] for item in location_data)
+        
+        for item in location_data:
+            item['percentage'] = round((item['donation_count'] / total_donations) * 100, 1)
+        
+        return {
+            "location_distribution": location_data,
+            "total_locations": len(location_data),
+            "most_active_location": location_data[0]['location'] if location_data else "Unknown"
+        }
+    
     def generate_user_engagement_metrics(self):
         """Generate metrics on user engagement with the platform."""
+        if self.snapshot is not None:
+            return self.snapshot.generate_user_engagement_metrics()
+        
+        # The maintained counters cover the full history, so a windowed report still groups its rows
+        if not (self.since or self.until):
+            store = self.synced_engagement()
+            if store is not None:
+                try:
+                    return self.engagement_metrics_from_store(store)
+                except sqlite3.Error as e:
+                    print(f"Error reading engagement store: {e}")
+        
         try:
-            # Donor engagement
-            self.cursor.execute(
-                """
-                SELECT 
-                    donor_id,
-                    COUNT(*) as donation_count
-                FROM donations
-                GROUP BY donor_id
-                ORDER BY donation_count DESC
-                """
-            )
-            donor_activity = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Calculate donor engagement metrics
-            donor_count = len(donor_activity)
-            total_donations = sum(d['donation_count'] for d in donor_activity)
-            avg_donations_per_donor = round(total_donations / max(1, donor_count), 2)
-            
-            # Recurring donors (more than 1 donation)
-            recurring_donors = sum(1 for d in donor_activity if d['donation_count'] > 1)
-            recurring_donor_rate = round((recurring_donors / max(1, donor_count)) * 100, 1)
-            
-            # Top donors
-            top_donors = donor_activity[:5] if donor_activity else []
-            
-            # Recipient engagement
+            return self.user_engagement_from_partial(self.user_engagement_partial(use_store=False))
+        except sqlite3.Error as e:
+            print(f"Error generating user engagement metrics: {e}")
+            return {}
+    
+    def user_engagement_partial(self, use_store=True):
+        """Read donations per donor, requests per recipient and the message count.
+        
+        Unwindowed, the per-user counts come from the maintained engagement
+        store when it is available; otherwise the rows are grouped.
+        """
+        store = self.synced_engagement() if use_store and not (self.since or self.until) else None
+        if store is not None:
+            return {
+                "donors": store.activity_counts('donor'),
+                "recipients": store.activity_counts('recipient'),
+                "messages": store.message_count()
+            }
+        
+        partial = {}
+        for key, user_column, table in (('donors', 'donor_id', 'donations_all'),
+                                        ('recipients', 'recipient_id', 'requests_all')):
             self.cursor.execute(
-                """
+                f"""
                 SELECT 
-                    recipient_id,
-                    COUNT(*) as request_count
-                FROM requests
-                GROUP BY recipient_id
-                ORDER BY request_count DESC
+                    {user_column} as user_id,
+                    COUNT(*) as count
+                FROM {table}
+                GROUP BY {user_column}
+                ORDER BY count DESC
                 """
             )
-            recipient_activity = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Calculate recipient engagement metrics
-            recipient_count = len(recipient_activity)
-            total_requests = sum(r['request_count'] for r in recipient_activity)
-            avg_requests_per_recipient = round(total_requests / max(1, recipient_count), 2)
-            
-            # Recurring recipients (more than 1 request)
-            recurring_recipients = sum(1 for r in recipient_activity if r['request_count'] > 1)
-            recurring_recipient_rate = round((recurring_recipients / max(1, recipient_count)) * 100, 1)
-            
-            # Chat activity
-            self.cursor.execute("SELECT COUNT(*) as count FROM messages")
-            message_count = self.cursor.fetchone()['count']
-            
-            engagement_metrics = {
-                "donor_metrics": {
-                    "total_donors": donor_count,
-                    "avg_donations_per_donor": avg_donations_per_donor,
-                    "recurring_donor_rate": recurring_donor_rate,
-                    "top_donors": top_donors
-                },
-                "recipient_metrics": {
-                    "total_recipients": recipient_count,
-                    "avg_requests_per_recipient": avg_requests_per_recipient,
-                    "recurring_recipient_rate": recurring_recipient_rate
-                },
-                "communication_metrics": {
-                    "total_messages": message_count,
-                    "avg_messages_per_donation": round(message_count / max(1, total_donations), 2)
-                }
+            partial[key] = {row['user_id']: row['count'] for row in self.cursor.fetchall()}
+        
+        # Chat activity
+        self.cursor.execute("SELECT COUNT(*) as count FROM messages")
+        partial["messages"] = self.cursor.fetchone()['count']
+        return partial
+    
+    def user_engagement_from_partial(self, partial):
+        """Calculate the engagement metrics from a user engagement partial."""
+        # Most active first; a stable sort keeps a single database's order
+        donor_activity = sorted(partial['donors'].items(), key=lambda x: -x[1])
+        recipient_activity = partial['recipients'].values()
+        message_count = partial['messages']
+        
+        # Calculate donor engagement metrics
+        donor_count = len(donor_activity)
+        total_donations = sum(count for _, count in donor_activity)
+        avg_donations_per_donor = round(total_donations / max(1, donor_count), 2)
+        
+        # Recurring donors (more than 1 donation)
+        recurring_donors = sum(1 for _, count in donor_activity if count > 1)
+        recurring_donor_rate = round((recurring_donors / max(1, donor_count)) * 100, 1)
+        
+        # Top donors
+        top_donors = [{"donor_id": donor_id, "donation_count": count} for donor_id, count in donor_activity[:5]]
+        
+        # Calculate recipient engagement metrics
+        recipient_count = len(recipient_activity)
+        total_requests = sum(recipient_activity)
+        avg_requests_per_recipient = round(total_requests / max(1, recipient_count), 2)
+        
+        # Recurring recipients (more than 1 request)
+        recurring_recipients = sum(1 for count in recipient_activity if count > 1)
+        recurring_recipient_rate = round((recurring_recipients / max(1, recipient_count)) * 100, 1)
+        
+        return {
+            "donor_metrics": {
+                "total_donors": donor_count,
+                "avg_donations_per_donor": avg_donations_per_donor,
+                "recurring_donor_rate": recurring_donor_rate,
+                "top_donors": top_donors
+            },
+            "recipient_metrics": {
+                "total_recipients": recipient_count,
+                "avg_requests_per_recipient": avg_requests_per_recipient,
+                "recurring_recipient_rate": recurring_recipient_rate
+            },
+            "communication_metrics": {
+                "total_messages": message_count,
+                "avg_messages_per_donation": round(message_count / max(1, total_donations), 2)
+            }
+        }
+    
+    def engagement_metrics_from_store(self, store):
+        """Generate the user engagement metrics from the maintained per-user counters."""
+        donor_count, total_donations, recurring_donors, top_donors = store.role_summary('donor')
+        recipient_count, total_requests, recurring_recipients, _ = store.role_summary('recipient')
+        message_count = store.message_count()
+        
+        return {
+            "donor_metrics": {
+                "total_donors": donor_count,
+                "avg_donations_per_donor": round(total_donations / max(1, donor_count), 2),
+                "recurring_donor_rate": round((recurring_donors / max(1, donor_count)) * 100, 1),
+                "top_donors": [{"donor_id": d, "donation_count": c} for d, c in top_donors]
+            },
+            "recipient_metrics": {
+                "total_recipients": recipient_count,
+                "avg_requests_per_recipient": round(total_requests / max(1, recipient_count), 2),
+                "recurring_recipient_rate": round((recurring_recipients / max(1, recipient_count)) * 100, 1)
+            },
+            "communication_metrics": {
+                "total_messages": message_count,
+                "avg_messages_per_donation": round(message_count / max(1, total_donations), 2)
+            }
+        }
+    
+    def generate_retention_cohorts(self, weeks=12):
+        """Generate weekly retention cohorts of donors and recipients by first active week."""
+        store = self.synced_engagement()
+        if store is None:
+            return {}
+        try:
+            since, until = format_bound(self.since), format_bound(self.until)
+            return {
+                "weeks": weeks,
+                "donors": store.retention_cohorts('donor', weeks, since, until),
+                "recipients": store.retention_cohorts('recipient', weeks, since, until)
             }
-            
-            return engagement_metrics
         except sqlite3.Error as e:
-            print(f"Error generating user engagement metrics: {e}")
+            print(f"Error generating retention cohorts: {e}")
+            return {}
+    
+    def analyze_time_to_first_request(self):
+        """Analyze how long donations wait for their first request, overall and by week."""
+        store = self.synced_engagement()
+        if store is None:
             return {}
+        try:
+            return store.time_to_first_request(format_bound(self.since), format_bound(self.until))
+        except sqlite3.Error as e:
+            print(f"Error analyzing time to first request: {e}")
+            return {}
+    
+    def sample_strata(self, statuses=None):
+        """Return the donation sample's strata for the report window, or None if the sample is unavailable."""
+        sample = self.synced_sample()
+        if sample is None:
+            return None
+        try:
+            return sample.strata(statuses, format_bound(self.since), format_bound(self.until))
+        except sqlite3.Error as e:
+            print(f"Error reading donation sample: {e}")
+            return None
+    
+    @staticmethod
+    def approximate_metadata(strata, intervals):
+        """Describe an approximate section: confidence level, sample size and {key: [low, high]} intervals."""
+        return {
+            "confidence": CONFIDENCE,
+            "sampled_donations": sum(size for _, size, _ in strata),
+            "intervals": intervals
+        }
+    
+    @staticmethod
+    def interval(estimate, half_width, scale=1, digits=None):
+        """Return [low, high] of estimate +/- half_width times scale, clipped at zero."""
+        return [round(max(0.0, (estimate - half_width) * scale), digits),
+                round((estimate + half_width) * scale, digits)]
+    
+    def approximate_overall_impact(self):
+        """Estimate the overall impact from the donation sample; None if it is unavailable."""
+        strata = self.sample_strata(('completed',))
+        if strata is None:
+            return None
+        estimates = StratifiedDonationSample.estimate_totals(strata, {
+            'count': lambda row: 1.0,
+            'kg': lambda row: row['kg']
+        })
+        count, count_half_width = estimates['count']
+        total_kg, kg_half_width = estimates['kg']
+        factors = self.impact_factors
+        return {
+            "total_donations": round(count),
+            "estimated_total_kg": round(total_kg, 2),
+            "estimated_meals_provided": round(total_kg * factors['meals_per_kg']),
+            "estimated_co2_saved": round(total_kg * factors['co2_per_kg'], 2),
+            "estimated_water_saved": round(total_kg * factors['water_per_kg']),
+            # Distinct donors and recipients cannot be estimated from a sample of donations
+            "unique_donors": None,
+            "unique_recipients": None,
+            "approximate": self.approximate_metadata(strata, {
+                "total_donations": self.interval(count, count_half_width),
+                "estimated_total_kg": self.interval(total_kg, kg_half_width, digits=2),
+                "estimated_meals_provided": self.interval(total_kg, kg_half_width, factors['meals_per_kg']),
+                "estimated_co2_saved": self.interval(total_kg, kg_half_width, factors['co2_per_kg'], 2),
+                "estimated_water_saved": self.interval(total_kg, kg_half_width, factors['water_per_kg'])
+            })
+        }
+    
+    @staticmethod
+    def shelf_life_bucket(row):
+        """Return the shelf-life bucket of a sampled donation, as in food_waste_partial; None without an expiry date."""
+        if not row['has_expiry']:
+            return None
+        days = row['shelf_life_days']
+        if days is None:
+            return 'long'
+        if days <= 3:
+            return 'very_short'
+        if days <= 7:
+            return 'short'
+        if days <= 14:
+            return 'medium'
+        return 'long'
+    
+    def approximate_food_waste(self):
+        """Estimate the waste prevented from the donation sample; None if it is unavailable."""
+        strata = self.sample_strata(('completed',))
+        if strata is None:
+            return None
+        bucket = self.shelf_life_bucket
+        saved = lambda row: 1.0 if bucket(row) in ('very_short', 'short') else 0.0
+        estimates = StratifiedDonationSample.estimate_totals(strata, {
+            **{name: (lambda row, name=name: 1.0 if bucket(row) == name else 0.0)
+               for name in ('very_short', 'short', 'medium', 'long')},
+            'saved': saved,
+            'saved_kg': lambda row: row['kg_simple'] if bucket(row) in ('very_short', 'short') else 0.0
+        })
+        percentage, percentage_half_width = StratifiedDonationSample.estimate_ratios(
+            strata, {'saved': saved}, lambda row: 1.0
+        )['saved']
+        
+        # Most common shelf life first; buckets absent from the sample are left out, as in SQL
+        shelf_life_distribution = [
+            {"shelf_life": name, "count": round(estimates[name][0])}
+            for name in sorted(('very_short', 'short', 'medium', 'long'), key=lambda name: -estimates[name][0])
+            if estimates[name][0] > 0
+        ]
+        saved_count, saved_half_width = estimates['saved']
+        saved_kg, saved_kg_half_width = estimates['saved_kg']
+        factors = self.impact_factors
+        return {
+            "donations_saved_from_waste": round(saved_count),
+            "percentage_of_total": round((percentage or 0) * 100),
+            "estimated_kg_saved": round(saved_kg, 2),
+            "environmental_impact": {
+                "co2_prevented": round(saved_kg * factors['co2_per_kg'], 2),
+                "water_saved": round(saved_kg * factors['water_per_kg'])
+            },
+            "shelf_life_distribution": shelf_life_distribution,
+            "approximate": self.approximate_metadata(strata, {
+                "donations_saved_from_waste": self.interval(saved_count, saved_half_width),
+                "percentage_of_total": self.interval(percentage or 0, percentage_half_width or 0, 100),
+                "estimated_kg_saved": self.interval(saved_kg, saved_kg_half_width, digits=2),
+                **{f"shelf_life.{name}": self.interval(*estimates[name])
+                   for name in ('very_short', 'short', 'medium', 'long') if estimates[name][0] > 0}
+            })
+        }
+    
+    def approximate_geographic(self):
+        """Estimate the location distribution from the donation sample; None if it is unavailable."""
+        strata = self.sample_strata()
+        if strata is None:
+            return None
+        # Only locations that occur in the sample can be reported
+        locations = sorted({row['location'] for _, _, rows in strata for row in rows if row['location']})
+        indicators = {location: (lambda row, location=location: 1.0 if row['location'] == location else 0.0)
+                      for location in locations}
+        counts = StratifiedDonationSample.estimate_totals(strata, indicators)
+        shares = StratifiedDonationSample.estimate_ratios(
+            strata, indicators, lambda row: 1.0 if row['location'] else 0.0
+        )
+        
+        location_data = [
+            {"location": location, "donation_count": round(counts[location][0]),
+             "percentage": round(shares[location][0] * 100, 1)}
+            for location in sorted(locations, key=lambda location: -counts[location][0])
+        ]
+        return {
+            "location_distribution": location_data,
+            "total_locations": len(location_data),
+            "most_active_location": location_data[0]['location'] if location_data else "Unknown",
+            "approximate": self.approximate_metadata(strata, {
+                **{f"donation_count.{location}": self.interval(*counts[location]) for location in locations},
+                **{f"percentage.{location}": self.interval(*shares[location], 100, 1) for location in locations}
+            })
+        }
+    
+    def build_section(self, name):
+        """Compute one section of the comprehensive report."""
+        if name not in REPORT_SECTIONS:
+            raise ValueError(f"Unknown report section: {name}")
+        if self.approximate and name in APPROXIMATE_SECTIONS and self.snapshot is None:
+            section = getattr(self, APPROXIMATE_SECTIONS[name])()
+            # Without a usable sample the section is computed exactly
+            if section is not None:
+                return section
+        return getattr(self, REPORT_SECTIONS[name][0])()
     
-    def generate_comprehensive_report(self):
-        """Generate a comprehensive impact and insights report."""
-        overall_impact = self.calculate_overall_impact()
-        time_series = self.generate_time_series_data('monthly')
-        waste_prevention = self.analyze_food_waste_prevention()
-        geographic = self.generate_geographic_insights()
-        engagement = self.generate_user_engagement_metrics()
+    def table_watermark(self, table):
+        """Return a value that changes whenever rows of a source table change."""
+        if self.snapshot is not None:
+            # A snapshot never changes after export
+            return self.snapshot.manifest['exported_at']
         
+        if table == 'messages':
+            self.cursor.execute("SELECT COUNT(*) as count, MAX(id) as max_id FROM messages")
+            row = self.cursor.fetchone()
+            return [row['count'], row['max_id']]
+        
+        # Inserts, status changes and deletes are in the change log; the row
+        # count and max id also catch archiving
+        self.cursor.execute(
+            "SELECT offset FROM change_log WHERE table_name = ? ORDER BY offset DESC LIMIT 1",
+            (table,)
+        )
+        row = self.cursor.fetchone()
+        last_offset = row['offset'] if row else 0
+        self.cursor.execute(f"SELECT COUNT(*) as count, MAX(id) as max_id FROM {table}")
+        row = self.cursor.fetchone()
+        self.cursor.execute(
+            "SELECT COUNT(*) as partitions, MAX(updated_at) as updated_at FROM archive_partitions"
+        )
+        partitions = self.cursor.fetchone()
+        return [last_offset, row['count'], row['max_id'], partitions['partitions'], partitions['updated_at']]
+    
+    def section_etag(self, name):
+        """Return the ETag of a section, derived from the watermarks of the tables it reads."""
+        if name not in REPORT_SECTIONS:
+            raise ValueError(f"Unknown report section: {name}")
+        try:
+            watermarks = {table: self.table_watermark(table) for table in REPORT_SECTIONS[name][1]}
+        except sqlite3.Error as e:
+            # Without a watermark the section can never be reported as unchanged
+            print(f"Error reading data watermarks: {e}")
+            watermarks = {"unavailable": datetime.now().isoformat()}
+        if self.approximate and name in APPROXIMATE_SECTIONS:
+            # Estimates and exact figures must not share a cache entry
+            return compute_etag(name, watermarks, self.since, self.until, 'approximate')
+        return compute_etag(name, watermarks, self.since, self.until)
+    
+    def get_report_section(self, name, if_none_match=None):
+        """Return one report section, or a not-modified marker if its ETag matches if_none_match."""
+        etag = self.section_etag(name)
+        if if_none_match == etag:
+            return {"section": name, "etag": etag, "not_modified": True}
+        return {"section": name, "etag": etag, "not_modified": False, "data": self.build_section(name)}
+    
+    def generate_comprehensive_report(self, sections=None):
+        """Generate a comprehensive impact and insights report.
+        
+        sections limits the report to the named parts of REPORT_SECTIONS.
+        """
         report = {
             "report_date": datetime.now().strftime('%Y-%m-%d'),
-            "overall_impact": overall_impact,
-            "user_engagement": engagement,
-            "food_waste_prevention": waste_prevention,
-            "geographic_insights": geographic,
-            "time_series_data": time_series
+            "metadata": self.data_freshness()
         }
+        for name in sections or REPORT_SECTIONS:
+            report[name] = self.build_section(name)
         
         return report
+    
+    def stream_comprehensive_report(self, sections=None, if_none_match=None):
+        """Yield the report as JSON text chunks, one section at a time.
+        
+        Each section carries its ETag; sections whose ETag matches
+        if_none_match ({section: etag}) are sent as not modified and never
+        computed.
+        """
+        names = list(sections or REPORT_SECTIONS)
+        for name in names:
+            if name not in REPORT_SECTIONS:
+                raise ValueError(f"Unknown report section: {name}")
+        header = {
+            "report_date": datetime.now().strftime('%Y-%m-%d'),
+            "metadata": self.data_freshness()
+        }
+        return iter_report_json(
+            header,
+            ((name, self.section_etag(name), lambda name=name: self.build_section(name)) for name in names),
+            if_none_match
+        )
 
 # Example usage
 if __name__ == "__main__":
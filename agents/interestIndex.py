@@ -0,0 +1,272 @@
+"""
+RecipientInterestIndex: Reverse matching from a new donation to interested recipients.
+
+Matching is otherwise pull-only: every recipient re-runs
+`RecipientAgent.match_donation_to_recipient` to discover new items. This
+index turns it around. `recipient_interests` is an inverted index from a
+(category, location) cell to the recipients who requested donations like
+that, with their non-rejected request count; every recipient also has a row
+under the ANY_LOCATION cell of each category. It advances from the change
+log on request inserts, status changes and deletes, and on donation deletes.
+
+When a donation is created, `notify_new_donation` reads the top recipients of
+the donation's exact cell and of its any-location cell from the
+(category, location, request_count) index. That costs time proportional to
+the number of matches returned, not to the number of users. Those recipients
+go into `notification_queue`. Clients then read their own pending
+notifications (or have them pushed) instead of re-running the matcher.
+
+Rebuild the index or inspect a recipient's queue with:
+    python agents/interestIndex.py --db database/foodcycle.sqlite --rebuild --pending 2
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.archivePartitions import ArchivePartitions
+from agents.changeLog import ChangeLog
+from agents.foodCategories import categorize_basic
+
+CONSUMER = 'recipient_interests'
+
+# Location cell that aggregates a recipient's interest in a category everywhere
+ANY_LOCATION = '*'
+# How much more a request in the donation's own location counts than one elsewhere
+LOCAL_BOOST = 2.0
+# Recipients notified per new donation
+NOTIFY_LIMIT = 20
+
+
+def location_cell(location):
+    """Normalize a free-text location into an index cell."""
+    return (location or '').strip().lower()
+
+
+class RecipientInterestIndex:
+    def __init__(self, conn):
+        """Initialize the index and notification queue on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        self.create_tables()
+
+    def create_tables(self):
+        """Create the interest index and notification queue if they do not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS recipient_interests (
+                category TEXT NOT NULL,
+                location TEXT NOT NULL,
+                recipient_id INTEGER NOT NULL,
+                request_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (category, location, recipient_id)
+            )
+            """
+        )
+        # Top recipients of a cell are read in index order
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_recipient_interests_top
+            ON recipient_interests (category, location, request_count DESC)
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS notification_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient_id INTEGER NOT NULL,
+                donation_id INTEGER NOT NULL,
+                score REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                delivered_at TIMESTAMP,
+                UNIQUE (recipient_id, donation_id)
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_notification_queue_pending
+            ON notification_queue (recipient_id, delivered_at)
+            """
+        )
+
+    def sync(self):
+        """Apply request and donation events from the change log. Returns the number of events read.
+
+        The caller is responsible for committing.
+        """
+        if self.changes.get_offset(CONSUMER) is None:
+            self.rebuild()
+            return 0
+        # Deleting a donation takes its requests out of the index
+        return self.changes.consume(CONSUMER, self._apply_events)
+
+    def _apply_events(self, events):
+        """Adjust interest counts for a batch of request and donation events."""
+        deltas = {}
+        for _, request, donation, old_status, new_status in self.changes.request_transitions(
+                events, 'id, food_name, location'):
+            delta = (new_status not in (None, 'rejected')) - (old_status not in (None, 'rejected'))
+            if delta:
+                category = categorize_basic(donation['food_name'])
+                for location in (location_cell(donation['location']), ANY_LOCATION):
+                    key = (category, location, request['recipient_id'])
+                    deltas[key] = deltas.get(key, 0) + delta
+
+        self.cursor.executemany(
+            """
+            INSERT INTO recipient_interests (category, location, recipient_id, request_count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (category, location, recipient_id)
+            DO UPDATE SET request_count = request_count + excluded.request_count
+            """,
+            [(*key, delta) for key, delta in deltas.items() if delta]
+        )
+
+    def rebuild(self):
+        """Recount every recipient's interests from request history and reset the log offset."""
+        # Deleting first takes the write lock, so the log head matches the rows read below
+        self.cursor.execute("DELETE FROM recipient_interests")
+        self.changes.set_offset(CONSUMER, self.changes.head())
+
+        self.cursor.execute(
+            """
+            SELECT r.recipient_id, d.food_name, d.location
+            FROM requests_all r
+            JOIN donations_all d ON r.donation_id = d.id
+            WHERE r.status != 'rejected'
+            """
+        )
+        counts = {}
+        for row in self.cursor.fetchall():
+            category = categorize_basic(row['food_name'])
+            for location in (location_cell(row['location']), ANY_LOCATION):
+                key = (category, location, row['recipient_id'])
+                counts[key] = counts.get(key, 0) + 1
+
+        self.cursor.executemany(
+            "INSERT INTO recipient_interests (category, location, recipient_id, request_count) VALUES (?, ?, ?, ?)",
+            [(*key, count) for key, count in counts.items()]
+        )
+
+    def interested_recipients(self, food_name, location, limit=NOTIFY_LIMIT):
+        """Return [(recipient_id, score)] of the recipients most interested in a donation, best first.
+
+        Candidates are the top `limit` recipients of the donation's exact cell
+        and of its any-location cell; each is scored by its any-location count
+        plus LOCAL_BOOST times its count in the donation's location.
+        """
+        category = categorize_basic(food_name)
+        local = location_cell(location)
+
+        candidates = set()
+        for cell in (local, ANY_LOCATION):
+            self.cursor.execute(
+                """
+                SELECT recipient_id FROM recipient_interests
+                WHERE category = ? AND location = ? AND request_count > 0
+                ORDER BY request_count DESC
+                LIMIT ?
+                """,
+                (category, cell, limit)
+            )
+            candidates.update(row['recipient_id'] for row in self.cursor.fetchall())
+        if not candidates:
+            return []
+
+        # Both counts of every candidate, from the primary key
+        self.cursor.execute(
+            f"""
+            SELECT recipient_id, location, request_count FROM recipient_interests
+            WHERE category = ? AND location IN (?, ?) AND recipient_id IN ({','.join('?' * len(candidates))})
+            """,
+            (category, local, ANY_LOCATION, *candidates)
+        )
+        scores = dict.fromkeys(candidates, 0.0)
+        for row in self.cursor.fetchall():
+            boost = LOCAL_BOOST if row['location'] == local and local != ANY_LOCATION else 1.0
+            scores[row['recipient_id']] += boost * row['request_count']
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def notify_new_donation(self, donation_id, food_name, location, limit=NOTIFY_LIMIT):
+        """Queue a notification for each recipient interested in a new donation.
+
+        Returns the recipient ids queued. The caller is responsible for
+        committing, so the notifications land with the donation itself.
+        """
+        self.sync()
+        recipients = self.interested_recipients(food_name, location, limit)
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO notification_queue (recipient_id, donation_id, score) VALUES (?, ?, ?)",
+            [(recipient_id, donation_id, score) for recipient_id, score in recipients]
+        )
+        return [recipient_id for recipient_id, _ in recipients]
+
+    def pending_notifications(self, recipient_id, limit=50):
+        """Return a recipient's undelivered notifications, oldest first."""
+        self.cursor.execute(
+            """
+            SELECT * FROM notification_queue
+            WHERE recipient_id = ? AND delivered_at IS NULL
+            ORDER BY id
+            LIMIT ?
+            """,
+            (recipient_id, limit)
+        )
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def mark_delivered(self, notification_ids):
+        """Mark notifications as delivered. The caller is responsible for committing."""
+        self.cursor.executemany(
+            "UPDATE notification_queue SET delivered_at = CURRENT_TIMESTAMP WHERE id = ? AND delivered_at IS NULL",
+            [(notification_id,) for notification_id in notification_ids]
+        )
+
+    def prune(self, days=30):
+        """Delete notifications delivered more than `days` ago. Returns the number deleted."""
+        self.cursor.execute(
+            "DELETE FROM notification_queue WHERE delivered_at < datetime('now', ?)",
+            (f'-{int(days)} days',)
+        )
+        return self.cursor.rowcount
+
+
+# Index maintenance entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the recipient interest index and notification queue.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database path")
+    parser.add_argument('--rebuild', action='store_true', help="Recount interests from request history")
+    parser.add_argument('--pending', type=int, metavar='RECIPIENT_ID', help="Show a recipient's pending notifications")
+    parser.add_argument('--prune-days', type=int, help="Delete notifications delivered more than this many days ago")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        # Archived months live in partition files
+        ArchivePartitions(conn, args.db).open()
+        index = RecipientInterestIndex(conn)
+        if args.rebuild:
+            index.rebuild()
+            print("Interest index rebuilt")
+        else:
+            index.sync()
+        if args.prune_days is not None:
+            print(f"Pruned {index.prune(args.prune_days)} delivered notifications")
+        conn.commit()
+        if args.pending is not None:
+            for notification in index.pending_notifications(args.pending):
+                print(f"#{notification['id']} donation {notification['donation_id']} "
+                      f"(score {notification['score']:.1f}, queued {notification['created_at']})")
+    except sqlite3.Error as e:
+        print(f"Interest index error: {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,29 @@
+"""
+LazyConnection: Deferred initialization of agent resources.
+
+Agents list the attributes their setup methods create (the connection,
+cursor and derived stores) in `lazy_attributes`. Constructing an agent then
+only records its configuration; the first access to any of those attributes
+runs the setup method that sets it. Short-lived CLI and cron invocations
+that never query pay no connection, DDL or print cost.
+"""
+
+
+class LazyConnection:
+    # {attribute name: name of the method that sets it}
+    lazy_attributes = {}
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails, i.e. before the attribute is set
+        loader = type(self).lazy_attributes.get(name)
+        if loader is None:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        getattr(self, loader)()
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(f"{type(self).__name__}.{loader}() did not set {name!r}") from None
+
+    def is_loaded(self, name):
+        """Return True if a lazy attribute has already been initialized."""
+        return name in self.__dict__
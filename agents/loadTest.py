@@ -0,0 +1,294 @@
+"""
+Load test: concurrent donors, recipients and dashboards against a scratch database.
+
+Copies the database to a scratch file with the backup API (the real data is
+never written) and links its archive partitions, then drives the agents from
+several processes, each running several threads with their own agent
+instances, like independent app servers sharing one SQLite file:
+
+- donor:     DonorAgent.process_new_donation
+- recipient: RecipientAgent.match_donation_to_recipient, then create_request
+             for the best match (the check-then-reserve path that can race)
+- dashboard: InsightsAgent.generate_comprehensive_report
+
+Arrivals are open-loop: each role has a target rate (operations per second
+across all workers) and every worker draws exponential inter-arrival times
+from its share of the total, so a slow database builds a queue instead of
+slowing the offered load. Latency is measured from each operation's
+scheduled start, so queueing delay is included in the tail.
+
+An operation counts as a locked error when one of its writes returns a
+"status": "error" result (the agents roll back and return one when SQLite
+cannot write; on the scratch copy under load that is a busy or locked
+database), or when a busy or locked sqlite3.OperationalError escapes it.
+Read paths that recover from an error with an empty result are not counted.
+The agents' progress prints are discarded. After the run, donations with
+more than one request created during the test are counted as double
+reservations.
+
+Run with:
+    python agents/loadTest.py --db database/foodcycle.sqlite --processes 2 --threads 4 \
+        --duration 20 --donor-rate 20 --recipient-rate 40 --dashboard-rate 1
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.archivePartitions import ArchivePartitions
+from agents.donorAgent import DonorAgent
+from agents.insightsAgent import InsightsAgent
+from agents.recipientAgent import RecipientAgent
+
+ROLES = ('donor', 'recipient', 'dashboard')
+# SQLite result codes of a write that could not get the lock
+LOCKED_ERROR_CODES = (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+FOOD_NAMES = ('Fresh Apples', 'Whole milk', 'Rice', 'Sourdough bread', 'Canned beans', 'Carrots', 'Chicken breast')
+
+
+def is_locked_error(error):
+    """Return True if a sqlite3 error is a busy or locked database."""
+    # sqlite_errorcode is the extended result code (Python 3.11+); its low byte is the primary code
+    code = getattr(error, 'sqlite_errorcode', None)
+    return code is not None and (code & 0xFF) in LOCKED_ERROR_CODES
+
+
+def create_scratch_database(db_path):
+    """Copy db_path into a temporary directory and return the copy's path."""
+    scratch_dir = tempfile.mkdtemp(prefix='load-test-')
+    scratch_path = os.path.join(scratch_dir, os.path.basename(db_path))
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(scratch_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    # Partition files are only read by the agents, so the copy shares them
+    partition_dir = ArchivePartitions.default_partition_dir(db_path)
+    if os.path.isdir(partition_dir):
+        os.symlink(os.path.abspath(partition_dir), ArchivePartitions.default_partition_dir(scratch_path))
+    return scratch_path
+
+
+def remove_scratch_database(scratch_path):
+    scratch_dir = os.path.dirname(scratch_path)
+    for name in os.listdir(scratch_dir):
+        path = os.path.join(scratch_dir, name)
+        if os.path.islink(path) or os.path.isfile(path):
+            os.remove(path)
+    os.rmdir(scratch_dir)
+
+
+def load_ids(db_path):
+    """Return (donor ids, recipient ids) to draw simulated users from."""
+    conn = sqlite3.connect(db_path)
+    try:
+        donors = [row[0] for row in conn.execute("SELECT id FROM users WHERE user_type = 'donor'")]
+        recipients = [row[0] for row in conn.execute("SELECT id FROM users WHERE user_type = 'recipient'")]
+        donors = donors or [row[0] for row in conn.execute("SELECT DISTINCT donor_id FROM donations")]
+        recipients = recipients or [row[0] for row in conn.execute("SELECT DISTINCT recipient_id FROM requests")]
+        return donors or [1], recipients or [2]
+    finally:
+        conn.close()
+
+
+def run_operation(role, agents, rng, donors, recipients):
+    """Run one operation; return (succeeded, a write failed to get the lock)."""
+    if role == 'donor':
+        result = agents['donor'].process_new_donation({
+            "donor_id": rng.choice(donors),
+            "food_name": rng.choice(FOOD_NAMES),
+            "quantity": f"{rng.randint(1, 20)} kg",
+            "expiry_date": (datetime.now() + timedelta(days=rng.randint(1, 21))).strftime('%Y-%m-%d'),
+            "description": "Load test donation",
+            "location": "Load test"
+        })
+        return result.get('status') == 'success', result.get('status') == 'error'
+
+    if role == 'recipient':
+        recipient_id = rng.choice(recipients)
+        matches = agents['recipient'].match_donation_to_recipient(recipient_id)['matches']
+        if not matches:
+            return True, False
+        result = agents['recipient'].create_request(recipient_id, matches[0]['id'])
+        # Losing the race to another recipient is an expected outcome, not an error
+        lost_race = 'not available' in result.get('message', '')
+        failed = result.get('status') == 'error' and not lost_race
+        return not failed, failed
+
+    report = agents['dashboard'].generate_comprehensive_report()
+    return 'overall_impact' in report, False
+
+
+def run_thread(db_path, rates, duration, seed, donors, recipients, results):
+    """Issue open-loop arrivals for one worker thread and append per-operation samples."""
+    rng = random.Random(seed)
+    total_rate = sum(rates.values())
+    roles, weights = zip(*rates.items())
+    agents = {
+        'donor': DonorAgent(db_path),
+        'recipient': RecipientAgent(db_path),
+        'dashboard': InsightsAgent(db_path)
+    }
+
+    samples = []
+    start = time.perf_counter()
+    scheduled = start
+    try:
+        while True:
+            scheduled += rng.expovariate(total_rate)
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            role = rng.choices(roles, weights)[0]
+            try:
+                ok, locked = run_operation(role, agents, rng, donors, recipients)
+            except sqlite3.Error as e:
+                ok, locked = False, is_locked_error(e)
+            except SystemExit:
+                # An agent failed to connect (e.g. locked during setup DDL); the cause is only printed
+                ok, locked = False, False
+            samples.append((role, time.perf_counter() - scheduled, ok, locked))
+    finally:
+        for agent in agents.values():
+            agent.close_connection()
+    results.extend(samples)
+
+
+def run_process(db_path, rates, duration, threads, seed, donors, recipients):
+    """Run one worker process with several threads; return its samples."""
+    results = []
+    # The agents' progress prints would flood the caller's output
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        workers = [
+            threading.Thread(
+                target=run_thread,
+                args=(db_path, rates, duration, seed * 1000 + i, donors, recipients, results)
+            )
+            for i in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    return results
+
+
+def count_double_reservations(db_path, first_request_id):
+    """Return the number of donations that got more than one request during the run."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            """
+            SELECT COUNT(*) FROM (
+                SELECT donation_id FROM requests
+                WHERE id >= ?
+                GROUP BY donation_id
+                HAVING COUNT(*) > 1
+            )
+            """,
+            (first_request_id,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def load_test(db_path, processes=2, threads=4, duration=10.0, rates=None, seed=0):
+    """Run the load test on a scratch copy of db_path and return a summary dict."""
+    rates = {role: rate for role, rate in (rates or {'donor': 10, 'recipient': 20, 'dashboard': 1}).items() if rate > 0}
+    workers = processes * threads
+    # Every worker draws its share of each role's rate
+    worker_rates = {role: rate / workers for role, rate in rates.items()}
+
+    scratch_path = create_scratch_database(db_path)
+    try:
+        donors, recipients = load_ids(scratch_path)
+        conn = sqlite3.connect(scratch_path)
+        first_request_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM requests").fetchone()[0]
+        conn.close()
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [
+                pool.submit(run_process, scratch_path, worker_rates, duration, threads, seed + p, donors, recipients)
+                for p in range(processes)
+            ]
+            samples = [sample for future in futures for sample in future.result()]
+        elapsed = time.perf_counter() - start
+
+        summary = {
+            "processes": processes,
+            "threads": threads,
+            "duration_s": round(elapsed, 2),
+            "offered_rates": rates,
+            "roles": {},
+            "double_reservations": count_double_reservations(scratch_path, first_request_id)
+        }
+        for role in ROLES:
+            role_samples = [s for s in samples if s[0] == role]
+            if not role_samples:
+                continue
+            latencies = [s[1] for s in role_samples]
+            summary["roles"][role] = {
+                "count": len(role_samples),
+                "throughput_per_s": round(len(role_samples) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+                "max_ms": round(max(latencies) * 1000, 2),
+                "error_rate": round(sum(not s[2] for s in role_samples) / len(role_samples), 4),
+                "locked_rate": round(sum(s[3] for s in role_samples) / len(role_samples), 4)
+            }
+        summary["locked_rate"] = round(sum(s[3] for s in samples) / len(samples), 4) if samples else 0
+        return summary
+    finally:
+        remove_scratch_database(scratch_path)
+
+
+# Load test entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive the agents concurrently against a scratch database.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database to copy")
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4, help="Threads per process")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds of arrivals")
+    parser.add_argument('--donor-rate', type=float, default=10.0, help="New donations per second")
+    parser.add_argument('--recipient-rate', type=float, default=20.0, help="Match-and-request operations per second")
+    parser.add_argument('--dashboard-rate', type=float, default=1.0, help="Insights reports per second")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    summary = load_test(
+        args.db, args.processes, args.threads, args.duration,
+        {'donor': args.donor_rate, 'recipient': args.recipient_rate, 'dashboard': args.dashboard_rate},
+        args.seed
+    )
+    print(f"{summary['processes']} processes x {summary['threads']} threads, {summary['duration_s']} s")
+    print(f"{'role':10} {'count':>6} {'ops/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7} {'locked':>7}")
+    for role, s in summary["roles"].items():
+        print(f"{role:10} {s['count']:6} {s['throughput_per_s']:8} {s['p50_ms']:9} {s['p95_ms']:9} "
+              f"{s['p99_ms']:9} {s['max_ms']:9} {s['error_rate']:7.2%} {s['locked_rate']:7.2%}")
+    print(f"Locked write rate: {summary['locked_rate']:.2%}")
+    print(f"Double reservations: {summary['double_reservations']}")
@@ -0,0 +1,48 @@
+"""
+Keyset pagination: opaque continuation tokens for newest-first history pages.
+
+History lists are ordered by (created_at DESC, id DESC) and each page seeks
+past the last key of the previous one, so a page costs the same however deep
+the user has scrolled, and rows inserted meanwhile never shift later pages.
+The key travels to the client as a URL-safe token bound to the listing it
+came from; clients must treat it as opaque.
+"""
+
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Bump when the token layout changes; older tokens are then rejected
+TOKEN_VERSION = 1
+
+
+def page_size(limit):
+    """Clamp a requested page size to [1, MAX_PAGE_SIZE]."""
+    return max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+
+
+def encode_page_token(listing, key):
+    """Return the token for continuing listing after key = (created_at, id)."""
+    payload = json.dumps([TOKEN_VERSION, listing, key[0], key[1]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_page_token(token, listing):
+    """Return the (created_at, id) key in a token, or None for the first page.
+
+    Raises ValueError if the token is malformed or belongs to another listing.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        version, token_listing, created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError) as e:
+        raise ValueError("malformed page token") from e
+    if version != TOKEN_VERSION:
+        raise ValueError("page token has expired; start from the first page")
+    if token_listing != listing or not isinstance(created_at, str) or not isinstance(row_id, int):
+        raise ValueError("page token does not belong to this listing")
+    return created_at, row_id
@@ -0,0 +1,95 @@
+"""
+PendingFoodCounts: Maintained counts of pending requests per food.
+
+Donor suggestions list the foods with the most pending requests. Requests
+leave the pending set when they are accepted or rejected, which a
+SpaceSaving sketch cannot take back, so this store keeps exact counts
+instead. It advances from the change log: a request counts while its status
+is 'pending' and its donation exists. The pending set is small, so the table stays a few rows per
+requested food and the top foods are read from an index.
+"""
+
+from agents.changeLog import ChangeLog
+
+CONSUMER = 'pending_food_counts'
+
+
+class PendingFoodCounts:
+    def __init__(self, conn):
+        """Initialize the counts on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        self.create_table()
+
+    def create_table(self):
+        """Create the pending_food_counts table if it does not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_food_counts (
+                food_name TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_pending_food_counts_count ON pending_food_counts (count)"
+        )
+
+    def top(self, k=5, sync=True):
+        """Return [(food_name, pending request count)] of the k most requested foods.
+
+        The caller is responsible for committing the catch-up writes.
+        """
+        if sync:
+            self.sync()
+        self.cursor.execute(
+            """
+            SELECT food_name, count FROM pending_food_counts
+            WHERE count > 0
+            ORDER BY count DESC, food_name
+            LIMIT ?
+            """,
+            (k,)
+        )
+        return [(row['food_name'], row['count']) for row in self.cursor.fetchall()]
+
+    def sync(self):
+        """Apply request and donation events from the change log. Returns the number of events read."""
+        if self.changes.get_offset(CONSUMER) is None:
+            self.rebuild()
+            return 0
+        # Deleting a donation takes its pending requests out of the counts
+        return self.changes.consume(CONSUMER, self._apply_events)
+
+    def _apply_events(self, events):
+        """Adjust counts for a batch of request and donation events."""
+        deltas = {}
+        for _, _, donation, old_status, new_status in self.changes.request_transitions(events, 'id, food_name'):
+            delta = (new_status == 'pending') - (old_status == 'pending')
+            if delta:
+                deltas[donation['food_name']] = deltas.get(donation['food_name'], 0) + delta
+
+        self.cursor.executemany(
+            """
+            INSERT INTO pending_food_counts (food_name, count) VALUES (?, ?)
+            ON CONFLICT (food_name) DO UPDATE SET count = count + excluded.count
+            """,
+            [(food_name, delta) for food_name, delta in deltas.items() if delta]
+        )
+
+    def rebuild(self):
+        """Recount pending requests per food and reset the log offset."""
+        # Deleting first takes the write lock, so the log head matches the rows read below
+        self.cursor.execute("DELETE FROM pending_food_counts")
+        self.changes.set_offset(CONSUMER, self.changes.head())
+        self.cursor.execute(
+            """
+            INSERT INTO pending_food_counts (food_name, count)
+            SELECT d.food_name, COUNT(*)
+            FROM requests_all r
+            JOIN donations_all d ON r.donation_id = d.id
+            WHERE r.status = 'pending'
+            GROUP BY d.food_name
+            """
+        )
@@ -0,0 +1,70 @@
+"""
+Quantity parsing: estimates weight in kg from free-text donation quantities.
+"""
+
+
+def estimate_quantity_kg(quantity):
+    """Estimate the weight in kg of a quantity string such as '10 kg' or '3 boxes'.
+
+    Returns 0 when the quantity cannot be interpreted.
+    """
+    quantity = quantity.lower()
+
+    # Basic parsing of quantity strings
+    if 'kg' in quantity:
+        try:
+            return float(quantity.split('kg')[0].strip())
+        except ValueError:
+            return 0
+    elif 'g' in quantity and 'kg' not in quantity:
+        try:
+            return float(quantity.split('g')[0].strip()) / 1000
+        except ValueError:
+            return 0
+    elif 'lb' in quantity or 'pound' in quantity:
+        try:
+            if 'lb' in quantity:
+                lb = float(quantity.split('lb')[0].strip())
+            else:
+                lb = float(quantity.split('pound')[0].strip())
+            return lb * 0.453592  # Convert lb to kg
+        except ValueError:
+            return 0
+    elif 'item' in quantity or 'piece' in quantity or 'pcs' in quantity:
+        try:
+            if 'item' in quantity:
+                items = float(quantity.split('item')[0].strip())
+            elif 'piece' in quantity:
+                items = float(quantity.split('piece')[0].strip())
+            else:
+                items = float(quantity.split('pcs')[0].strip())
+            return items * 0.2  # Assume average item weight is 200g
+        except ValueError:
+            return 0
+    else:
+        # Try to extract just the number
+        try:
+            parts = quantity.split()
+            if parts and parts[0].replace('.', '', 1).isdigit():
+                num = float(parts[0])
+                if len(parts) > 1:
+                    unit = parts[1].lower()
+                    if unit in ['box', 'boxes', 'package', 'packages', 'pack', 'packs']:
+                        return num * 0.5  # Assume average package is 500g
+                    return num * 0.3  # Generic assumption for unspecified units
+                return num * 0.3  # Just a number, assume kg
+            return 0
+        except (ValueError, IndexError):
+            # If we can't parse it, make a conservative estimate
+            return 0.2
+
+
+def estimate_quantity_kg_simple(quantity):
+    """Simplified estimate used for waste prevention: kg amounts, else 0.5 kg."""
+    quantity = quantity.lower()
+    if 'kg' in quantity:
+        try:
+            return float(quantity.split('kg')[0].strip())
+        except ValueError:
+            return 0.5  # Default assumption
+    return 0.5  # Default assumption
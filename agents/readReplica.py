@@ -0,0 +1,140 @@
+"""
+Read replica: a periodically refreshed, read-only copy of the database for analytics.
+
+Long analytics scans (InsightsAgent reports, RecommendationAgent trends) run
+against a replica file instead of the primary the Donor/Recipient agents
+write to, so they never hold read locks that block writers or starve WAL
+checkpoints. `refresh_replica` copies the primary with the SQLite online
+backup API into a temporary file, brings the derived stores in the copy up to
+date with its own change log, stamps it in `replica_info`, and atomically
+swaps it into place. Connections opened before a refresh keep reading the
+previous copy until they reconnect.
+
+Keep a replica fresh every 5 minutes with:
+    python agents/readReplica.py --db database/foodcycle.sqlite --replica database/foodcycle-replica.sqlite --interval 300
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.archivePartitions import ArchivePartitions, PartitionedConnection
+from agents.categoryCounts import DonationCategoryCounts
+from agents.changeLog import ChangeLog
+from agents.donationSample import StratifiedDonationSample
+from agents.engagementStats import UserEngagementStore
+
+# Freshness reported for results read straight from the primary
+PRIMARY_METADATA = {"source": "primary", "staleness_seconds": 0}
+
+
+def refresh_replica(db_path, replica_path, pages=-1):
+    """Copy the primary database at db_path to replica_path.
+
+    pages is passed to the backup API: -1 copies under a single read
+    transaction, a positive number copies in steps and lets writers in
+    between (the copy restarts if the primary changes mid-way).
+    Returns the replica_info row written to the copy.
+    """
+    tmp_path = replica_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(tmp_path)
+    target.row_factory = sqlite3.Row
+    try:
+        source.backup(target, pages=pages)
+        target.execute("PRAGMA journal_mode = DELETE")
+
+        # Archived months live in the primary's partition files
+        partitions = ArchivePartitions(target, db_path)
+        partitions.open()
+        # Readers never sync on the read-only replica, so every store they read is caught up here
+        DonationCategoryCounts(target).sync()
+        UserEngagementStore(target).sync()
+        StratifiedDonationSample(target).sync()
+        target.commit()
+        partitions.close()
+
+        target.execute(
+            """
+            CREATE TABLE IF NOT EXISTS replica_info (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                primary_path TEXT NOT NULL,
+                refreshed_at TIMESTAMP NOT NULL,
+                change_log_offset INTEGER NOT NULL
+            )
+            """
+        )
+        info = {
+            "primary_path": os.path.abspath(db_path),
+            "refreshed_at": datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            "change_log_offset": ChangeLog(target).head()
+        }
+        target.execute(
+            """
+            INSERT OR REPLACE INTO replica_info (id, primary_path, refreshed_at, change_log_offset)
+            VALUES (1, :primary_path, :refreshed_at, :change_log_offset)
+            """,
+            info
+        )
+        target.commit()
+    finally:
+        target.close()
+        source.close()
+
+    os.replace(tmp_path, replica_path)
+    return info
+
+
+def open_replica(replica_path):
+    """Open a replica read-only, or return None if it does not exist yet."""
+    if not replica_path or not os.path.exists(replica_path):
+        return None
+    conn = sqlite3.connect(f"file:{os.path.abspath(replica_path)}?mode=ro", uri=True, factory=PartitionedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def replica_metadata(conn, now=None):
+    """Describe how fresh the data behind a replica connection is."""
+    now = now or datetime.utcnow()
+    row = conn.execute("SELECT refreshed_at, change_log_offset FROM replica_info WHERE id = 1").fetchone()
+    refreshed_at = datetime.strptime(row['refreshed_at'], '%Y-%m-%d %H:%M:%S')
+    return {
+        "source": "replica",
+        "refreshed_at": row['refreshed_at'],
+        "staleness_seconds": max(0, int((now - refreshed_at).total_seconds())),
+        "change_log_offset": row['change_log_offset']
+    }
+
+
+# Scheduled refresh
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the analytics read replica.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="Primary SQLite database")
+    parser.add_argument('--replica', default='database/foodcycle-replica.sqlite', help="Replica file")
+    parser.add_argument('--interval', type=int, default=0, help="Seconds between refreshes; 0 refreshes once")
+    parser.add_argument('--pages', type=int, default=-1, help="Pages copied per backup step (-1 for all)")
+    args = parser.parse_args()
+
+    try:
+        while True:
+            try:
+                info = refresh_replica(args.db, args.replica, args.pages)
+                print(f"Refreshed {args.replica} at {info['refreshed_at']} (change log offset {info['change_log_offset']})")
+            except sqlite3.Error as e:
+                print(f"Error refreshing replica: {e}")
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
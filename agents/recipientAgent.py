@@ -8,111 +8,158 @@ import os
 import sys
 from datetime import datetime, timedelta
 
-# Add parent directory to path to access shared modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-class RecipientAgent:
-    def __init__(self, db_path='database/foodcycle.sqlite'):
-        """Initialize the recipient agent with database connection."""
+from agents.archivePartitions import ArchivePartitions, PartitionedConnection
+from agents.donationSearch import DonationSearchIndex, build_match_query
+from agents.foodCategories import categorize_basic
+from agents.interestIndex import RecipientInterestIndex
+from agents.lazyConnection import LazyConnection
+from agents.pagination import DEFAULT_PAGE_SIZE, decode_page_token, encode_page_token, page_size
+from agents.recipientPreferences import RecipientPreferenceStore
+from agents.storage import create_storage
+
+class RecipientAgent(LazyConnection):
+    lazy_attributes = {
+        **dict.fromkeys(('conn', 'cursor', 'partitions', 'preferences', 'interests', 'storage'), 'connect_db'),
+        'search_index': 'connect_search'
+    }
+
+    def __init__(self, db_path='database/foodcycle.sqlite', storage_engine='sqlite'):
+        """Initialize the recipient agent; the database is opened on first use.
+        
+        storage_engine selects the backend for available-donation and history
+        reads: 'sqlite' queries the database, 'memory' loads it into an
+        indexed in-memory store that follows the change log.
+        """
         self.db_path = db_path
-        self.connect_db()
+        self.storage_engine = storage_engine
     
     def connect_db(self):
         """Connect to the SQLite database."""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = sqlite3.connect(self.db_path, factory=PartitionedConnection)
             self.conn.row_factory = sqlite3.Row  # Return rows as dictionaries
             self.cursor = self.conn.cursor()
+            self.partitions = ArchivePartitions(self.conn, self.db_path)
+            self.partitions.open()
+            self.preferences = RecipientPreferenceStore(self.conn)
+            self.interests = RecipientInterestIndex(self.conn)
+            self.storage = create_storage(self.conn, self.storage_engine)
             print(f"Connected to database: {self.db_path}")
         except sqlite3.Error as e:
             print(f"Database connection error: {e}")
             sys.exit(1)
     
+    def connect_search(self):
+        """Open the full-text search index, or fall back to substring search without FTS5."""
+        try:
+            self.search_index = DonationSearchIndex(self.conn)
+            self.conn.commit()
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search unavailable ({e}); using substring search")
+            self.search_index = None
+    
     def close_connection(self):
         """Close the database connection."""
-        if hasattr(self, 'conn'):
+        if self.is_loaded('conn'):
             self.conn.close()
             print("Database connection closed")
     
     def get_available_donations(self, limit=20):
         """Get a list of available donations ordered by expiry date."""
         try:
-            self.cursor.execute(
-                """
-                SELECT d.*, u.name as donor_name
-                FROM donations d
-                JOIN users u ON d.donor_id = u.id
-                WHERE d.status = 'available'
-                ORDER BY 
-                    CASE 
-                        WHEN d.expiry_date IS NULL THEN '9999-12-31'
-                        ELSE d.expiry_date 
-                    END ASC,
-                    d.created_at DESC
-                LIMIT ?
-                """,
-                (limit,)
-            )
-            donations = [dict(row) for row in self.cursor.fetchall()]
+            donations = self.storage.available_donations(limit)
             print(f"Retrieved {len(donations)} available donations")
             return donations
         except sqlite3.Error as e:
             print(f"Error retrieving available donations: {e}")
             return []
     
+    def search_donations(self, query, limit=20):
+        """Search available donations by food name and description, best match first."""
+        try:
+            if self.search_index is not None:
+                donations = self.search_index.search(query, limit)
+                self.conn.commit()
+            elif build_match_query(query) is None:
+                # Text without words matches nothing, as in the full-text index
+                donations = []
+            else:
+                pattern = f"%{query.strip()}%"
+                self.cursor.execute(
+                    """
+                    SELECT d.*, u.name as donor_name
+                    FROM donations d
+                    JOIN users u ON d.donor_id = u.id
+                    WHERE d.status = 'available' AND (d.food_name LIKE ? OR d.description LIKE ?)
+                    ORDER BY d.expiry_date ASC
+                    LIMIT ?
+                    """,
+                    (pattern, pattern, limit)
+                )
+                donations = [dict(row) for row in self.cursor.fetchall()]
+            print(f"Found {len(donations)} available donations matching '{query}'")
+            return donations
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error searching donations: {e}")
+            return []
+    
     def get_recipient_history(self, recipient_id):
         """Get a recipient's request history."""
         try:
-            self.cursor.execute(
-                """
-                SELECT r.*, d.food_name, d.quantity, d.expiry_date, u.name as donor_name
-                FROM requests r
-                JOIN donations d ON r.donation_id = d.id
-                JOIN users u ON d.donor_id = u.id
-                WHERE r.recipient_id = ?
-                ORDER BY r.created_at DESC
-                """,
-                (recipient_id,)
-            )
-            requests = [dict(row) for row in self.cursor.fetchall()]
+            requests = self.storage.recipient_history(recipient_id)
             print(f"Retrieved {len(requests)} requests for recipient {recipient_id}")
             return requests
         except sqlite3.Error as e:
             print(f"Error retrieving recipient history: {e}")
             return []
     
+    def get_recipient_history_page(self, recipient_id, limit=DEFAULT_PAGE_SIZE, page_token=None):
+        """Get one page of a recipient's request history, newest first.
+        
+        Pass the returned next_page_token to get the following page; it is
+        None on the last page.
+        """
+        listing = f"recipient_history:{recipient_id}"
+        try:
+            after = decode_page_token(page_token, listing)
+            requests, next_key = self.storage.recipient_history_page(recipient_id, page_size(limit), after)
+            return {
+                "requests": requests,
+                "next_page_token": encode_page_token(listing, next_key) if next_key else None
+            }
+        except ValueError as e:
+            return {
+                "status": "error",
+                "message": f"Invalid page token: {e}"
+            }
+        except sqlite3.Error as e:
+            print(f"Error retrieving recipient history: {e}")
+            return {
+                "status": "error",
+                "message": f"Failed to retrieve recipient history: {str(e)}"
+            }
+    
     def calculate_recipient_preferences(self, recipient_id):
-        """Calculate food preferences based on recipient's request history."""
-        requests = self.get_recipient_history(recipient_id)
+        """Calculate food preferences from the recipient's maintained preference vector."""
+        try:
+            # Counts of accepted or pending requests per category
+            food_types = self.preferences.get_preferences(recipient_id)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error retrieving recipient preferences: {e}")
+            food_types = {}
         
-        if not requests:
+        if not food_types:
             return {
                 "preferences": {},
                 "message": "No preference data available."
             }
         
-        # Extract food types from request history
-        food_types = {}
-        for request in requests:
-            if request['status'] != 'rejected':  # Only consider accepted or pending requests
-                food_name = request['food_name'].lower()
-                
-                # Categorize food
-                if 'vegetable' in food_name or 'veg' in food_name:
-                    category = 'vegetables'
-                elif 'fruit' in food_name:
-                    category = 'fruits'
-                elif 'bread' in food_name or 'bakery' in food_name:
-                    category = 'bakery'
-                elif 'canned' in food_name:
-                    category = 'canned goods'
-                elif 'dairy' in food_name or 'milk' in food_name or 'cheese' in food_name:
-                    category = 'dairy'
-                else:
-                    category = 'other'
-                
-                food_types[category] = food_types.get(category, 0) + 1
-        
         # Calculate preferences as percentages
         total_requests = sum(food_types.values())
         preferences = {k: round((v / total_requests) * 100) for k, v in food_types.items()}
@@ -145,21 +192,7 @@ class RecipientAgent:
         scored_donations = []
         for donation in available_donations:
             score = 0
-            food_name = donation['food_name'].lower()
-            
-            # Categorize the donation
-            if 'vegetable' in food_name or 'veg' in food_name:
-                category = 'vegetables'
-            elif 'fruit' in food_name:
-                category = 'fruits'
-            elif 'bread' in food_name or 'bakery' in food_name:
-                category = 'bakery'
-            elif 'canned' in food_name:
-                category = 'canned goods'
-            elif 'dairy' in food_name or 'milk' in food_name or 'cheese' in food_name:
-                category = 'dairy'
-            else:
-                category = 'other'
+            category = categorize_basic(donation['food_name'])
             
             # Score based on preference match
             if category in preferences['preferences']:
@@ -194,6 +227,40 @@ class RecipientAgent:
             "message": f"Found {len(matches)} donations matching your preferences."
         }
     
+    def get_notifications(self, recipient_id, limit=20):
+        """Return new donations queued for a recipient by the interest index and mark them delivered.
+        
+        Replaces polling match_donation_to_recipient: notifications are queued
+        when a matching donation is created. Donations taken in the meantime
+        are delivered but left out of the result.
+        """
+        try:
+            notifications = self.interests.pending_notifications(recipient_id, limit)
+            if not notifications:
+                return []
+            self.interests.mark_delivered([n['id'] for n in notifications])
+            self.conn.commit()
+            
+            donation_ids = [n['donation_id'] for n in notifications]
+            self.cursor.execute(
+                f"""
+                SELECT d.*, u.name as donor_name
+                FROM donations d
+                JOIN users u ON d.donor_id = u.id
+                WHERE d.id IN ({','.join('?' * len(donation_ids))}) AND d.status = 'available'
+                """,
+                donation_ids
+            )
+            donations = {row['id']: dict(row) for row in self.cursor.fetchall()}
+            return [
+                dict(donations[n['donation_id']], notification_id=n['id'], match_score=n['score'])
+                for n in notifications if n['donation_id'] in donations
+            ]
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error retrieving notifications: {e}")
+            return []
+    
     def create_request(self, recipient_id, donation_id):
         """Create a new request for a donation."""
         try:
@@ -221,6 +288,7 @@ class RecipientAgent:
                 "INSERT INTO requests (recipient_id, donation_id) VALUES (?, ?)",
                 (recipient_id, donation_id)
             )
+            request_id = self.cursor.lastrowid
             
             # Update donation status to 'reserved'
             self.cursor.execute(
@@ -233,15 +301,57 @@ class RecipientAgent:
             return {
                 "status": "success",
                 "message": "Request created successfully.",
-                "request_id": self.cursor.lastrowid
+                "request_id": request_id
             }
         except sqlite3.Error as e:
+            self.conn.rollback()
             print(f"Error creating request: {e}")
             return {
                 "status": "error",
                 "message": f"Failed to create request: {str(e)}"
             }
 
+    def update_request_status(self, request_id, status):
+        """Change a request's status; derived preference vectors follow via the change log."""
+        if status not in ('pending', 'accepted', 'rejected'):
+            return {
+                "status": "error",
+                "message": f"Invalid request status: {status}"
+            }
+        
+        try:
+            self.cursor.execute(
+                "SELECT id FROM requests WHERE id = ?",
+                (request_id,)
+            )
+            result = self.cursor.fetchone()
+            
+            if not result:
+                return {
+                    "status": "error",
+                    "message": "Request not found."
+                }
+            
+            # The change log picks up the transition for the preference vectors
+            self.cursor.execute(
+                "UPDATE requests SET status = ? WHERE id = ?",
+                (status, request_id)
+            )
+            self.conn.commit()
+            
+            return {
+                "status": "success",
+                "message": f"Request status updated to {status}.",
+                "request_id": request_id
+            }
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error updating request status: {e}")
+            return {
+                "status": "error",
+                "message": f"Failed to update request: {str(e)}"
+            }
+
 # Example usage
 if __name__ == "__main__":
     agent = RecipientAgent()
@@ -0,0 +1,248 @@
+"""
+RecipientPreferenceStore: Maintains incremental per-recipient preference vectors.
+
+For every recipient the store keeps the number of non-rejected requests per
+food category, for each taxonomy in `foodCategories.TAXONOMIES`. Vectors are
+adjusted from the change log when a request is created, changes status or is
+deleted, or its donation is deleted, so the matchers read a handful of rows
+instead of re-joining the recipient's whole request history.
+
+Alongside the plain counts each row carries an exponentially time-decayed
+score. It is stored as a sum of 2 ** ((created_at - DECAY_EPOCH) / half-life)
+terms so that adding or removing a single request stays exact and O(1); the
+current decayed count is that sum scaled by 2 ** (-(now - DECAY_EPOCH) / half-life).
+"""
+
+from datetime import datetime
+
+from agents.changeLog import ChangeLog
+from agents.donorProfiles import parse_timestamp
+from agents.foodCategories import TAXONOMIES
+
+CONSUMER = 'recipient_preferences'
+
+# Half-life of a request's contribution to the decayed preference score
+PREFERENCE_HALF_LIFE_DAYS = 30.0
+DECAY_EPOCH = datetime(2020, 1, 1)
+
+
+def decay_weight(timestamp):
+    """Return the epoch-normalized decay weight of a request created at timestamp."""
+    if isinstance(timestamp, str):
+        timestamp = parse_timestamp(timestamp)
+    days = (timestamp - DECAY_EPOCH).total_seconds() / 86400
+    return 2 ** (days / PREFERENCE_HALF_LIFE_DAYS)
+
+
+class RecipientPreferenceStore:
+    def __init__(self, conn):
+        """Initialize the preference store on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        self.create_tables()
+
+    def create_tables(self):
+        """Create the preference tables if they do not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS recipient_preferences (
+                recipient_id INTEGER NOT NULL,
+                taxonomy TEXT NOT NULL,
+                category TEXT NOT NULL,
+                request_count INTEGER NOT NULL DEFAULT 0,
+                decay_score REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (recipient_id, taxonomy, category)
+            )
+            """
+        )
+        # Recipients whose vector has been built, and the change log offset it reflects;
+        # others are built from history on first read
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS recipient_preference_state (
+                recipient_id INTEGER PRIMARY KEY,
+                built_offset INTEGER NOT NULL DEFAULT 0,
+                built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        self.cursor.execute("PRAGMA table_info(recipient_preference_state)")
+        if 'built_offset' not in [row['name'] for row in self.cursor.fetchall()]:
+            self.cursor.execute(
+                "ALTER TABLE recipient_preference_state ADD COLUMN built_offset INTEGER NOT NULL DEFAULT 0"
+            )
+        self.cursor.execute("PRAGMA table_info(recipient_preferences)")
+        if 'decay_score' not in [row['name'] for row in self.cursor.fetchall()]:
+            # Vectors built before decayed scores existed are rebuilt on next read
+            self.cursor.execute(
+                "ALTER TABLE recipient_preferences ADD COLUMN decay_score REAL NOT NULL DEFAULT 0"
+            )
+            self.cursor.execute("DELETE FROM recipient_preference_state")
+        # Also serves keyset-paginated request history, which seeks on (created_at, id)
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_requests_recipient_created ON requests (recipient_id, created_at)"
+        )
+        self.cursor.execute("DROP INDEX IF EXISTS idx_requests_recipient_id")
+
+    def get_preferences(self, recipient_id, taxonomy='basic', decayed=False):
+        """Return {category: non-rejected request count} for a recipient.
+
+        With decayed=True the counts are exponentially time-decayed as of now.
+        The caller is responsible for committing the catch-up writes.
+        """
+        self.sync()
+        self.cursor.execute(
+            "SELECT 1 FROM recipient_preference_state WHERE recipient_id = ?",
+            (recipient_id,)
+        )
+        if not self.cursor.fetchone():
+            self.rebuild(recipient_id)
+
+        self.cursor.execute(
+            """
+            SELECT category, request_count, decay_score
+            FROM recipient_preferences
+            WHERE recipient_id = ? AND taxonomy = ? AND request_count > 0
+            ORDER BY request_count DESC
+            """,
+            (recipient_id, taxonomy)
+        )
+        rows = self.cursor.fetchall()
+        if decayed:
+            scale = 1 / decay_weight(datetime.utcnow())
+            return {row['category']: row['decay_score'] * scale for row in rows}
+        return {row['category']: row['request_count'] for row in rows}
+
+    def sync(self):
+        """Apply request and donation events from the change log to the built vectors.
+
+        The caller is responsible for committing. Returns the number of events read.
+        """
+        if self.changes.get_offset(CONSUMER) is None:
+            # First run against this log: vectors built before it existed may be stale
+            self.cursor.execute("DELETE FROM recipient_preference_state")
+            self.changes.set_offset(CONSUMER, self.changes.head())
+        # Deleting a donation takes its requests out of the vectors
+        return self.changes.consume(CONSUMER, self._apply_events)
+
+    def _apply_events(self, events):
+        """Adjust vectors for a batch of request and donation events."""
+        transitions = self.changes.request_transitions(events, 'id, food_name')
+        recipient_ids = list({request['recipient_id'] for _, request, _, _, _ in transitions})
+        if not recipient_ids:
+            return
+        self.cursor.execute(
+            f"""
+            SELECT recipient_id, built_offset FROM recipient_preference_state
+            WHERE recipient_id IN ({','.join('?' * len(recipient_ids))})
+            """,
+            recipient_ids
+        )
+        built_offsets = {row['recipient_id']: row['built_offset'] for row in self.cursor.fetchall()}
+
+        for event, request, donation, old_status, new_status in transitions:
+            built_offset = built_offsets.get(request['recipient_id'])
+            # Unbuilt vectors are counted from history when first read, and
+            # events up to built_offset are already part of the rebuilt vector
+            if built_offset is None or event['offset'] <= built_offset:
+                continue
+
+            delta = (new_status not in (None, 'rejected')) - (old_status not in (None, 'rejected'))
+            if delta:
+                self._adjust(request['recipient_id'], donation['food_name'], request['created_at'], delta)
+
+    def _adjust(self, recipient_id, food_name, created_at, delta):
+        """Add delta to the recipient's count for the food's category in every taxonomy."""
+        weight = delta * decay_weight(created_at)
+        for taxonomy, categorize in TAXONOMIES.items():
+            self.cursor.execute(
+                """
+                INSERT INTO recipient_preferences (recipient_id, taxonomy, category, request_count, decay_score)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (recipient_id, taxonomy, category)
+                DO UPDATE SET request_count = request_count + excluded.request_count,
+                              decay_score = decay_score + excluded.decay_score
+                """,
+                (recipient_id, taxonomy, categorize(food_name), delta, weight)
+            )
+
+    def compute_from_history(self, recipient_id):
+        """Recount a recipient's preference vectors from the requests table.
+
+        Returns {taxonomy: {category: [request_count, decay_score]}}.
+        """
+        self.cursor.execute(
+            """
+            SELECT d.food_name, r.created_at
+            FROM requests_all r
+            JOIN donations_all d ON r.donation_id = d.id
+            WHERE r.recipient_id = ? AND r.status != 'rejected'
+            """,
+            (recipient_id,)
+        )
+        vectors = {taxonomy: {} for taxonomy in TAXONOMIES}
+        for row in self.cursor.fetchall():
+            weight = decay_weight(row['created_at'])
+            for taxonomy, categorize in TAXONOMIES.items():
+                entry = vectors[taxonomy].setdefault(categorize(row['food_name']), [0, 0.0])
+                entry[0] += 1
+                entry[1] += weight
+        return vectors
+
+    def rebuild(self, recipient_id):
+        """Replace a recipient's stored vectors with ones recounted from history."""
+        # Deleting first takes the write lock, so no event can land between
+        # reading the log head and reading the history it corresponds to
+        self.cursor.execute(
+            "DELETE FROM recipient_preferences WHERE recipient_id = ?",
+            (recipient_id,)
+        )
+        built_offset = self.changes.head()
+        vectors = self.compute_from_history(recipient_id)
+        self.cursor.executemany(
+            """
+            INSERT INTO recipient_preferences (recipient_id, taxonomy, category, request_count, decay_score)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(recipient_id, taxonomy, category, count, score)
+             for taxonomy, entries in vectors.items()
+             for category, (count, score) in entries.items()]
+        )
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO recipient_preference_state (recipient_id, built_offset) VALUES (?, ?)",
+            (recipient_id, built_offset)
+        )
+        return vectors
+
+    def check_consistency(self, recipient_ids=None, repair=False):
+        """Compare stored vectors against history and optionally rebuild drifted ones.
+
+        Returns a list of {recipient_id, taxonomy, stored, expected} mismatches.
+        """
+        self.sync()
+        if recipient_ids is None:
+            self.cursor.execute("SELECT recipient_id FROM recipient_preference_state")
+            recipient_ids = [row['recipient_id'] for row in self.cursor.fetchall()]
+
+        mismatches = []
+        for recipient_id in recipient_ids:
+            expected = self.compute_from_history(recipient_id)
+            drifted = False
+            for taxonomy in TAXONOMIES:
+                stored = self.get_preferences(recipient_id, taxonomy)
+                expected_counts = {c: entry[0] for c, entry in expected[taxonomy].items()}
+                if stored != expected_counts:
+                    drifted = True
+                    mismatches.append({
+                        "recipient_id": recipient_id,
+                        "taxonomy": taxonomy,
+                        "stored": stored,
+                        "expected": expected_counts
+                    })
+            if drifted and repair:
+                self.rebuild(recipient_id)
+
+        if repair:
+            self.conn.commit()
+        return mismatches
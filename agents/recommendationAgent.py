@@ -6,46 +6,152 @@ import sqlite3
 import json
 import os
 import sys
+import time
 from datetime import datetime, timedelta
 
-# Add parent directory to path to access shared modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-class RecommendationAgent:
-    def __init__(self, db_path='database/foodcycle.sqlite'):
-        """Initialize the recommendation agent with database connection."""
+from agents.archivePartitions import ArchivePartitions, PartitionedConnection
+from agents.categoryCounts import DonationCategoryCounts
+from agents.deadline import Deadline
+from agents.foodCategories import FOOD_CATEGORIES
+from agents.lazyConnection import LazyConnection
+from agents.readReplica import PRIMARY_METADATA, open_replica, replica_metadata
+from agents.recipientPreferences import RecipientPreferenceStore
+from agents.requestMemo import RequestMemo
+from agents.storage import create_storage
+from agents.trendingFoods import TrendingFoodSketch
+
+# Parts of the trend and community-needs results, in output order
+TREND_SECTIONS = ('daily_trends', 'food_categories', 'shelf_life')
+NEEDS_SECTIONS = ('most_requested', 'high_demand_categories', 'available_categories', 'supply_demand_gap')
+
+# Candidate donations scored per recipient request
+CANDIDATE_LIMIT = 30
+# Deadline-aware requests may reuse a candidate list fetched this recently
+CANDIDATE_CACHE_SECONDS = 10
+
+
+def supply_demand_gap(high_demand_categories, available_categories):
+    """Percentage of each high-demand category's demand not covered by available donations, biggest first."""
+    all_categories = set(high_demand_categories.keys()) | set(available_categories.keys())
+    gaps = {}
+    
+    for category in all_categories:
+        demand = high_demand_categories.get(category, 0)
+        supply = available_categories.get(category, 0)
+        
+        if demand > 0:
+            # Calculate as percentage: (demand - supply) / demand * 100
+            gap = (demand - min(demand, supply)) / demand * 100
+            gaps[category] = round(gap)
+    
+    # Sort by gap size (descending)
+    return dict(sorted(gaps.items(), key=lambda x: x[1], reverse=True))
+
+
+class RecommendationAgent(LazyConnection):
+    lazy_attributes = {
+        **dict.fromkeys(('conn', 'cursor', 'partitions', 'preferences', 'trending', 'category_counts', 'storage'),
+                        'connect_db'),
+        **dict.fromkeys(('analytics_conn', 'analytics_counts'), 'connect_analytics'),
+        'scoring_model': 'init_scoring_model'
+    }
+
+    def __init__(self, db_path='database/foodcycle.sqlite', model_path=None, replica_path=None,
+                 storage_engine='sqlite'):
+        """Initialize the recommendation agent; the database, replica and
+        scoring model are opened on first use.
+        
+        model_path optionally points to a scoring model trained with
+        agents/scoringModel.py; without one, donations are ranked with the
+        hand-tuned scores.
+        
+        replica_path optionally points to a read replica maintained by
+        agents/readReplica.py; trend analysis then runs there while
+        recommendations stay on the primary.
+        
+        storage_engine selects the backend candidate donations are read
+        from: 'sqlite' or 'memory' (see agents/storage.py).
+        """
         self.db_path = db_path
-        self.connect_db()
+        self.replica_path = replica_path
+        self.model_path = model_path
+        self.storage_engine = storage_engine
+        self.memo = RequestMemo()
+        # (monotonic fetch time, donations) shared by deadline-aware requests
+        self.candidate_cache = None
         
         # Define food categories for classification
-        self.food_categories = {
-            'vegetables': ['vegetable', 'veg', 'greens', 'lettuce', 'spinach', 'carrot', 'tomato'],
-            'fruits': ['fruit', 'apple', 'banana', 'orange', 'berry', 'berries'],
-            'dairy': ['dairy', 'milk', 'cheese', 'yogurt', 'butter', 'cream'],
-            'bakery': ['bread', 'bakery', 'cake', 'pastry', 'roll', 'bun'],
-            'canned': ['canned', 'can', 'preserved', 'jar', 'tin'],
-            'grains': ['rice', 'pasta', 'grain', 'cereal', 'oat', 'wheat'],
-            'meat': ['meat', 'beef', 'chicken', 'pork', 'fish', 'seafood', 'poultry'],
-            'ready': ['prepared', 'meal', 'cooked', 'ready', 'leftover']
-        }
+        self.food_categories = FOOD_CATEGORIES
     
     def connect_db(self):
         """Connect to the SQLite database."""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = sqlite3.connect(self.db_path, factory=PartitionedConnection)
             self.conn.row_factory = sqlite3.Row  # Return rows as dictionaries
             self.cursor = self.conn.cursor()
+            self.partitions = ArchivePartitions(self.conn, self.db_path)
+            self.partitions.open()
+            self.preferences = RecipientPreferenceStore(self.conn)
+            self.trending = TrendingFoodSketch(self.conn)
+            self.category_counts = DonationCategoryCounts(self.conn)
+            self.storage = create_storage(self.conn, self.storage_engine)
+            # Lets the high-demand subquery count requests per donation from the index
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_requests_donation_id ON requests (donation_id)")
             print(f"Connected to database: {self.db_path}")
         except sqlite3.Error as e:
             print(f"Database connection error: {e}")
             sys.exit(1)
     
+    def connect_analytics(self):
+        """Open the read replica for trend analysis, or fall back to the primary connection."""
+        self.analytics_conn = None
+        try:
+            self.analytics_conn = open_replica(self.replica_path)
+            if self.analytics_conn is not None:
+                ArchivePartitions(self.analytics_conn, self.db_path).open()
+                self.analytics_counts = DonationCategoryCounts(self.analytics_conn)
+                print(f"Using read replica for analytics: {self.replica_path}")
+                return
+        except sqlite3.Error as e:
+            print(f"Error opening read replica: {e}")
+            if self.analytics_conn is not None:
+                self.analytics_conn.close()
+                self.analytics_conn = None
+        if self.replica_path:
+            print("Read replica unavailable; running analytics on the primary database")
+    
     def close_connection(self):
         """Close the database connection."""
-        if hasattr(self, 'conn'):
+        if self.is_loaded('analytics_conn') and self.analytics_conn is not None:
+            self.analytics_conn.close()
+        if self.is_loaded('conn'):
             self.conn.close()
             print("Database connection closed")
     
+    def init_scoring_model(self):
+        """Load the scoring model named at construction."""
+        self.scoring_model = self.load_scoring_model(self.model_path)
+    
+    def load_scoring_model(self, model_path):
+        """Load the learned scoring model, or return None to use hand-tuned scores."""
+        if not model_path:
+            return None
+        try:
+            # Imported here so NumPy is only loaded when a model is used
+            from agents.scoringModel import ScoringModel
+        except ImportError:
+            print("NumPy is not installed; using hand-tuned recommendation scores")
+            return None
+        try:
+            return ScoringModel.load(model_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading scoring model: {e}")
+            return None
+    
     def categorize_food(self, food_name):
         """Categorize food based on keywords in the name."""
         food_name = food_name.lower()
@@ -57,141 +163,220 @@ class RecommendationAgent:
         
         return 'other'
     
-    def analyze_donation_trends(self):
-        """Analyze trends in donations over time."""
+    def categorize_food_cached(self, food_name):
+        """Categorize a food once per request scope."""
+        return self.memo.get(('category', food_name), lambda: self.categorize_food(food_name))
+    
+    def analyze_donation_trends(self, sections=TREND_SECTIONS):
+        """Analyze trends in donations over time.
+        
+        sections limits the result to the named parts of TREND_SECTIONS;
+        the others are not computed.
+        """
+        if self.analytics_conn is not None:
+            cursor = self.analytics_conn.cursor()
+            metadata = replica_metadata(self.analytics_conn)
+        else:
+            cursor = self.cursor
+            metadata = dict(PRIMARY_METADATA)
+        
+        builders = {
+            'daily_trends': lambda: self._daily_trends(cursor),
+            'food_categories': self._trend_food_categories,
+            'shelf_life': lambda: self._shelf_life(cursor)
+        }
         try:
-            # Overall donation trends
-            self.cursor.execute(
-                """
-                SELECT 
-                    date(created_at) as donation_date,
-                    COUNT(*) as donation_count
-                FROM donations
-                GROUP BY donation_date
-                ORDER BY donation_date DESC
-                LIMIT 30
-                """
-            )
-            daily_counts = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Food type trends
-            self.cursor.execute("SELECT food_name FROM donations")
-            food_names = [row['food_name'] for row in self.cursor.fetchall()]
-            
-            food_categories = {}
-            for food in food_names:
-                category = self.categorize_food(food)
-                food_categories[category] = food_categories.get(category, 0) + 1
-            
-            # Sort by frequency
-            food_categories = dict(sorted(food_categories.items(), key=lambda x: x[1], reverse=True))
-            
-            # Expiration patterns
-            self.cursor.execute(
-                """
-                SELECT
-                    CASE
-                        WHEN julianday(expiry_date) - julianday(created_at) <= 3 THEN 'very_short'
-                        WHEN julianday(expiry_date) - julianday(created_at) <= 7 THEN 'short'
-                        WHEN julianday(expiry_date) - julianday(created_at) <= 14 THEN 'medium'
-                        ELSE 'long'
-                    END as shelf_life,
-                    COUNT(*) as count
-                FROM donations
-                WHERE expiry_date IS NOT NULL
-                GROUP BY shelf_life
-                ORDER BY count DESC
-                """
-            )
-            shelf_life = [dict(row) for row in self.cursor.fetchall()]
-            
-            return {
-                "daily_trends": daily_counts,
-                "food_categories": food_categories,
-                "shelf_life": shelf_life
-            }
+            with self.memo.scope():
+                trends = {name: self.memo.get(('trends', name), builders[name]) for name in sections}
+            trends["metadata"] = metadata
+            return trends
         except sqlite3.Error as e:
             print(f"Error analyzing donation trends: {e}")
             return {}
     
-    def identify_community_needs(self):
-        """Identify current community needs based on requests and available food."""
+    def _daily_trends(self, cursor):
+        """Donation counts for the 30 most recent days with donations."""
+        cursor.execute(
+            """
+            SELECT 
+                date(created_at) as donation_date,
+                COUNT(*) as donation_count
+            FROM donations_all
+            GROUP BY donation_date
+            ORDER BY donation_date DESC
+            LIMIT 30
+            """
+        )
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def _trend_food_categories(self):
+        """Food type trends, from the maintained category counts."""
+        if self.analytics_conn is not None:
+            # The replica's counts were brought up to date when it was refreshed
+            return self.analytics_counts.counts('all', sync=False)
+        food_categories = self.category_counts.counts('all')
+        self.conn.commit()
+        return food_categories
+    
+    def _shelf_life(self, cursor):
+        """Donation counts per shelf-life bucket."""
+        cursor.execute(
+            """
+            SELECT
+                CASE
+                    WHEN julianday(expiry_date) - julianday(created_at) <= 3 THEN 'very_short'
+                    WHEN julianday(expiry_date) - julianday(created_at) <= 7 THEN 'short'
+                    WHEN julianday(expiry_date) - julianday(created_at) <= 14 THEN 'medium'
+                    ELSE 'long'
+                END as shelf_life,
+                COUNT(*) as count
+            FROM donations_all
+            WHERE expiry_date IS NOT NULL
+            GROUP BY shelf_life
+            ORDER BY count DESC
+            """
+        )
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def identify_community_needs(self, sections=NEEDS_SECTIONS):
+        """Identify current community needs based on requests and available food.
+        
+        sections limits the result to the named parts of NEEDS_SECTIONS;
+        the others are not computed.
+        """
+        builders = {
+            'most_requested': self._most_requested,
+            'high_demand_categories': self._high_demand_categories,
+            'available_categories': self._available_categories,
+            'supply_demand_gap': self._supply_demand_gap
+        }
         try:
-            # Most requested food types
-            self.cursor.execute(
-                """
-                SELECT d.food_name, COUNT(*) as request_count
-                FROM requests r
-                JOIN donations d ON r.donation_id = d.id
-                GROUP BY d.food_name
-                ORDER BY request_count DESC
-                LIMIT 10
-                """
-            )
-            most_requested = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Most requested but unavailable categories
-            self.cursor.execute(
-                """
-                SELECT food_name FROM donations 
-                WHERE status = 'completed' 
-                AND id IN (
-                    SELECT donation_id FROM requests GROUP BY donation_id
-                    HAVING COUNT(*) > 1
-                )
-                ORDER BY created_at DESC
-                LIMIT 20
-                """
-            )
-            high_demand_foods = [row['food_name'] for row in self.cursor.fetchall()]
-            
-            high_demand_categories = {}
-            for food in high_demand_foods:
-                category = self.categorize_food(food)
-                high_demand_categories[category] = high_demand_categories.get(category, 0) + 1
-            
-            # Sort by frequency
-            high_demand_categories = dict(sorted(high_demand_categories.items(), key=lambda x: x[1], reverse=True))
-            
-            # Currently available categories
-            self.cursor.execute("SELECT food_name FROM donations WHERE status = 'available'")
-            available_foods = [row['food_name'] for row in self.cursor.fetchall()]
-            
-            available_categories = {}
-            for food in available_foods:
-                category = self.categorize_food(food)
-                available_categories[category] = available_categories.get(category, 0) + 1
-            
-            # Calculate supply-demand gap
-            all_categories = set(high_demand_categories.keys()) | set(available_categories.keys())
-            supply_demand_gap = {}
-            
-            for category in all_categories:
-                demand = high_demand_categories.get(category, 0)
-                supply = available_categories.get(category, 0)
-                
-                if demand > 0:
-                    # Calculate as percentage: (demand - supply) / demand * 100
-                    gap = (demand - min(demand, supply)) / demand * 100
-                    supply_demand_gap[category] = round(gap)
-            
-            # Sort by gap size (descending)
-            supply_demand_gap = dict(sorted(supply_demand_gap.items(), key=lambda x: x[1], reverse=True))
-            
-            return {
-                "most_requested": most_requested,
-                "high_demand_categories": high_demand_categories,
-                "available_categories": available_categories,
-                "supply_demand_gap": supply_demand_gap
-            }
+            with self.memo.scope():
+                return {name: self.memo.get(('needs', name), builders[name]) for name in sections}
         except sqlite3.Error as e:
             print(f"Error identifying community needs: {e}")
             return {}
     
+    def _most_requested(self):
+        """Most requested food types over the last 30 days, from the streaming sketch."""
+        most_requested = [{"food_name": t['item'], "request_count": t['count']}
+                          for t in self.trending.top(10, window_days=30)]
+        self.conn.commit()
+        return most_requested
+    
+    def _high_demand_foods(self):
+        """(created_at, food_name) of the 20 most recently created completed donations that drew more than one request."""
+        self.cursor.execute(
+            """
+            SELECT created_at, food_name FROM donations_all 
+            WHERE status = 'completed' 
+            AND id IN (
+                SELECT donation_id FROM requests_all GROUP BY donation_id
+                HAVING COUNT(*) > 1
+            )
+            ORDER BY created_at DESC
+            LIMIT 20
+            """
+        )
+        return [(row['created_at'], row['food_name']) for row in self.cursor.fetchall()]
+    
+    def _high_demand_categories(self):
+        """Categories of recently completed donations that drew more than one request."""
+        return self.category_frequencies(food for _, food in self._high_demand_foods())
+    
+    def category_frequencies(self, food_names):
+        """Count food names per category, most frequent first."""
+        high_demand_categories = {}
+        for food in food_names:
+            category = self.categorize_food_cached(food)
+            high_demand_categories[category] = high_demand_categories.get(category, 0) + 1
+        
+        # Sort by frequency
+        return dict(sorted(high_demand_categories.items(), key=lambda x: x[1], reverse=True))
+    
+    def _available_categories(self):
+        """Currently available categories, from the maintained category counts."""
+        available_categories = self.category_counts.counts('available')
+        self.conn.commit()
+        return available_categories
+    
+    def _supply_demand_gap(self):
+        """Percentage of each high-demand category's demand not covered by available donations."""
+        high_demand_categories = self.memo.get(('needs', 'high_demand_categories'), self._high_demand_categories)
+        available_categories = self.memo.get(('needs', 'available_categories'), self._available_categories)
+        
+        return supply_demand_gap(high_demand_categories, available_categories)
+    
     def generate_donor_recommendations(self, donor_id=None):
         """Generate personalized recommendations for donors."""
-        community_needs = self.identify_community_needs()
-        trends = self.analyze_donation_trends()
+        with self.memo.scope():
+            return self._generate_donor_recommendations(donor_id)
+    
+    def _generate_donor_recommendations(self, donor_id):
+        context = self.donor_recommendation_context()
+        
+        # Add recommendations based on specific donor history if donor_id is provided
+        donor_foods = None
+        if donor_id:
+            try:
+                self.cursor.execute(
+                    "SELECT food_name FROM donations_all WHERE donor_id = ? ORDER BY created_at DESC LIMIT 10",
+                    (donor_id,)
+                )
+                donor_foods = [row['food_name'] for row in self.cursor.fetchall()]
+            except sqlite3.Error as e:
+                print(f"Error analyzing donor history: {e}")
+        
+        return self.build_donor_recommendations(context, donor_foods)
+    
+    def donor_recommendation_context(self):
+        """Compute the community needs and trends shared by every donor's recommendations."""
+        # Only the sections used below are computed
+        return {
+            "community_needs": self.identify_community_needs(sections=('supply_demand_gap',)),
+            "trends": self.analyze_donation_trends()
+        }
+    
+    def community_partial(self):
+        """Read the mergeable inputs of the donor recommendation context from this database.
+        
+        Counts are {key: count} maps; daily trends keep this database's 30
+        most recent days, which include every one of them in the merged 30.
+        """
+        with self.memo.scope():
+            return {
+                "daily_trends": {row['donation_date']: row['donation_count'] for row in self._daily_trends(self.cursor)},
+                "food_categories": self._trend_food_categories(),
+                "shelf_life": {row['shelf_life']: row['count'] for row in self._shelf_life(self.cursor)},
+                "high_demand_foods": self._high_demand_foods(),
+                "available_categories": self._available_categories()
+            }
+    
+    def context_from_partial(self, partial, metadata=None):
+        """Build a donor recommendation context, as donor_recommendation_context returns, from a merged partial."""
+        def by_count(counts):
+            return sorted(counts.items(), key=lambda x: x[1], reverse=True)
+        
+        recent = sorted(partial['high_demand_foods'], key=lambda x: x[0] or '', reverse=True)[:20]
+        with self.memo.scope():
+            high_demand_categories = self.category_frequencies(food for _, food in recent)
+        daily = sorted(partial['daily_trends'].items(), key=lambda x: x[0] or '', reverse=True)[:30]
+        return {
+            "community_needs": {
+                "supply_demand_gap": supply_demand_gap(high_demand_categories, partial['available_categories'])
+            },
+            "trends": {
+                "daily_trends": [{"donation_date": day, "donation_count": count} for day, count in daily],
+                "food_categories": dict(by_count(partial['food_categories'])),
+                "shelf_life": [{"shelf_life": bucket, "count": count} for bucket, count in by_count(partial['shelf_life'])],
+                "metadata": metadata or dict(PRIMARY_METADATA)
+            }
+        }
+    
+    def build_donor_recommendations(self, context, donor_foods=None):
+        """Combine the shared context with a donor's recent food names (newest first) into recommendations."""
+        community_needs = context['community_needs']
+        trends = context['trends']
         
         recommendations = []
         
@@ -214,36 +399,26 @@ class RecommendationAgent:
                     "message": "Many donations have very short shelf life. Consider donating items that last longer."
                 })
         
-        # Add recommendations based on specific donor history if donor_id is provided
-        if donor_id:
-            try:
-                self.cursor.execute(
-                    "SELECT food_name FROM donations WHERE donor_id = ? ORDER BY created_at DESC LIMIT 10",
-                    (donor_id,)
-                )
-                donor_foods = [row['food_name'] for row in self.cursor.fetchall()]
-                
-                donor_categories = {}
-                for food in donor_foods:
-                    category = self.categorize_food(food)
-                    donor_categories[category] = donor_categories.get(category, 0) + 1
-                
-                # Sort by frequency
-                donor_categories = dict(sorted(donor_categories.items(), key=lambda x: x[1], reverse=True))
+        if donor_foods:
+            donor_categories = {}
+            for food in donor_foods:
+                category = self.categorize_food_cached(food)
+                donor_categories[category] = donor_categories.get(category, 0) + 1
+            
+            # Sort by frequency
+            donor_categories = dict(sorted(donor_categories.items(), key=lambda x: x[1], reverse=True))
+            
+            # Recommend diversification if donor mostly donates one category
+            if donor_categories and list(donor_categories.values())[0] > 0.6 * sum(donor_categories.values()):
+                most_donated = list(donor_categories.keys())[0]
+                needed_categories = [c for c, g in community_needs.get('supply_demand_gap', {}).items() 
+                                    if g > 30 and c != most_donated]
                 
-                # Recommend diversification if donor mostly donates one category
-                if donor_categories and list(donor_categories.values())[0] > 0.6 * sum(donor_categories.values()):
-                    most_donated = list(donor_categories.keys())[0]
-                    needed_categories = [c for c, g in community_needs.get('supply_demand_gap', {}).items() 
-                                        if g > 30 and c != most_donated]
-                    
-                    if needed_categories:
-                        recommendations.append({
-                            "type": "diversify",
-                            "message": f"You frequently donate {most_donated}. Consider diversifying with {needed_categories[0]} which is in high demand."
-                        })
-            except sqlite3.Error as e:
-                print(f"Error analyzing donor history: {e}")
+                if needed_categories:
+                    recommendations.append({
+                        "type": "diversify",
+                        "message": f"You frequently donate {most_donated}. Consider diversifying with {needed_categories[0]} which is in high demand."
+                    })
         
         # Add general recommendations if we don't have many specific ones
         if len(recommendations) < 3:
@@ -273,70 +448,77 @@ class RecommendationAgent:
             }
         }
     
-    def generate_recipient_recommendations(self, recipient_id):
-        """Generate personalized recommendations for recipients."""
+    def generate_recipient_recommendations(self, recipient_id, budget_ms=None):
+        """Generate personalized recommendations for recipients.
+        
+        With budget_ms the request is deadline-aware: candidates may come from
+        a recently cached list, scoring stops when the budget is spent, and
+        the optional unavailable-preference and expiring-soon blocks are
+        skipped once it is. The response then reports each degraded section
+        and why under "degraded".
+        """
+        with self.memo.scope():
+            return self._generate_recipient_recommendations(recipient_id, Deadline(budget_ms))
+    
+    def available_candidates(self, deadline):
+        """Return (candidate donations, age in seconds of the list served)."""
+        if deadline.bounded and self.candidate_cache is not None:
+            fetched_at, donations = self.candidate_cache
+            age = time.monotonic() - fetched_at
+            if age <= CANDIDATE_CACHE_SECONDS:
+                return donations, age
+        # Candidates need no donor, so donations of deleted users are still recommended
+        donations = self.storage.available_donations(CANDIDATE_LIMIT, with_donor=False)
+        self.candidate_cache = (time.monotonic(), donations)
+        return donations, 0
+    
+    def _generate_recipient_recommendations(self, recipient_id, deadline):
+        degraded = {}
         try:
-            # Get recipient's request history
-            self.cursor.execute(
-                """
-                SELECT d.food_name, d.expiry_date, r.status
-                FROM requests r
-                JOIN donations d ON r.donation_id = d.id
-                WHERE r.recipient_id = ?
-                ORDER BY r.created_at DESC
-                """,
-                (recipient_id,)
-            )
-            request_history = [dict(row) for row in self.cursor.fetchall()]
-            
-            # Calculate preferred categories
-            preferences = {}
-            for request in request_history:
-                if request['status'] != 'rejected':
-                    category = self.categorize_food(request['food_name'])
-                    preferences[category] = preferences.get(category, 0) + 1
+            # Preferred categories from the recipient's maintained preference vector
+            preferences = self.preferences.get_preferences(recipient_id, 'extended')
+            self.conn.commit()
             
             # Available donations
-            self.cursor.execute(
-                """
-                SELECT *
-                FROM donations
-                WHERE status = 'available'
-                ORDER BY 
-                    CASE 
-                        WHEN expiry_date IS NULL THEN '9999-12-31'
-                        ELSE expiry_date 
-                    END ASC
-                LIMIT 30
-                """
-            )
-            available = [dict(row) for row in self.cursor.fetchall()]
+            available, age = self.available_candidates(deadline)
+            if age:
+                degraded["candidates"] = f"served from a list cached {age:.1f}s ago"
             
             # Score and rank available donations
-            scored_donations = []
-            for donation in available:
-                score = 0
-                category = self.categorize_food(donation['food_name'])
-                
-                # Base score on preferences
-                if category in preferences:
-                    score += preferences[category] * 10
-                
-                # Consider expiration (prioritize items with reasonable shelf life)
-                if donation['expiry_date']:
-                    try:
-                        expiry = datetime.strptime(donation['expiry_date'], '%Y-%m-%d')
-                        days_left = (expiry - datetime.now()).days
-                        
-                        if 3 <= days_left <= 10:
-                            score += 20
-                        elif days_left > 10:
-                            score += 10
-                    except (ValueError, TypeError):
-                        pass
-                
-                scored_donations.append((donation, score))
-            
+            if self.scoring_model is not None:
+                decayed_preferences = self.preferences.get_preferences(recipient_id, 'extended', decayed=True)
+                scores = self.scoring_model.score_donations(available, decayed_preferences, self.categorize_food_cached)
+                scored_donations = list(zip(available, scores.tolist()))
+            else:
+                scored_donations = []
+                for i, donation in enumerate(available):
+                    # Out of time: the rest keep their expiry order behind the scored ones
+                    if deadline.expired():
+                        degraded["recommended_donations"] = f"scored {i} of {len(available)} candidates"
+                        scored_donations.extend((d, 0) for d in available[i:])
+                        break
+                    score = 0
+                    category = self.categorize_food_cached(donation['food_name'])
+                    
+                    # Base score on preferences
+                    if category in preferences:
+                        score += preferences[category] * 10
+                    
+                    # Consider expiration (prioritize items with reasonable shelf life)
+                    if donation['expiry_date']:
+                        try:
+                            expiry = datetime.strptime(donation['expiry_date'], '%Y-%m-%d')
+                            days_left = (expiry - datetime.now()).days
+                    
+                            if 3 <= days_left <= 10:
+                                score += 20
+                            elif days_left > 10:
+                                score += 10
+                        except (ValueError, TypeError):
+                            pass
+                    
+                    scored_donations.append((donation, score))
+                    
             # Sort by score
             scored_donations.sort(key=lambda x: x[1], reverse=True)
             
@@ -352,31 +534,42 @@ class RecommendationAgent:
                 })
             
             # Preferred but unavailable categories
-            available_categories = {self.categorize_food(d['food_name']) for d in available}
-            missing_preferences = [p for p in preferences if p not in available_categories]
-            
-            if missing_preferences:
-                recommendations.append({
-                    "type": "unavailable_preference",
-                    "message": f"Your preferred food categories ({', '.join(missing_preferences)}) are currently unavailable. Consider alternative options or check back later."
-                })
+            if deadline.expired():
+                degraded["unavailable_preference"] = "skipped: over budget"
+            else:
+                available_categories = {self.categorize_food_cached(d['food_name']) for d in available}
+                missing_preferences = [p for p in preferences if p not in available_categories]
+                
+                if missing_preferences:
+                    recommendations.append({
+                        "type": "unavailable_preference",
+                        "message": f"Your preferred food categories ({', '.join(missing_preferences)}) are currently unavailable. Consider alternative options or check back later."
+                    })
             
             # Expiring soon
-            expiring_soon = [d for d in available if d['expiry_date'] and 
-                             datetime.strptime(d['expiry_date'], '%Y-%m-%d') - datetime.now() <= timedelta(days=3)]
-            
-            if expiring_soon:
-                recommendations.append({
-                    "type": "expiring_soon",
-                    "message": f"There are {len(expiring_soon)} donations expiring soon. Consider requesting these to prevent food waste.",
-                    "donations": expiring_soon[:3]
-                })
+            if deadline.expired():
+                degraded["expiring_soon"] = "skipped: over budget"
+            else:
+                expiring_soon = [d for d in available if d['expiry_date'] and 
+                                 datetime.strptime(d['expiry_date'], '%Y-%m-%d') - datetime.now() <= timedelta(days=3)]
+                
+                if expiring_soon:
+                    recommendations.append({
+                        "type": "expiring_soon",
+                        "message": f"There are {len(expiring_soon)} donations expiring soon. Consider requesting these to prevent food waste.",
+                        "donations": expiring_soon[:3]
+                    })
             
-            return {
+            result = {
                 "recipient_id": recipient_id,
                 "preferences": preferences,
                 "recommendations": recommendations
             }
+            if deadline.bounded:
+                result["budget_ms"] = deadline.budget_ms
+                result["elapsed_ms"] = round(deadline.elapsed_ms(), 2)
+                result["degraded"] = degraded
+            return result
         except sqlite3.Error as e:
             print(f"Error generating recipient recommendations: {e}")
             return {
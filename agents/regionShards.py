@@ -0,0 +1,652 @@
+"""
+RegionShards: Per-region SQLite files for donations, requests and messages.
+
+One `foodcycle.sqlite` serving several cities makes every agent query scan
+every city. `ShardRouter` places each region in its own database file
+(`shards/<db>-<n>-<region>.sqlite` next to the main database). A shard is a
+complete FoodCycle database: the agents open it like the main one, and their
+queries, maintained stores and archive partitions only ever see that region.
+The main database becomes the directory. It keeps:
+
+- the `users` table, so user ids and emails stay unique across regions;
+  each shard holds a copy of its region's users
+- `region_shards`, the catalog of shard files
+- `region_locations`, which donation locations belong to which region
+- `user_regions`, the region every user is served from
+- `donation_regions` and `request_regions`, the region of every donation
+  and request placed by `split`
+
+A donation lives in its donor's shard and a request lives with its donation,
+so a recipient's requests are spread over every region they requested from.
+A message lives in its sender's shard. Each shard allocates new donation,
+request and message ids from its own block of ID_BLOCK ids. A donation or
+request id therefore names its shard without a lookup, and only ids placed
+by `split` are looked up in `donation_regions` and `request_regions`. Every
+id stays below 2**32, the bits agents/donationSearch.py keeps for the
+donation id in its search key: ids placed by `split` must be below ID_BLOCK,
+there are at most MAX_SHARDS regions, and a shard refuses inserts once its
+block is used up. Adding a region creates a new, empty file and never
+touches the existing shards.
+
+`agent_for_user` serves reads scoped to one region. Requests go through the
+router instead: `create_request` and `update_request_status` run on the
+shard holding the donation, and `recipient_history` and
+`recipient_history_page` gather a recipient's requests from every shard and
+from the directory's pre-split archive partitions.
+
+Global aggregates over every shard are computed by agents/scatterGather.py.
+
+Register two regions, split a single database into them and list the shards with:
+    python agents/regionShards.py --db database/foodcycle.sqlite --add-region London "Community Center" Downtown --add-region Leeds Eastside --split London --list
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+from contextlib import contextmanager
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.coldStorage import DONATION_FIELDS, REQUEST_FIELDS, create_cold_storage
+from agents.pagination import DEFAULT_PAGE_SIZE, decode_page_token, encode_page_token, page_size
+
+# Base tables every shard is created with, from the directory's own definitions
+SHARD_TABLES = ('users', 'donations', 'requests', 'messages')
+# Tables whose new ids a shard allocates from its own block
+ID_TABLES = ('donations', 'requests', 'messages')
+# Ids a shard allocates; blocks stay below the 2**32 donation ids DonationSearchIndex can pack
+ID_BLOCK = 2 ** 24
+MAX_SHARDS = 2 ** 32 // ID_BLOCK - 1
+
+
+class ShardRouter:
+    def __init__(self, conn, db_path, shard_dir=None):
+        """Initialize the shard directory in the database at db_path."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.db_path = db_path
+        self.shard_dir = shard_dir or self.default_shard_dir(db_path)
+        self.db_name = os.path.splitext(os.path.basename(db_path))[0]
+        # {(agent class, region): agent} handed out by agent_for_region; region None is the directory
+        self.agents = {}
+        create_cold_storage(self.cursor)
+        self.create_tables()
+        self.conn.commit()
+
+    @staticmethod
+    def default_shard_dir(db_path):
+        """Return the directory shard files live in by default: <db dir>/shards."""
+        return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'shards')
+
+    def create_tables(self):
+        """Create the directory tables if they do not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS region_shards (
+                region TEXT PRIMARY KEY,
+                shard_no INTEGER UNIQUE NOT NULL,
+                filename TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS region_locations (
+                location TEXT PRIMARY KEY,
+                region TEXT NOT NULL
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_regions (
+                user_id INTEGER PRIMARY KEY,
+                region TEXT NOT NULL
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS donation_regions (
+                donation_id INTEGER PRIMARY KEY,
+                region TEXT NOT NULL
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS request_regions (
+                request_id INTEGER PRIMARY KEY,
+                region TEXT NOT NULL
+            )
+            """
+        )
+
+    def list_regions(self):
+        """Return catalog rows in the order the regions were added."""
+        self.cursor.execute("SELECT * FROM region_shards ORDER BY shard_no")
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def shard_path(self, region):
+        """Return the shard file of a region, or None if the region is unknown."""
+        self.cursor.execute("SELECT filename FROM region_shards WHERE region = ?", (region,))
+        row = self.cursor.fetchone()
+        return os.path.join(self.shard_dir, row['filename']) if row else None
+
+    def shard_paths(self):
+        """Return {region: shard file} for every region."""
+        return {row['region']: os.path.join(self.shard_dir, row['filename']) for row in self.list_regions()}
+
+    def add_region(self, region, locations=()):
+        """Create a region's shard file if it does not exist, and map locations to the region.
+
+        Must be called outside a transaction. Returns the catalog row.
+        """
+        self.cursor.execute("SELECT * FROM region_shards WHERE region = ?", (region,))
+        row = self.cursor.fetchone()
+        if row is None:
+            self.cursor.execute("SELECT COALESCE(MAX(shard_no), 0) + 1 as shard_no FROM region_shards")
+            shard_no = self.cursor.fetchone()['shard_no']
+            if shard_no > MAX_SHARDS:
+                raise ValueError(f"At most {MAX_SHARDS} regions are supported")
+            slug = re.sub(r'[^a-z0-9]+', '-', region.lower()).strip('-') or 'region'
+            filename = f"{self.db_name}-{shard_no}-{slug}.sqlite"
+            self._create_shard(filename, shard_no)
+            self.cursor.execute(
+                "INSERT INTO region_shards (region, shard_no, filename) VALUES (?, ?, ?)",
+                (region, shard_no, filename)
+            )
+            self.cursor.execute("SELECT * FROM region_shards WHERE region = ?", (region,))
+            row = self.cursor.fetchone()
+        self.map_locations(region, locations)
+        self.conn.commit()
+        return dict(row)
+
+    def _create_shard(self, filename, shard_no):
+        """Create a shard file with the directory's base tables and its own id block."""
+        os.makedirs(self.shard_dir, exist_ok=True)
+        placeholders = ','.join('?' * len(SHARD_TABLES))
+        self.cursor.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN ({placeholders})",
+            SHARD_TABLES
+        )
+        definitions = {row['name']: row['sql'] for row in self.cursor.fetchall()}
+
+        shard = sqlite3.connect(os.path.join(self.shard_dir, filename))
+        try:
+            for table in SHARD_TABLES:
+                if table in definitions:
+                    shard.execute(definitions[table].replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+            create_cold_storage(shard.cursor())
+            for table in ID_TABLES:
+                if table in definitions:
+                    shard.execute(
+                        "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, shard_no * ID_BLOCK)
+                    )
+                    # An id past the block would be routed to the next shard
+                    shard.execute(
+                        f"""
+                        CREATE TRIGGER IF NOT EXISTS {table}_id_block AFTER INSERT ON {table}
+                        WHEN NEW.id >= {(shard_no + 1) * ID_BLOCK}
+                        BEGIN
+                            SELECT RAISE(ABORT, 'id outside this shard''s id block');
+                        END
+                        """
+                    )
+            shard.commit()
+        finally:
+            shard.close()
+
+    def map_locations(self, region, locations):
+        """Record that donations at these locations belong to region. The caller is responsible for committing."""
+        self.cursor.executemany(
+            "INSERT OR REPLACE INTO region_locations (location, region) VALUES (?, ?)",
+            [(location, region) for location in locations]
+        )
+
+    def region_of_location(self, location):
+        """Return the region a donation location belongs to, or None."""
+        self.cursor.execute("SELECT region FROM region_locations WHERE location = ?", (location,))
+        row = self.cursor.fetchone()
+        return row['region'] if row else None
+
+    def assign_user(self, user_id, region):
+        """Serve a registered user from a region's shard, copying their users row there.
+
+        Must be called outside a transaction.
+        """
+        self.copy_user(user_id, region)
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO user_regions (user_id, region) VALUES (?, ?)", (user_id, region)
+        )
+        self.conn.commit()
+
+    def copy_user(self, user_id, region):
+        """Copy a user's users row into a region's shard. Must be called outside a transaction."""
+        filename = self._filename(region)
+        with self._attached(filename) as schema:
+            self.cursor.execute(f"INSERT OR REPLACE INTO {schema}.users SELECT * FROM main.users WHERE id = ?", (user_id,))
+            self.conn.commit()
+
+    def region_of_user(self, user_id):
+        """Return the region a user is served from, or None if they are not assigned."""
+        self.cursor.execute("SELECT region FROM user_regions WHERE user_id = ?", (user_id,))
+        row = self.cursor.fetchone()
+        return row['region'] if row else None
+
+    def region_of_donation(self, donation_id):
+        """Return the region whose shard holds a donation, or None if it is unknown."""
+        return self._region_of_id(donation_id, 'donation_regions', 'donation_id')
+
+    def region_of_request(self, request_id):
+        """Return the region whose shard holds a request, or None if it is unknown."""
+        return self._region_of_id(request_id, 'request_regions', 'request_id')
+
+    def _region_of_id(self, row_id, lookup_table, id_column):
+        if row_id >= ID_BLOCK:
+            self.cursor.execute("SELECT region FROM region_shards WHERE shard_no = ?", (row_id // ID_BLOCK,))
+        else:
+            self.cursor.execute(f"SELECT region FROM {lookup_table} WHERE {id_column} = ?", (row_id,))
+        row = self.cursor.fetchone()
+        return row['region'] if row else None
+
+    def shard_for_user(self, user_id):
+        """Return the shard file a user is served from, or None."""
+        region = self.region_of_user(user_id)
+        return self.shard_path(region) if region else None
+
+    def shard_for_donation(self, donation_id):
+        """Return the shard file holding a donation, or None."""
+        region = self.region_of_donation(donation_id)
+        return self.shard_path(region) if region else None
+
+    def agent_for_region(self, agent_class, region, **kwargs):
+        """Return an agent of agent_class on a region's shard, created on first use and then reused."""
+        key = (agent_class, region)
+        if key not in self.agents:
+            path = self.shard_path(region)
+            if path is None:
+                raise ValueError(f"Unknown region: {region}")
+            self.agents[key] = agent_class(path, **kwargs)
+        return self.agents[key]
+
+    def agent_for_directory(self, agent_class, **kwargs):
+        """Return an agent of agent_class on the directory database, created on first use and then reused."""
+        key = (agent_class, None)
+        if key not in self.agents:
+            self.agents[key] = agent_class(self.db_path, **kwargs)
+        return self.agents[key]
+
+    def agent_for_user(self, agent_class, user_id, **kwargs):
+        """Return an agent of agent_class on the shard a user is served from.
+
+        The agent only sees that region: a recipient's requests for donations
+        in other regions are read with recipient_history and made with
+        create_request.
+        """
+        region = self.region_of_user(user_id)
+        if region is None:
+            raise ValueError(f"User {user_id} is not assigned to a region")
+        return self.agent_for_region(agent_class, region, **kwargs)
+
+    def member_agents(self, agent_class, **kwargs):
+        """Return agents of agent_class on the directory and on every region shard."""
+        return [self.agent_for_directory(agent_class, **kwargs)] + [
+            self.agent_for_region(agent_class, region, **kwargs) for region in self.shard_paths()
+        ]
+
+    def create_request(self, agent_class, recipient_id, donation_id, **kwargs):
+        """Request a donation on the shard holding it, with an agent_class (RecipientAgent) agent.
+
+        The recipient's users row is copied there first. Must be called
+        outside a transaction. Returns the agent's create_request result.
+        """
+        region = self.region_of_donation(donation_id)
+        if region is None:
+            return {
+                "status": "error",
+                "message": "Donation not found."
+            }
+        self.copy_user(recipient_id, region)
+        return self.agent_for_region(agent_class, region, **kwargs).create_request(recipient_id, donation_id)
+
+    def update_request_status(self, agent_class, request_id, status, **kwargs):
+        """Change a request's status on the shard holding it. Returns the agent's update_request_status result."""
+        region = self.region_of_request(request_id)
+        if region is None:
+            return {
+                "status": "error",
+                "message": "Request not found."
+            }
+        return self.agent_for_region(agent_class, region, **kwargs).update_request_status(request_id, status)
+
+    def recipient_history(self, agent_class, recipient_id, **kwargs):
+        """Return a recipient's requests from every shard and the directory, newest first.
+
+        Rows are shaped like RecipientAgent.get_recipient_history. A request
+        and its donation can sit in different members (rows flushed to the
+        directory's archive partitions before the split stayed there), so
+        requests are joined with their donations across the members here.
+        """
+        try:
+            agents = self.member_agents(agent_class, **kwargs)
+            requests = self._recipient_requests(agents, recipient_id)
+            return self._with_donations(agents, requests)
+        except sqlite3.Error as e:
+            print(f"Error retrieving recipient history: {e}")
+            return []
+
+    def recipient_history_page(self, agent_class, recipient_id, limit=DEFAULT_PAGE_SIZE, page_token=None, **kwargs):
+        """Return one page of recipient_history, like RecipientAgent.get_recipient_history_page."""
+        listing = f"recipient_history:{recipient_id}"
+        limit = page_size(limit)
+        try:
+            after = decode_page_token(page_token, listing)
+            agents = self.member_agents(agent_class, **kwargs)
+            # Each member's first limit + 1 rows after the key hold the merged first limit + 1
+            scanned = self._recipient_requests(agents, recipient_id, limit + 1, after)[:limit + 1]
+            next_key = _history_key(scanned[limit - 1]) if len(scanned) > limit else None
+            return {
+                "requests": self._with_donations(agents, scanned[:limit]),
+                "next_page_token": encode_page_token(listing, next_key) if next_key else None
+            }
+        except ValueError as e:
+            return {
+                "status": "error",
+                "message": f"Invalid page token: {e}"
+            }
+        except sqlite3.Error as e:
+            print(f"Error retrieving recipient history: {e}")
+            return {
+                "status": "error",
+                "message": f"Failed to retrieve recipient history: {str(e)}"
+            }
+
+    def _recipient_requests(self, agents, recipient_id, limit=None, after=None):
+        """Return a recipient's requests in every member older than after, newest first.
+
+        With limit, each member contributes at most its limit newest rows.
+        """
+        seek = "AND (created_at, id) < (?, ?)" if after else ""
+        bound = "LIMIT ?" if limit else ""
+        params = (recipient_id, *(after or ()), *((limit,) if limit else ()))
+        requests = []
+        for agent in agents:
+            agent.cursor.execute(
+                f"""
+                SELECT * FROM requests_all
+                WHERE recipient_id = ? {seek}
+                ORDER BY created_at DESC, id DESC
+                {bound}
+                """,
+                params
+            )
+            requests.extend(dict(row) for row in agent.cursor.fetchall())
+        requests.sort(key=_history_key, reverse=True)
+        return requests
+
+    def _with_donations(self, agents, requests):
+        """Add food_name, quantity, expiry_date and donor_name to requests, looked up in every member.
+
+        Requests whose donation or donor is gone are skipped, as in recipient_history.
+        """
+        donation_ids = list({row['donation_id'] for row in requests})
+        donations = {}
+        for agent in agents:
+            agent.cursor.execute(
+                f"""
+                SELECT d.id, d.food_name, d.quantity, d.expiry_date, u.name as donor_name
+                FROM donations_all d
+                JOIN users u ON d.donor_id = u.id
+                WHERE d.id IN ({','.join('?' * len(donation_ids))})
+                """,
+                donation_ids
+            )
+            donations.update((row['id'], row) for row in agent.cursor.fetchall())
+        return [
+            dict(
+                row,
+                food_name=donations[row['donation_id']]['food_name'],
+                quantity=donations[row['donation_id']]['quantity'],
+                expiry_date=donations[row['donation_id']]['expiry_date'],
+                donor_name=donations[row['donation_id']]['donor_name']
+            )
+            for row in requests if row['donation_id'] in donations
+        ]
+
+    def close_agents(self):
+        """Close every agent handed out by agent_for_region."""
+        for agent in self.agents.values():
+            agent.close_connection()
+        self.agents = {}
+
+    def split(self, default_region):
+        """Move the directory's donations, requests and messages into the region shards.
+
+        Users without a region are assigned one first. A donor gets the
+        region most of their donations' locations map to, a recipient the
+        region most of the donations they requested went to, and anyone
+        else gets default_region. Each region moves in one transaction
+        across the directory and its shard. Archive partitions flushed
+        before the split stay with the directory (agents/scatterGather.py
+        gathers it with the shards). The directory's maintained stores are
+        reset and rebuild from the remaining rows on next use. Must be
+        called outside a transaction. Returns {region: {table: rows moved}}.
+
+        Raises ValueError if an id to move is not below ID_BLOCK.
+        """
+        for table in ID_TABLES:
+            for source in (table, f"{table}_archive"):
+                if self._has_table(source):
+                    self.cursor.execute(f"SELECT MAX(id) as max_id FROM main.{source}")
+                    max_id = self.cursor.fetchone()['max_id']
+                    if max_id is not None and max_id >= ID_BLOCK:
+                        raise ValueError(f"{source} id {max_id} does not fit below the shard id blocks ({ID_BLOCK})")
+        self.add_region(default_region)
+        self._assign_remaining_users(default_region)
+
+        moved = {}
+        for region, filename in [(row['region'], row['filename']) for row in self.list_regions()]:
+            with self._attached(filename) as schema:
+                counts = {}
+                self.cursor.execute(
+                    f"""
+                    INSERT OR REPLACE INTO {schema}.users SELECT * FROM main.users
+                    WHERE id IN (SELECT user_id FROM user_regions WHERE region = ?)
+                    """,
+                    (region,)
+                )
+                counts['users'] = self.cursor.rowcount
+                for table, fields, ids in (
+                    ('donations', DONATION_FIELDS, 'temp.split_donations'),
+                    ('requests', REQUEST_FIELDS, 'temp.split_requests')
+                ):
+                    self.cursor.execute(
+                        f"INSERT INTO {schema}.{table} SELECT * FROM main.{table} "
+                        f"WHERE id IN (SELECT id FROM {ids} WHERE region = ?)",
+                        (region,)
+                    )
+                    counts[table] = self.cursor.rowcount
+                    self.cursor.execute(
+                        f"""
+                        INSERT INTO {schema}.{table}_archive ({fields}, archived_at)
+                        SELECT {fields}, archived_at FROM main.{table}_archive
+                        WHERE id IN (SELECT id FROM {ids} WHERE region = ?)
+                        """,
+                        (region,)
+                    )
+                    counts[table] += self.cursor.rowcount
+                    for source in (table, f"{table}_archive"):
+                        self.cursor.execute(
+                            f"DELETE FROM main.{source} WHERE id IN (SELECT id FROM {ids} WHERE region = ?)",
+                            (region,)
+                        )
+                if self._has_table('messages'):
+                    sender_in_region = "sender_id IN (SELECT user_id FROM user_regions WHERE region = ?)"
+                    self.cursor.execute(
+                        f"INSERT INTO {schema}.messages SELECT * FROM main.messages WHERE {sender_in_region}",
+                        (region,)
+                    )
+                    counts['messages'] = self.cursor.rowcount
+                    self.cursor.execute(f"DELETE FROM main.messages WHERE {sender_in_region}", (region,))
+                self.conn.commit()
+            moved[region] = counts
+
+        # Counts and indexes maintained from the change log no longer match the remaining rows
+        if self._has_table('change_log_consumers'):
+            self.cursor.execute("DELETE FROM change_log_consumers")
+        self.cursor.execute("DROP TABLE IF EXISTS temp.split_donations")
+        self.cursor.execute("DROP TABLE IF EXISTS temp.split_requests")
+        self.conn.commit()
+        return moved
+
+    def _assign_remaining_users(self, default_region):
+        """Assign every unassigned user a region and record the region of every donation and request to move."""
+        # Donors: the region most of their donations' locations belong to
+        self.cursor.execute(
+            """
+            INSERT OR IGNORE INTO user_regions (user_id, region)
+            SELECT donor_id, region FROM (
+                SELECT d.donor_id, l.region,
+                       ROW_NUMBER() OVER (PARTITION BY d.donor_id ORDER BY COUNT(*) DESC, l.region) as rank
+                FROM (
+                    SELECT donor_id, location FROM main.donations
+                    UNION ALL
+                    SELECT donor_id, location FROM main.donations_archive
+                ) d
+                JOIN region_locations l ON l.location = d.location
+                GROUP BY d.donor_id, l.region
+            )
+            WHERE rank = 1
+            """
+        )
+        self.cursor.execute("DROP TABLE IF EXISTS temp.split_donations")
+        self.cursor.execute(
+            """
+            CREATE TEMP TABLE split_donations AS
+            SELECT d.id, COALESCE(u.region, ?) as region
+            FROM (SELECT id, donor_id FROM main.donations UNION ALL SELECT id, donor_id FROM main.donations_archive) d
+            LEFT JOIN user_regions u ON u.user_id = d.donor_id
+            """,
+            (default_region,)
+        )
+        self.cursor.execute("CREATE INDEX temp.idx_split_donations ON split_donations (id)")
+
+        # Recipients: the region most of the donations they requested are in
+        self.cursor.execute(
+            """
+            INSERT OR IGNORE INTO user_regions (user_id, region)
+            SELECT recipient_id, region FROM (
+                SELECT r.recipient_id, d.region,
+                       ROW_NUMBER() OVER (PARTITION BY r.recipient_id ORDER BY COUNT(*) DESC, d.region) as rank
+                FROM (
+                    SELECT recipient_id, donation_id FROM main.requests
+                    UNION ALL
+                    SELECT recipient_id, donation_id FROM main.requests_archive
+                ) r
+                JOIN temp.split_donations d ON d.id = r.donation_id
+                GROUP BY r.recipient_id, d.region
+            )
+            WHERE rank = 1
+            """
+        )
+        self.cursor.execute(
+            "INSERT OR IGNORE INTO user_regions (user_id, region) SELECT id, ? FROM main.users",
+            (default_region,)
+        )
+
+        # A request moves with its donation, or with its recipient if the donation is gone
+        self.cursor.execute("DROP TABLE IF EXISTS temp.split_requests")
+        self.cursor.execute(
+            """
+            CREATE TEMP TABLE split_requests AS
+            SELECT r.id, COALESCE(d.region, u.region, ?) as region
+            FROM (
+                SELECT id, recipient_id, donation_id FROM main.requests
+                UNION ALL
+                SELECT id, recipient_id, donation_id FROM main.requests_archive
+            ) r
+            LEFT JOIN temp.split_donations d ON d.id = r.donation_id
+            LEFT JOIN user_regions u ON u.user_id = r.recipient_id
+            """,
+            (default_region,)
+        )
+        self.cursor.execute("CREATE INDEX temp.idx_split_requests ON split_requests (id)")
+
+        # Ids placed here predate the shards' id blocks, so they are routed by lookup
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO donation_regions (donation_id, region) SELECT id, region FROM temp.split_donations"
+        )
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO request_regions (request_id, region) SELECT id, region FROM temp.split_requests"
+        )
+        self.conn.commit()
+
+    def _has_table(self, name):
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+        return self.cursor.fetchone() is not None
+
+    def _filename(self, region):
+        self.cursor.execute("SELECT filename FROM region_shards WHERE region = ?", (region,))
+        row = self.cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Unknown region: {region}")
+        return row['filename']
+
+    @contextmanager
+    def _attached(self, filename, schema='shard_target'):
+        """Attach a shard file for the duration of a with block."""
+        self.cursor.execute(f"ATTACH DATABASE ? AS {schema}", (os.path.join(self.shard_dir, filename),))
+        try:
+            yield schema
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.cursor.execute(f"DETACH DATABASE {schema}")
+
+
+def _history_key(row):
+    """Return the (created_at, id) key recipient history is ordered by."""
+    return (row['created_at'] or '', row['id'])
+
+
+# Shard maintenance entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage per-region database shards.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="Directory SQLite database")
+    parser.add_argument('--shard-dir', help="Directory for shard files (default: shards/ next to the database)")
+    parser.add_argument('--add-region', nargs='+', action='append', default=[], metavar=('REGION', 'LOCATION'),
+                        help="Create a region's shard and map donation locations to it")
+    parser.add_argument('--assign', nargs=2, action='append', default=[], metavar=('USER_ID', 'REGION'),
+                        help="Serve a user from a region")
+    parser.add_argument('--split', metavar='DEFAULT_REGION',
+                        help="Move donations, requests and messages into the shards")
+    parser.add_argument('--list', action='store_true', help="List regions")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        router = ShardRouter(conn, args.db, args.shard_dir)
+        for region, *locations in args.add_region:
+            row = router.add_region(region, locations)
+            print(f"Region {region}: {row['filename']}")
+        for user_id, region in args.assign:
+            router.assign_user(int(user_id), region)
+            print(f"User {user_id} assigned to {region}")
+        if args.split:
+            for region, counts in router.split(args.split).items():
+                print(f"Moved into {region}: " + ", ".join(f"{n} {table}" for table, n in counts.items()))
+        if args.list or not (args.add_region or args.assign or args.split):
+            for row in router.list_regions():
+                print(f"{row['region']}: shard {row['shard_no']} ({row['filename']})")
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Shard error: {e}")
+    finally:
+        conn.close()
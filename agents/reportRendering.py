@@ -0,0 +1,53 @@
+"""
+Report rendering helpers: ETags and streaming JSON for section-addressable reports.
+
+An ETag is a short hash of whatever identifies a section's inputs (its name,
+the data watermarks it depends on, the report window), so it changes exactly
+when the section could render differently. `iter_report_json` writes a report
+as JSON text chunks, computing and encoding one section at a time, so a large
+section is never held as one serialized string and sections the client
+already has are sent as a small "not modified" stub.
+"""
+
+import hashlib
+import json
+
+# Bump when a section's output format changes so clients drop cached copies
+REPORT_FORMAT_VERSION = 1
+
+
+def compute_etag(*parts):
+    """Return a stable ETag for JSON-serializable parts."""
+    payload = json.dumps([REPORT_FORMAT_VERSION, *parts], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:20]
+
+
+def iter_report_json(header, sections, if_none_match=None, indent=None):
+    """Yield a report as JSON text chunks.
+
+    header: dict of small top-level fields written first
+    sections: iterable of (name, etag, build) where build() returns the data
+    if_none_match: {section name: etag} the client already holds; those
+        sections are written as {"etag": ..., "not_modified": true}
+    """
+    if_none_match = if_none_match or {}
+    encoder = json.JSONEncoder(indent=indent, default=str)
+
+    yield '{'
+    for key, value in header.items():
+        yield f"{json.dumps(key)}: "
+        yield from encoder.iterencode(value)
+        yield ', '
+
+    yield '"sections": {'
+    for i, (name, etag, build) in enumerate(sections):
+        if i:
+            yield ', '
+        yield f"{json.dumps(name)}: {{\"etag\": {json.dumps(etag)}, "
+        if if_none_match.get(name) == etag:
+            yield '"not_modified": true}'
+            continue
+        yield '"data": '
+        yield from encoder.iterencode(build())
+        yield '}'
+    yield '}}'
@@ -0,0 +1,46 @@
+"""
+RequestMemo: Request-scoped memoization for agent workflows.
+
+A workflow such as `RecommendationAgent.generate_donor_recommendations`
+opens a scope with `with memo.scope():`; inside it, `memo.get(key, compute)`
+runs each distinct sub-query or derived value once and shares the result with
+every other step of the same request. Scopes nest, and the values are dropped
+when the outermost scope closes, so nothing is cached across requests and no
+result can go stale. Outside a scope `get` simply computes.
+"""
+
+from contextlib import contextmanager
+
+
+class RequestMemo:
+    def __init__(self):
+        """Initialize an idle memo; values are only kept inside a scope."""
+        self._values = None
+        self._depth = 0
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def scope(self):
+        """Share computed values until the outermost scope exits."""
+        if self._depth == 0:
+            self._values = {}
+        self._depth += 1
+        try:
+            yield self
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                self._values = None
+
+    def get(self, key, compute):
+        """Return the value memoized under key, computing it on first use in the scope."""
+        if self._values is None:
+            return compute()
+        if key in self._values:
+            self.hits += 1
+            return self._values[key]
+        self.misses += 1
+        value = compute()
+        self._values[key] = value
+        return value
@@ -0,0 +1,537 @@
+"""
+RobotTelemetry: In-memory ring buffers for robot telemetry, downsampled to SQLite.
+
+Robots report position, battery and status many times a second. Writing each
+update to SQLite would make the fleet dashboard's hottest path a write per
+sample. `RobotRingBuffer` instead keeps the latest `capacity` samples of
+every robot in preallocated NumPy arrays (one row per robot, one column per
+sample slot), and appends whole batches of updates with vectorized
+indexing. "Where is every robot now" and "trail for robot X" are answered
+from those arrays.
+
+Every flush interval, `TelemetryStore` downsamples the samples written since
+the last flush into fixed time buckets per robot (last position, last and
+minimum battery, last status, sample count) and upserts them into
+`robot_telemetry` with one executemany. History older than the ring is served
+from there. If a robot writes more than `capacity` samples between flushes,
+the overwritten samples are counted as dropped instead of being stored.
+
+`TelemetryService` puts the two behind a Unix socket. Robots (or a gateway)
+write newline-delimited JSON updates:
+
+    {"robot_id": "R001", "ts": 1760000000.5, "lat": 51.5, "lon": -0.12, "battery": 84.5, "status": "active"}
+
+and dashboards send queries on the same socket, answered with one JSON line:
+
+    {"query": "positions"}
+    {"query": "trail", "robot_id": "R001", "seconds": 300}
+
+Serve, or measure ingest throughput on synthetic updates, with:
+    python agents/robotTelemetry.py --db database/foodcycle.sqlite --socket /tmp/foodcycle-telemetry.sock
+    python agents/robotTelemetry.py --db /tmp/telemetry.sqlite --benchmark 1000000
+"""
+
+import argparse
+import json
+import os
+import selectors
+import socket
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Samples kept in memory per robot
+DEFAULT_CAPACITY = 1024
+# Robot slots allocated up front; the arrays double when the fleet outgrows them
+DEFAULT_ROBOTS = 64
+# Width of a downsampled bucket, and how often buckets are written
+DOWNSAMPLE_SECONDS = 10
+FLUSH_INTERVAL_SECONDS = 5.0
+DEFAULT_SOCKET_PATH = '/tmp/foodcycle-telemetry.sock'
+
+SAMPLE_COLUMNS = {
+    'ts': np.float64,       # seconds since the Unix epoch
+    'lat': np.float64,
+    'lon': np.float64,
+    'battery': np.float32,  # percent
+    'status': np.int16      # code into RobotRingBuffer.statuses
+}
+
+
+class RobotRingBuffer:
+    """The latest `capacity` samples of every robot, in preallocated arrays."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, robots=DEFAULT_ROBOTS):
+        self.capacity = capacity
+        self.robot_ids = []
+        self.slots = {}
+        self.statuses = []
+        self.status_codes = {}
+        # Samples ever written and ever flushed per robot; a sample's ring position is its sequence % capacity
+        self.written = np.zeros(robots, dtype=np.int64)
+        self.flushed = np.zeros(robots, dtype=np.int64)
+        self.columns = {name: np.zeros((robots, capacity), dtype=dtype) for name, dtype in SAMPLE_COLUMNS.items()}
+
+    def slot_of(self, robot_id):
+        """Return the array row of a robot, allocating one on first sight."""
+        slot = self.slots.get(robot_id)
+        if slot is None:
+            slot = self.slots[robot_id] = len(self.robot_ids)
+            self.robot_ids.append(robot_id)
+            if slot >= self.written.size:
+                self._grow(2 * self.written.size)
+        return slot
+
+    def _grow(self, robots):
+        extra = robots - self.written.size
+        self.written = np.concatenate([self.written, np.zeros(extra, dtype=np.int64)])
+        self.flushed = np.concatenate([self.flushed, np.zeros(extra, dtype=np.int64)])
+        for name, column in self.columns.items():
+            self.columns[name] = np.concatenate([column, np.zeros((extra, self.capacity), dtype=column.dtype)])
+
+    def status_code(self, status):
+        code = self.status_codes.get(status)
+        if code is None:
+            code = self.status_codes[status] = len(self.statuses)
+            self.statuses.append(status)
+        return code
+
+    def append(self, robot_ids, ts, lat, lon, battery, statuses):
+        """Append a batch of samples, given as parallel sequences in arrival order."""
+        n = len(robot_ids)
+        if n == 0:
+            return
+        slot_of = self.slot_of
+        status_code = self.status_code
+        slots = np.fromiter((slot_of(robot_id) for robot_id in robot_ids), dtype=np.int64, count=n)
+        values = {
+            'ts': np.asarray(ts, dtype=np.float64),
+            'lat': np.asarray(lat, dtype=np.float64),
+            'lon': np.asarray(lon, dtype=np.float64),
+            'battery': np.asarray(battery, dtype=np.float32),
+            'status': np.fromiter((status_code(s) for s in statuses), dtype=np.int16, count=n)
+        }
+
+        # Rank of each sample among its robot's samples in this batch, in arrival order
+        order = np.argsort(slots, kind='stable')
+        sorted_slots = slots[order]
+        starts = np.flatnonzero(np.r_[True, sorted_slots[1:] != sorted_slots[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n) - np.repeat(starts, sizes)
+        batch_count = np.empty(n, dtype=np.int64)
+        batch_count[order] = np.repeat(sizes, sizes)
+
+        # Only a robot's last `capacity` samples of the batch survive; skipping the rest
+        # keeps the writes below free of duplicate positions
+        keep = rank >= batch_count - self.capacity
+        rows = slots[keep]
+        positions = (self.written[rows] + rank[keep]) % self.capacity
+        for name, column in self.columns.items():
+            column[rows, positions] = values[name][keep]
+        self.written[sorted_slots[starts]] += sizes
+
+    def latest(self):
+        """Return the newest sample of every robot that has reported."""
+        robots = len(self.robot_ids)
+        written = self.written[:robots]
+        rows = np.flatnonzero(written)
+        positions = (written[rows] - 1) % self.capacity
+        return self._samples(rows, positions, with_robot_id=True)
+
+    def trail(self, robot_id, since=None, limit=None):
+        """Return a robot's buffered samples, oldest first, optionally from `since` (epoch seconds)."""
+        slot = self.slots.get(robot_id)
+        if slot is None:
+            return []
+        written = int(self.written[slot])
+        held = min(written, self.capacity)
+        positions = np.arange(written - held, written) % self.capacity
+        if since is not None:
+            positions = positions[self.columns['ts'][slot, positions] >= since]
+        if limit is not None:
+            positions = positions[-limit:]
+        return self._samples(np.full(positions.size, slot), positions)
+
+    def oldest_ts(self, robot_id):
+        """Return the timestamp of a robot's oldest buffered sample, or None."""
+        slot = self.slots.get(robot_id)
+        if slot is None:
+            return None
+        written = int(self.written[slot])
+        return float(self.columns['ts'][slot, (written - min(written, self.capacity)) % self.capacity])
+
+    def _samples(self, rows, positions, with_robot_id=False):
+        columns = {name: column[rows, positions].tolist() for name, column in self.columns.items()}
+        samples = []
+        for i in range(len(columns['ts'])):
+            sample = {
+                "ts": columns['ts'][i],
+                "lat": columns['lat'][i],
+                "lon": columns['lon'][i],
+                "battery": round(columns['battery'][i], 1),
+                "status": self.statuses[columns['status'][i]]
+            }
+            if with_robot_id:
+                sample = {"robot_id": self.robot_ids[rows[i]], **sample}
+            samples.append(sample)
+        return samples
+
+    def take_unflushed(self):
+        """Return (rows, columns, dropped) for the samples written since the last call, and mark them flushed.
+
+        rows and every column are flat arrays in per-robot sequence order;
+        dropped counts samples overwritten before they could be flushed.
+        """
+        robots = len(self.robot_ids)
+        written = self.written[:robots].copy()
+        flushed = self.flushed[:robots]
+        start = np.maximum(flushed, written - self.capacity)
+        dropped = int((start - flushed).sum())
+        sizes = written - start
+
+        total = int(sizes.sum())
+        rows = np.repeat(np.arange(robots), sizes)
+        offsets = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        positions = (np.repeat(start, sizes) + offsets) % self.capacity
+        columns = {name: column[rows, positions] for name, column in self.columns.items()}
+        self.flushed[:robots] = written
+        return rows, columns, dropped
+
+
+class TelemetryStore:
+    def __init__(self, conn, bucket_seconds=DOWNSAMPLE_SECONDS):
+        """Initialize the downsampled telemetry table on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.bucket_seconds = bucket_seconds
+        self.create_table()
+
+    def create_table(self):
+        """Create the robot_telemetry table if it does not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS robot_telemetry (
+                robot_id TEXT NOT NULL,
+                bucket_start INTEGER NOT NULL,
+                last_ts REAL NOT NULL,
+                lat REAL,
+                lon REAL,
+                battery REAL,
+                battery_min REAL,
+                status TEXT,
+                samples INTEGER NOT NULL,
+                PRIMARY KEY (robot_id, bucket_start)
+            )
+            """
+        )
+
+    def write(self, buffer):
+        """Downsample the buffer's unflushed samples into buckets and upsert them.
+
+        Returns (buckets written, samples dropped). The caller is responsible
+        for committing.
+        """
+        rows, columns, dropped = buffer.take_unflushed()
+        if rows.size == 0:
+            return 0, dropped
+
+        buckets = (columns['ts'] // self.bucket_seconds).astype(np.int64) * self.bucket_seconds
+        order = np.lexsort((columns['ts'], buckets, rows))
+        rows, buckets = rows[order], buckets[order]
+        starts = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (buckets[1:] != buckets[:-1])])
+        ends = np.r_[starts[1:], rows.size] - 1
+
+        # The newest sample of each bucket gives its position, battery and status
+        last = {name: column[order][ends].tolist() for name, column in columns.items()}
+        battery_min = np.minimum.reduceat(columns['battery'][order], starts).tolist()
+        samples = np.diff(np.r_[starts, rows.size]).tolist()
+        bucket_rows = rows[starts].tolist()
+        bucket_starts = buckets[starts].tolist()
+
+        self.cursor.executemany(
+            """
+            INSERT INTO robot_telemetry (
+                robot_id, bucket_start, last_ts, lat, lon, battery, battery_min, status, samples
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (robot_id, bucket_start) DO UPDATE SET
+                lat = CASE WHEN excluded.last_ts >= last_ts THEN excluded.lat ELSE lat END,
+                lon = CASE WHEN excluded.last_ts >= last_ts THEN excluded.lon ELSE lon END,
+                battery = CASE WHEN excluded.last_ts >= last_ts THEN excluded.battery ELSE battery END,
+                status = CASE WHEN excluded.last_ts >= last_ts THEN excluded.status ELSE status END,
+                last_ts = MAX(last_ts, excluded.last_ts),
+                battery_min = MIN(battery_min, excluded.battery_min),
+                samples = samples + excluded.samples
+            """,
+            [
+                (
+                    buffer.robot_ids[bucket_rows[i]], bucket_starts[i], last['ts'][i], last['lat'][i],
+                    last['lon'][i], round(last['battery'][i], 1), round(battery_min[i], 1),
+                    buffer.statuses[last['status'][i]], samples[i]
+                )
+                for i in range(len(bucket_rows))
+            ]
+        )
+        return len(bucket_rows), dropped
+
+    def history(self, robot_id, since, until=None):
+        """Return a robot's downsampled buckets in [since, until), oldest first."""
+        self.cursor.execute(
+            """
+            SELECT * FROM robot_telemetry
+            WHERE robot_id = ? AND bucket_start >= ? AND bucket_start < ?
+            ORDER BY bucket_start
+            """,
+            (robot_id, int(since // self.bucket_seconds * self.bucket_seconds), until or float('inf'))
+        )
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def prune(self, days=30):
+        """Delete buckets older than `days`. Returns the number deleted."""
+        self.cursor.execute("DELETE FROM robot_telemetry WHERE bucket_start < ?", (time.time() - days * 86400,))
+        return self.cursor.rowcount
+
+
+def valid_update(update):
+    """Return True if an update dict has a robot id and numeric position, timestamp and battery."""
+    def number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    return (
+        isinstance(update.get('robot_id'), (str, int)) and not isinstance(update.get('robot_id'), bool)
+        and number(update.get('lat')) and number(update.get('lon'))
+        and number(update.get('ts', 0)) and number(update.get('battery', 0))
+        and isinstance(update.get('status', 'active'), str)
+    )
+
+
+class TelemetryService:
+    def __init__(self, conn, capacity=DEFAULT_CAPACITY, bucket_seconds=DOWNSAMPLE_SECONDS,
+                 flush_interval=FLUSH_INTERVAL_SECONDS):
+        """Initialize the ring buffers and the downsampled store on an open database connection."""
+        self.conn = conn
+        self.buffer = RobotRingBuffer(capacity)
+        self.store = TelemetryStore(conn, bucket_seconds)
+        self.conn.commit()
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.dropped = 0
+        # Lines and updates rejected as malformed
+        self.skipped = 0
+
+    def ingest(self, updates):
+        """Append a batch of update dicts; `ts` defaults to now and `status` to 'active'."""
+        now = time.time()
+        # Convert before appending, so a bad value fails the batch before it touches the buffer
+        self.buffer.append(
+            [u['robot_id'] for u in updates],
+            np.asarray([u.get('ts', now) for u in updates], dtype=np.float64),
+            np.asarray([u['lat'] for u in updates], dtype=np.float64),
+            np.asarray([u['lon'] for u in updates], dtype=np.float64),
+            np.asarray([u.get('battery', np.nan) for u in updates], dtype=np.float32),
+            [u.get('status', 'active') for u in updates]
+        )
+
+    def handle_lines(self, lines):
+        """Ingest the updates among a batch of JSON lines and return the answers to its queries.
+
+        Malformed lines and updates are skipped and counted in `skipped`; the
+        rest of the batch is still ingested.
+        """
+        messages = self.parse_lines(lines)
+        updates = [m for m in messages if 'query' not in m]
+        try:
+            self.ingest(updates)
+        except (KeyError, TypeError, ValueError):
+            # A bad update fails the vectorized append before any sample is written
+            valid = [u for u in updates if valid_update(u)]
+            self.skipped += len(updates) - len(valid)
+            self.ingest(valid)
+
+        answers = []
+        for query in messages:
+            if 'query' not in query:
+                continue
+            try:
+                answers.append(self.answer(query))
+            except (KeyError, TypeError, ValueError) as e:
+                answers.append({"error": f"bad query: {e}"})
+        return answers
+
+    def parse_lines(self, lines):
+        """Return the JSON objects among lines, skipping lines that are not one."""
+        try:
+            # One parse for the whole batch
+            messages = json.loads('[' + ','.join(lines) + ']')
+        except ValueError:
+            messages = []
+            for line in lines:
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    self.skipped += 1
+        objects = [m for m in messages if isinstance(m, dict)]
+        self.skipped += len(messages) - len(objects)
+        return objects
+
+    def answer(self, query):
+        """Answer a positions or trail query from memory, or from the store beyond the buffer."""
+        if query['query'] == 'positions':
+            return {"query": "positions", "robots": self.buffer.latest()}
+        if query['query'] == 'trail':
+            since = time.time() - query['seconds'] if 'seconds' in query else None
+            trail = self.buffer.trail(query['robot_id'], since, query.get('limit'))
+            response = {"query": "trail", "robot_id": query['robot_id'], "samples": trail}
+            # The window reaches back past the ring: add the downsampled buckets before it
+            oldest = self.buffer.oldest_ts(query['robot_id'])
+            if since is not None and (oldest is None or oldest > since):
+                response["history"] = self.store.history(query['robot_id'], since, oldest)
+            return response
+        return {"error": f"unknown query: {query['query']}"}
+
+    def maybe_flush(self, force=False):
+        """Write downsampled buckets if the flush interval has passed. Returns the buckets written."""
+        if not force and time.monotonic() - self.last_flush < self.flush_interval:
+            return 0
+        self.last_flush = time.monotonic()
+        try:
+            buckets, dropped = self.store.write(self.buffer)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            # The samples stay in the ring; a lost batch only thins the history
+            self.conn.rollback()
+            print(f"Telemetry flush error: {e}")
+            return 0
+        if dropped:
+            self.dropped += dropped
+            print(f"Telemetry flush dropped {dropped} samples overwritten before flushing")
+        return buckets
+
+    def handle_client(self, client, pending):
+        """Read from a client, handle its complete lines and send the answers.
+
+        pending maps each client to its unterminated partial line. Returns
+        False once the client has closed the connection.
+        """
+        data = client.recv(1 << 16)
+        if not data:
+            return False
+        *lines, pending[client] = (pending[client] + data).split(b'\n')
+        lines = [line.decode('utf-8', errors='replace') for line in lines if line.strip()]
+        if lines:
+            for answer in self.handle_lines(lines):
+                client.sendall(json.dumps(answer, separators=(',', ':')).encode('utf-8') + b'\n')
+        return True
+
+    def serve(self, socket_path=DEFAULT_SOCKET_PATH):
+        """Accept updates and queries on a Unix socket until interrupted."""
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen()
+        server.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        pending = {}
+        try:
+            while True:
+                for key, _ in selector.select(timeout=self.flush_interval):
+                    if key.fileobj is server:
+                        client, _ = server.accept()
+                        selector.register(client, selectors.EVENT_READ)
+                        pending[client] = b''
+                        continue
+                    client = key.fileobj
+                    try:
+                        connected = self.handle_client(client, pending)
+                    except OSError:
+                        # A client that went away mid-answer only loses its own connection
+                        connected = False
+                    if not connected:
+                        selector.unregister(client)
+                        client.close()
+                        del pending[client]
+                self.maybe_flush()
+        finally:
+            self.maybe_flush(force=True)
+            selector.close()
+            server.close()
+            os.remove(socket_path)
+
+
+def benchmark(service, updates, robots=200, batch=1000):
+    """Ingest synthetic updates from JSON lines in batches; return throughput figures."""
+    rng = np.random.default_rng(0)
+    now = time.time()
+    lines = [
+        json.dumps({
+            "robot_id": f"R{i % robots:04d}", "ts": now + i / 1000, "lat": 51.5 + rng.normal() * 0.01,
+            "lon": -0.12 + rng.normal() * 0.01, "battery": 100 - (i % 1000) / 10, "status": "active"
+        })
+        for i in range(min(updates, 100000))
+    ]
+    ingest_seconds = 0.0
+    flush_seconds = 0.0
+    sent = 0
+    while sent < updates:
+        chunk = lines[sent % len(lines):][:min(batch, updates - sent)]
+        start = time.perf_counter()
+        service.handle_lines(chunk)
+        ingest_seconds += time.perf_counter() - start
+        sent += len(chunk)
+        if sent % (batch * 50) == 0:
+            start = time.perf_counter()
+            service.maybe_flush(force=True)
+            flush_seconds += time.perf_counter() - start
+    start = time.perf_counter()
+    service.maybe_flush(force=True)
+    flush_seconds += time.perf_counter() - start
+
+    start = time.perf_counter()
+    positions = service.answer({"query": "positions"})
+    trail = service.answer({"query": "trail", "robot_id": "R0000", "limit": 100})
+    query_ms = (time.perf_counter() - start) * 1000
+    return {
+        "updates": updates,
+        "ingest_per_second": round(updates / ingest_seconds),
+        "flush_seconds": round(flush_seconds, 3),
+        "positions_and_trail_ms": round(query_ms, 2),
+        "robots": len(positions['robots']),
+        "trail_samples": len(trail['samples']),
+        "dropped": service.dropped
+    }
+
+
+# Telemetry service entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest robot telemetry into ring buffers and SQLite.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database for downsampled history")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help="Unix socket to serve on")
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help="Samples kept in memory per robot")
+    parser.add_argument('--bucket-seconds', type=int, default=DOWNSAMPLE_SECONDS)
+    parser.add_argument('--flush-interval', type=float, default=FLUSH_INTERVAL_SECONDS)
+    parser.add_argument('--benchmark', type=int, metavar='UPDATES', help="Ingest synthetic updates and report throughput")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        service = TelemetryService(conn, args.capacity, args.bucket_seconds, args.flush_interval)
+        if args.benchmark:
+            print(json.dumps(benchmark(service, args.benchmark), indent=2))
+        else:
+            print(f"Serving robot telemetry on {args.socket}")
+            service.serve(args.socket)
+    except KeyboardInterrupt:
+        pass
+    except sqlite3.Error as e:
+        print(f"Telemetry error: {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,169 @@
+"""
+Scatter-gather: Global InsightsAgent and RecommendationAgent results over region shards.
+
+With the regions split into shards by agents/regionShards.py, a global
+figure needs every shard. Each member database computes its partial results
+in its own worker process. The members are every region shard plus the
+directory database, which keeps the archive partitions flushed before the
+split. The partials are mergeable: numbers, {key: count} maps, sets of user
+ids and short lists of candidate rows. `merge_partials` folds them in any
+order (numbers and map values add, sets union, lists concatenate). The
+agents' *_from_partial methods then turn the merged partial into the same
+section a single database would report.
+
+Shards are scanned in parallel, so a global report takes about as long as
+its largest shard rather than the sum of all of them. Report sections that
+cannot be merged from per-shard counts (retention cohorts and time to first
+request, whose cohorts need every user's full activity) are reported per
+region.
+
+Print the global report and donor recommendation context with:
+    python agents/scatterGather.py --db database/foodcycle.sqlite
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.insightsAgent import MERGEABLE_SECTIONS, REPORT_SECTIONS, InsightsAgent
+from agents.recommendationAgent import RecommendationAgent
+from agents.regionShards import ShardRouter
+
+# Member name of the directory database in per-region results
+DIRECTORY_MEMBER = 'directory'
+
+
+def merge_partials(partials):
+    """Fold partial results from several databases into one."""
+    merged = None
+    for partial in partials:
+        merged = partial if merged is None else _merge(merged, partial)
+    return merged
+
+
+def _merge(a, b):
+    if isinstance(a, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = _merge(merged[key], value) if key in merged else value
+        return merged
+    if isinstance(a, set):
+        return a | b
+    if isinstance(a, list):
+        return a + b
+    if isinstance(a, str) or a is None:
+        # Labels such as the period type are the same in every partial
+        return a
+    return a + b
+
+
+def members(router):
+    """Return {member name: database path} for the directory and every region shard."""
+    return {DIRECTORY_MEMBER: router.db_path, **router.shard_paths()}
+
+
+def scatter(paths, task, *args, workers=None):
+    """Run task(path, *args) for every path in its own process; return the results in path order."""
+    paths = list(paths)
+    with ProcessPoolExecutor(max_workers=workers or min(len(paths), os.cpu_count() or 1)) as pool:
+        futures = [pool.submit(task, path, *args) for path in paths]
+        return [future.result() for future in futures]
+
+
+def insights_member(db_path, partial_sections, full_sections, since, until):
+    """Worker: one member's partials for the mergeable sections and its results for the others."""
+    # The agents report progress with print; keep the caller's stdout for results
+    with redirect_stdout(sys.stderr):
+        agent = InsightsAgent(db_path, since=since, until=until)
+        try:
+            partials = {name: getattr(agent, MERGEABLE_SECTIONS[name][0])() for name in partial_sections}
+            return partials, {name: agent.build_section(name) for name in full_sections}
+        finally:
+            agent.close_connection()
+
+
+def recommendation_member(db_path):
+    """Worker: one member's donor recommendation context partial."""
+    with redirect_stdout(sys.stderr):
+        agent = RecommendationAgent(db_path)
+        try:
+            return agent.community_partial()
+        finally:
+            agent.close_connection()
+
+
+def global_report(router, sections=None, since=None, until=None, workers=None):
+    """Build the comprehensive insights report over every shard.
+
+    Mergeable sections are reported as for one database; the others map
+    each member to its own section.
+    """
+    names = list(sections or REPORT_SECTIONS)
+    for name in names:
+        if name not in REPORT_SECTIONS:
+            raise ValueError(f"Unknown report section: {name}")
+    partial_sections = [name for name in names if name in MERGEABLE_SECTIONS]
+    full_sections = [name for name in names if name not in MERGEABLE_SECTIONS]
+
+    paths = members(router)
+    results = scatter(paths.values(), insights_member, partial_sections, full_sections, since, until, workers=workers)
+
+    # Only the *_from_partial methods are used, so this agent never opens a database
+    finisher = InsightsAgent(router.db_path, since=since, until=until)
+    report = {
+        "report_date": datetime.now().strftime('%Y-%m-%d'),
+        "metadata": {"source": "shards", "members": list(paths), "staleness_seconds": 0}
+    }
+    for name in names:
+        if name in MERGEABLE_SECTIONS:
+            merged = merge_partials(partials[name] for partials, _ in results)
+            report[name] = getattr(finisher, MERGEABLE_SECTIONS[name][1])(merged)
+        else:
+            report[name] = {member: full[name] for member, (_, full) in zip(paths, results)}
+    return report
+
+
+def global_recommendation_context(router, workers=None):
+    """Build the donor recommendation context over every shard, for RecommendationAgent.build_donor_recommendations."""
+    paths = members(router)
+    merged = merge_partials(scatter(paths.values(), recommendation_member, workers=workers))
+    finisher = RecommendationAgent(router.db_path)
+    return finisher.context_from_partial(
+        merged, {"source": "shards", "members": list(paths), "staleness_seconds": 0}
+    )
+
+
+# Global report entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute global insights and recommendations over region shards.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="Directory SQLite database")
+    parser.add_argument('--shard-dir', help="Directory for shard files (default: shards/ next to the database)")
+    parser.add_argument('--since', help="Only count rows created at or after this date")
+    parser.add_argument('--until', help="Only count rows created before this date")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per member, up to the CPU count)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        router = ShardRouter(conn, args.db, args.shard_dir)
+        output = {
+            "report": global_report(router, since=args.since, until=args.until, workers=args.workers),
+            "recommendations": RecommendationAgent(args.db).build_donor_recommendations(
+                global_recommendation_context(router, workers=args.workers)
+            )
+        }
+        print(json.dumps(output, indent=2))
+    except sqlite3.Error as e:
+        print(f"Scatter-gather error: {e}")
+    finally:
+        conn.close()
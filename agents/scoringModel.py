@@ -0,0 +1,234 @@
+"""
+ScoringModel: Learned scoring of available donations for a recipient.
+
+A small logistic model over time-decayed preference and expiry features,
+trained offline from accepted vs rejected requests and saved as a compact
+`.npz` file. `RecommendationAgent` scores all candidate donations in one
+vectorized pass when a model file is configured, and falls back to its
+hand-tuned constants otherwise.
+
+Train a model with:
+    python agents/scoringModel.py --db database/foodcycle.sqlite --out models/recommendation_scorer.npz
+"""
+
+import argparse
+import math
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import numpy as np
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.archivePartitions import ArchivePartitions
+from agents.donorProfiles import parse_timestamp
+from agents.foodCategories import categorize_extended
+from agents.recipientPreferences import PREFERENCE_HALF_LIFE_DAYS
+
+FEATURE_NAMES = [
+    'bias',
+    'preference_share',       # decayed share of the recipient's requests in this category
+    'preference_log_count',   # log1p of the decayed request count in this category
+    'expiry_under_3_days',
+    'expiry_3_to_10_days',
+    'expiry_over_10_days',
+    'expiry_unknown'
+]
+
+
+def build_features(category_scores, total_score, days_left):
+    """Build the feature matrix for a batch of candidates.
+
+    category_scores: decayed preference count of each candidate's category
+    total_score: decayed preference count over all categories
+    days_left: days until expiry per candidate, NaN when unknown
+    """
+    category_scores = np.asarray(category_scores, dtype=np.float64)
+    days_left = np.asarray(days_left, dtype=np.float64)
+    known = ~np.isnan(days_left)
+    # NaN compares False, so unknown expiries fall into none of the buckets
+    with np.errstate(invalid='ignore'):
+        features = np.column_stack([
+            np.ones_like(category_scores),
+            category_scores / total_score if total_score > 0 else np.zeros_like(category_scores),
+            np.log1p(category_scores),
+            known & (days_left < 3),
+            (days_left >= 3) & (days_left <= 10),
+            days_left > 10,
+            ~known
+        ])
+    return features.astype(np.float64)
+
+
+class ScoringModel:
+    def __init__(self, weights, half_life_days=PREFERENCE_HALF_LIFE_DAYS):
+        """Initialize the model with one weight per entry of FEATURE_NAMES."""
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.half_life_days = float(half_life_days)
+
+    @classmethod
+    def load(cls, path):
+        """Load a model saved with `save`."""
+        with np.load(path) as data:
+            if list(data['feature_names']) != FEATURE_NAMES:
+                raise ValueError(f"Model at {path} was trained on a different feature set")
+            if float(data['half_life_days']) != PREFERENCE_HALF_LIFE_DAYS:
+                raise ValueError(f"Model at {path} was trained with a different preference half-life")
+            return cls(data['weights'], data['half_life_days'])
+
+    def save(self, path):
+        """Save the model as a compressed `.npz` file."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                weights=self.weights,
+                half_life_days=self.half_life_days,
+                feature_names=np.array(FEATURE_NAMES)
+            )
+
+    def score(self, features):
+        """Return the predicted acceptance probability for each feature row."""
+        return 1 / (1 + np.exp(-(features @ self.weights)))
+
+    def score_donations(self, donations, preferences, categorize=categorize_extended, now=None):
+        """Score available donations for a recipient in one vectorized pass.
+
+        preferences: {category: decayed request count} for the recipient
+        """
+        now = now or datetime.now()
+        category_scores = [preferences.get(categorize(d['food_name']), 0.0) for d in donations]
+        days_left = [days_until(d.get('expiry_date'), now) for d in donations]
+        features = build_features(category_scores, sum(preferences.values()), days_left)
+        return self.score(features)
+
+
+def days_until(expiry_date, now):
+    """Whole days from now until expiry_date ('YYYY-MM-DD'), or NaN if unknown."""
+    if not expiry_date:
+        return math.nan
+    try:
+        return (datetime.strptime(expiry_date, '%Y-%m-%d') - now).days
+    except (ValueError, TypeError):
+        return math.nan
+
+
+def load_training_examples(conn):
+    """Build (features, labels) from accepted and rejected requests.
+
+    Each example uses the recipient's decayed preferences as they stood just
+    before the request was made, so the model only sees information that
+    would have been available at scoring time.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT r.recipient_id, r.status, r.created_at, d.food_name, d.expiry_date
+        FROM requests_all r
+        JOIN donations_all d ON r.donation_id = d.id
+        ORDER BY r.recipient_id, r.created_at, r.id
+        """
+    )
+
+    decay_rate = math.log(2) / PREFERENCE_HALF_LIFE_DAYS
+    rows = []
+    labels = []
+    current_recipient = None
+    preferences = {}
+    last_time = None
+
+    for row in cursor:
+        created = parse_timestamp(row['created_at'])
+        if row['recipient_id'] != current_recipient:
+            current_recipient = row['recipient_id']
+            preferences = {}
+            last_time = created
+
+        # Decay the running preference counts up to this request
+        factor = math.exp(-decay_rate * (created - last_time).total_seconds() / 86400)
+        for category in preferences:
+            preferences[category] *= factor
+        last_time = created
+
+        category = categorize_extended(row['food_name'])
+        if row['status'] in ('accepted', 'rejected'):
+            rows.append((
+                preferences.get(category, 0.0),
+                sum(preferences.values()),
+                days_until(row['expiry_date'], created)
+            ))
+            labels.append(1.0 if row['status'] == 'accepted' else 0.0)
+
+        if row['status'] != 'rejected':
+            preferences[category] = preferences.get(category, 0.0) + 1
+
+    if not rows:
+        return np.zeros((0, len(FEATURE_NAMES))), np.zeros(0)
+
+    category_scores, totals, days_left = (np.array(col, dtype=np.float64) for col in zip(*rows))
+    features = build_features(category_scores, 1.0, days_left)
+    # Preference share depends on each example's own total
+    features[:, 1] = np.divide(category_scores, totals, out=np.zeros_like(totals), where=totals > 0)
+    return features, np.array(labels)
+
+
+def train_scoring_model(conn, iterations=2000, learning_rate=0.5, l2=1e-3, min_examples=20):
+    """Fit a logistic scoring model on the requests table with batch gradient descent."""
+    features, labels = load_training_examples(conn)
+
+    if len(labels) < min_examples:
+        raise ValueError(f"Need at least {min_examples} accepted/rejected requests, found {len(labels)}")
+    if labels.min() == labels.max():
+        raise ValueError("Training data contains only one outcome; need both accepted and rejected requests")
+
+    weights = np.zeros(features.shape[1])
+    n = len(labels)
+    for _ in range(iterations):
+        predictions = 1 / (1 + np.exp(-(features @ weights)))
+        gradient = features.T @ (predictions - labels) / n
+        gradient[1:] += l2 * weights[1:]
+        weights -= learning_rate * gradient
+
+    predictions = 1 / (1 + np.exp(-(features @ weights)))
+    eps = 1e-12
+    log_loss = -np.mean(labels * np.log(predictions + eps) + (1 - labels) * np.log(1 - predictions + eps))
+    accuracy = np.mean((predictions >= 0.5) == (labels == 1))
+
+    return ScoringModel(weights), {
+        "examples": int(n),
+        "acceptance_rate": round(float(labels.mean()), 4),
+        "log_loss": round(float(log_loss), 4),
+        "accuracy": round(float(accuracy), 4)
+    }
+
+
+# Offline trainer
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the recommendation scoring model.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database to train from")
+    parser.add_argument('--out', default='models/recommendation_scorer.npz', help="Output model file")
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    ArchivePartitions(conn, args.db).open()
+    try:
+        model, metrics = train_scoring_model(conn, iterations=args.iterations)
+    except ValueError as e:
+        print(f"Training failed: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    model.save(args.out)
+    print(f"Saved model to {args.out}")
+    for name, weight in zip(FEATURE_NAMES, model.weights):
+        print(f"  {name}: {weight:.4f}")
+    print(f"Training metrics: {metrics}")
@@ -0,0 +1,107 @@
+"""
+Startup benchmark: import, construction and first-query cost of each agent.
+
+Each module is imported in a fresh interpreter under `python -X importtime`
+and the cumulative import time of the module itself is read from its report,
+so numbers are not flattered by modules another import already loaded. The
+agents are then constructed repeatedly in-process (which must not touch the
+database) and timed on their first query, which pays the lazy connection.
+
+Run with:
+    python agents/startupBenchmark.py --db database/foodcycle.sqlite --repeat 5
+"""
+
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module: (class name, first query)
+AGENTS = {
+    'agents.donorAgent': ('DonorAgent', lambda agent: agent.get_donor_donations(1)),
+    'agents.recipientAgent': ('RecipientAgent', lambda agent: agent.get_available_donations(20)),
+    'agents.recommendationAgent': ('RecommendationAgent', lambda agent: agent.analyze_donation_trends()),
+    'agents.insightsAgent': ('InsightsAgent', lambda agent: agent.calculate_overall_impact())
+}
+
+
+def import_time_us(module, repeat=5):
+    """Return the median cumulative import time of module in a fresh interpreter, in µs."""
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        )
+        # Lines look like "import time:   self [us] | cumulative | imported package"
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                samples.append(int(fields[1]))
+    return statistics.median(samples) if samples else None
+
+
+def construct_time_us(cls, db_path, repeat=1000):
+    """Return the mean time to construct cls, in µs; asserts no connection was opened."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        agent = cls(db_path)
+    elapsed = (time.perf_counter() - start) / repeat
+    assert not agent.is_loaded('conn'), f"{cls.__name__} connected during construction"
+    return elapsed * 1e6
+
+
+def first_query_ms(cls, query, db_path):
+    """Return (first query ms, second query ms) for a freshly constructed agent."""
+    agent = cls(db_path)
+    try:
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            query(agent)
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            query(agent)
+            second = time.perf_counter() - start
+    finally:
+        with redirect_stdout(io.StringIO()):
+            agent.close_connection()
+    return first * 1000, second * 1000
+
+
+def benchmark(db_path, repeat=5):
+    """Return {module: {import_ms, construct_us, first_query_ms, warm_query_ms}}."""
+    summary = {}
+    for module, (class_name, query) in AGENTS.items():
+        import_us = import_time_us(module, repeat)
+        cls = getattr(__import__(module, fromlist=[class_name]), class_name)
+        first, warm = first_query_ms(cls, query, db_path)
+        summary[module] = {
+            "import_ms": round(import_us / 1000, 2) if import_us is not None else None,
+            "construct_us": round(construct_time_us(cls, db_path), 2),
+            "first_query_ms": round(first, 2),
+            "warm_query_ms": round(warm, 2)
+        }
+    return summary
+
+
+# Benchmark entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure agent import, construction and first-query time.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database path")
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per import measurement")
+    args = parser.parse_args()
+
+    summary = benchmark(args.db, args.repeat)
+    print(f"{'module':30} {'import ms':>10} {'construct us':>13} {'first query ms':>15} {'warm query ms':>14}")
+    for module, s in summary.items():
+        print(f"{module:30} {s['import_ms']:10} {s['construct_us']:13} {s['first_query_ms']:15} {s['warm_query_ms']:14}")
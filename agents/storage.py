@@ -0,0 +1,525 @@
+"""
+Storage backends: the donation and request queries the agents need, behind one interface.
+
+`StorageBackend` lists the operations: available donations by expiry, a
+donor's donations, a recipient's request history (whole or one keyset page
+at a time, see agents/pagination.py), grouped counts, and the writes that
+create and move rows. `SQLiteStorage` runs them as SQL against
+the shared database. `InMemoryStorage` keeps the same rows in Python dicts
+with per-user indexes and an expiry-ordered list of available donations, for
+latency-critical matching and for tests that should not touch SQLite. An
+in-memory store loaded with `from_sqlite` follows the database's change log,
+so rows written by the Node backend or other agents show up on the next read,
+and rows deleted outright drop out of it.
+
+Both backends return the same dicts, and `agents/storageBenchmark.py` runs
+one workload against each.
+"""
+
+import bisect
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from agents.changeLog import ChangeLog
+from agents.coldStorage import DONATION_FIELDS, REQUEST_FIELDS
+from agents.donorProfiles import parse_timestamp
+
+DONATION_COLUMNS = [field.strip() for field in DONATION_FIELDS.split(',')]
+REQUEST_COLUMNS = [field.strip() for field in REQUEST_FIELDS.split(',')]
+
+# strftime formats of the supported count periods, as used by InsightsAgent
+PERIOD_FORMATS = {
+    'monthly': '%Y-%m',
+    'weekly': '%Y-%W',
+    'daily': '%Y-%m-%d'
+}
+
+VALID_STATUSES = {
+    'donations': ('available', 'reserved', 'completed', 'expired'),
+    'requests': ('pending', 'accepted', 'rejected')
+}
+
+# Sorts donations without an expiry date after every dated one
+NO_EXPIRY = '9999-12-31'
+
+
+class StorageBackend(ABC):
+    """Operations every storage backend implements."""
+
+    @abstractmethod
+    def available_donations(self, limit=20, with_donor=True):
+        """Return available donations, soonest expiry first, newest first on ties.
+
+        with_donor adds donor_name and leaves out donations whose donor has no
+        user row; otherwise the plain donation rows are returned.
+        """
+
+    @abstractmethod
+    def donor_donations(self, donor_id):
+        """Return every donation made by a donor, newest first."""
+
+    @abstractmethod
+    def recipient_history(self, recipient_id):
+        """Return a recipient's requests with food_name, quantity, expiry_date and donor_name, newest first."""
+
+    @abstractmethod
+    def donor_donations_page(self, donor_id, limit, after=None):
+        """Return (up to limit donations older than after, key to continue from or None).
+
+        Rows are ordered by (created_at, id) descending and after is the
+        (created_at, id) key of the last row of the previous page.
+        """
+
+    @abstractmethod
+    def recipient_history_page(self, recipient_id, limit, after=None):
+        """Return one page of recipient_history, like donor_donations_page."""
+
+    @abstractmethod
+    def count_donations(self, by='status'):
+        """Return {value: count} of donations grouped by status or location."""
+
+    @abstractmethod
+    def count_donations_by_period(self, period='monthly'):
+        """Return [(period label, count)] of donations per created_at period, oldest first."""
+
+    @abstractmethod
+    def add_donation(self, donation):
+        """Insert a donation dict and return its id."""
+
+    @abstractmethod
+    def add_request(self, request):
+        """Insert a request dict and return its id."""
+
+    @abstractmethod
+    def set_status(self, table, row_id, status):
+        """Change a donation's or request's status. Returns False if the row does not exist."""
+
+
+def _history_key(row):
+    """Return the (created_at, id) key history pages are ordered by."""
+    return (row['created_at'] or '', row['id'])
+
+
+def _continuation(scanned, limit):
+    """Return the key to continue after, given up to limit + 1 rows scanned in page order."""
+    if len(scanned) <= limit:
+        return None
+    return _history_key(scanned[limit - 1])
+
+
+def _check_status(table, status):
+    if status not in VALID_STATUSES.get(table, ()):
+        raise ValueError(f"Invalid {table} status: {status}")
+
+
+class SQLiteStorage(StorageBackend):
+    def __init__(self, conn):
+        """Initialize the backend on an open database connection with Row results."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+
+    def available_donations(self, limit=20, with_donor=True):
+        if with_donor:
+            source = "SELECT d.*, u.name as donor_name FROM donations d JOIN users u ON d.donor_id = u.id"
+        else:
+            source = "SELECT d.* FROM donations d"
+        self.cursor.execute(
+            f"""
+            {source}
+            WHERE d.status = 'available'
+            ORDER BY
+                CASE
+                    WHEN d.expiry_date IS NULL THEN '9999-12-31'
+                    ELSE d.expiry_date
+                END ASC,
+                d.created_at DESC
+            LIMIT ?
+            """,
+            (limit,)
+        )
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def donor_donations(self, donor_id):
+        self.cursor.execute(
+            "SELECT * FROM donations_all WHERE donor_id = ? ORDER BY created_at DESC",
+            (donor_id,)
+        )
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def recipient_history(self, recipient_id):
+        self.cursor.execute(
+            """
+            SELECT r.*, d.food_name, d.quantity, d.expiry_date, u.name as donor_name
+            FROM requests_all r
+            JOIN donations_all d ON r.donation_id = d.id
+            JOIN users u ON d.donor_id = u.id
+            WHERE r.recipient_id = ?
+            ORDER BY r.created_at DESC
+            """,
+            (recipient_id,)
+        )
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def donor_donations_page(self, donor_id, limit, after=None):
+        # Each branch of donations_all seeks on its (donor_id, created_at) index and
+        # the branches are merged in order, so the scan stops after limit + 1 rows
+        seek = "AND (created_at, id) < (?, ?)" if after else ""
+        self.cursor.execute(
+            f"""
+            SELECT * FROM donations_all
+            WHERE donor_id = ? {seek}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+            """,
+            (donor_id, *(after or ()), limit + 1)
+        )
+        rows = [dict(row) for row in self.cursor.fetchall()]
+        return rows[:limit], _continuation(rows, limit)
+
+    def recipient_history_page(self, recipient_id, limit, after=None):
+        seek = "AND (created_at, id) < (?, ?)" if after else ""
+        self.cursor.execute(
+            f"""
+            SELECT * FROM requests_all
+            WHERE recipient_id = ? {seek}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+            """,
+            (recipient_id, *(after or ()), limit + 1)
+        )
+        scanned = [dict(row) for row in self.cursor.fetchall()]
+
+        # Looked up by id in a second query: joining donations_all would materialize the whole view
+        donation_ids = list({row['donation_id'] for row in scanned[:limit]})
+        self.cursor.execute(
+            f"""
+            SELECT d.id, d.food_name, d.quantity, d.expiry_date, u.name as donor_name
+            FROM donations_all d
+            JOIN users u ON d.donor_id = u.id
+            WHERE d.id IN ({','.join('?' * len(donation_ids))})
+            """,
+            donation_ids
+        )
+        donations = {row['id']: row for row in self.cursor.fetchall()}
+
+        # Requests whose donation or donor is gone are skipped, as in recipient_history
+        rows = [
+            dict(
+                row,
+                food_name=donations[row['donation_id']]['food_name'],
+                quantity=donations[row['donation_id']]['quantity'],
+                expiry_date=donations[row['donation_id']]['expiry_date'],
+                donor_name=donations[row['donation_id']]['donor_name']
+            )
+            for row in scanned[:limit] if row['donation_id'] in donations
+        ]
+        return rows, _continuation(scanned, limit)
+
+    def count_donations(self, by='status'):
+        if by not in ('status', 'location'):
+            raise ValueError(f"Cannot count donations by {by}")
+        self.cursor.execute(f"SELECT {by} as value, COUNT(*) as count FROM donations_all GROUP BY {by}")
+        return {row['value']: row['count'] for row in self.cursor.fetchall()}
+
+    def count_donations_by_period(self, period='monthly'):
+        date_format = PERIOD_FORMATS.get(period, PERIOD_FORMATS['monthly'])
+        self.cursor.execute(
+            """
+            SELECT strftime(?, created_at) as period, COUNT(*) as count
+            FROM donations_all
+            GROUP BY period
+            ORDER BY period
+            """,
+            (date_format,)
+        )
+        return [(row['period'], row['count']) for row in self.cursor.fetchall()]
+
+    def add_donation(self, donation):
+        columns = [c for c in DONATION_COLUMNS if c != 'id' and donation.get(c) is not None]
+        self.cursor.execute(
+            f"INSERT INTO donations ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [donation[c] for c in columns]
+        )
+        return self.cursor.lastrowid
+
+    def add_request(self, request):
+        columns = [c for c in REQUEST_COLUMNS if c != 'id' and request.get(c) is not None]
+        self.cursor.execute(
+            f"INSERT INTO requests ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [request[c] for c in columns]
+        )
+        return self.cursor.lastrowid
+
+    def set_status(self, table, row_id, status):
+        _check_status(table, status)
+        self.cursor.execute(f"UPDATE {table} SET status = ? WHERE id = ?", (status, row_id))
+        return self.cursor.rowcount > 0
+
+
+class InMemoryStorage(StorageBackend):
+    def __init__(self):
+        """Initialize an empty store."""
+        self.users = {}
+        self.donations = {}
+        self.requests = {}
+        # Sorted (created_at, id) keys per donor / recipient
+        self.donations_by_donor = {}
+        self.requests_by_recipient = {}
+        # Sorted (expiry key, -created timestamp, id) of available donations
+        self.available = []
+        self.conn = None
+        self.offset = 0
+        self.next_ids = {'donations': 1, 'requests': 1}
+
+    @classmethod
+    def from_sqlite(cls, conn, follow=True):
+        """Load users, donations and requests from a database.
+
+        With follow=True the store catches up from the database's change log
+        before every read and rejects writes; otherwise it is a detached copy.
+        """
+        store = cls()
+        store.conn = conn if follow else None
+        cursor = conn.cursor()
+        changes = ChangeLog(conn)
+        # Reading inside one transaction keeps the rows and the log head consistent
+        in_transaction = conn.in_transaction
+        if not in_transaction:
+            cursor.execute("BEGIN")
+        try:
+            store.offset = changes.head()
+            cursor.execute("SELECT id, name FROM users")
+            store.users = {row['id']: row['name'] for row in cursor.fetchall()}
+            cursor.execute(f"SELECT {DONATION_FIELDS} FROM donations_all")
+            for row in cursor.fetchall():
+                store._put_donation(dict(row))
+            cursor.execute(f"SELECT {REQUEST_FIELDS} FROM requests_all")
+            for row in cursor.fetchall():
+                store._put_request(dict(row))
+        finally:
+            if not in_transaction:
+                conn.rollback()
+        return store
+
+    def catch_up(self):
+        """Apply rows changed in the followed database since the last read."""
+        if self.conn is None:
+            return 0
+        changes = ChangeLog(self.conn)
+        cursor = self.conn.cursor()
+        processed = 0
+        while True:
+            events = changes.read(self.offset, 1000)
+            if not events:
+                break
+            for table, view, columns, put in (
+                ('donations', 'donations_all', DONATION_FIELDS, self._put_donation),
+                ('requests', 'requests_all', REQUEST_FIELDS, self._put_request)
+            ):
+                row_ids = list({e['row_id'] for e in events if e['table_name'] == table})
+                if row_ids:
+                    cursor.execute(
+                        f"SELECT {columns} FROM {view} WHERE id IN ({','.join('?' * len(row_ids))})",
+                        row_ids
+                    )
+                    for row in cursor.fetchall():
+                        put(dict(row))
+            for event in events:
+                if event['operation'] == 'delete':
+                    self._drop(event['table_name'], event['row_id'])
+            self.offset = events[-1]['offset']
+            processed += len(events)
+        return processed
+
+    def add_user(self, user_id, name):
+        """Register a user name for the donor_name of a detached store's results."""
+        self.users[user_id] = name
+
+    def _donor_name(self, donor_id):
+        if donor_id not in self.users and self.conn is not None:
+            row = self.conn.execute("SELECT name FROM users WHERE id = ?", (donor_id,)).fetchone()
+            if row:
+                self.users[donor_id] = row[0]
+        return self.users.get(donor_id)
+
+    def _available_key(self, donation):
+        created = donation.get('created_at')
+        created_seconds = parse_timestamp(created).timestamp() if created else 0.0
+        return (donation.get('expiry_date') or NO_EXPIRY, -created_seconds, donation['id'])
+
+    def _put_donation(self, donation):
+        """Insert or replace a donation and keep the indexes in step."""
+        previous = self.donations.get(donation['id'])
+        if previous is not None and previous['status'] == 'available':
+            self._remove_key(self.available, self._available_key(previous))
+        if previous is None:
+            bisect.insort(self.donations_by_donor.setdefault(donation['donor_id'], []), _history_key(donation))
+
+        self.donations[donation['id']] = donation
+        if donation['status'] == 'available':
+            bisect.insort(self.available, self._available_key(donation))
+        self.next_ids['donations'] = max(self.next_ids['donations'], donation['id'] + 1)
+
+    def _put_request(self, request):
+        """Insert or replace a request and keep the indexes in step."""
+        if request['id'] not in self.requests:
+            bisect.insort(self.requests_by_recipient.setdefault(request['recipient_id'], []), _history_key(request))
+        self.requests[request['id']] = request
+        self.next_ids['requests'] = max(self.next_ids['requests'], request['id'] + 1)
+
+    def _drop(self, table, row_id):
+        """Remove a deleted donation or request and its index entries."""
+        if table == 'donations':
+            donation = self.donations.pop(row_id, None)
+            if donation is None:
+                return
+            self._remove_key(self.available, self._available_key(donation))
+            self._remove_key(self.donations_by_donor.get(donation['donor_id'], []), _history_key(donation))
+        else:
+            request = self.requests.pop(row_id, None)
+            if request is None:
+                return
+            self._remove_key(self.requests_by_recipient.get(request['recipient_id'], []), _history_key(request))
+
+    @staticmethod
+    def _remove_key(keys, key):
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+
+    def available_donations(self, limit=20, with_donor=True):
+        self.catch_up()
+        results = []
+        for _, _, donation_id in self.available:
+            donation = self.donations[donation_id]
+            if not with_donor:
+                results.append(dict(donation))
+            else:
+                donor_name = self._donor_name(donation['donor_id'])
+                if donor_name is None:
+                    continue
+                results.append(dict(donation, donor_name=donor_name))
+            if len(results) == limit:
+                break
+        return results
+
+    def donor_donations(self, donor_id):
+        self.catch_up()
+        return [dict(self.donations[i]) for _, i in reversed(self.donations_by_donor.get(donor_id, []))]
+
+    def recipient_history(self, recipient_id):
+        self.catch_up()
+        keys = self.requests_by_recipient.get(recipient_id, [])
+        return [row for row in map(self._history_row, reversed(keys)) if row is not None]
+
+    def _history_row(self, key):
+        """Return the recipient_history row for a request key, or None if its donation or donor is gone."""
+        request = self.requests[key[1]]
+        donation = self.donations.get(request['donation_id'])
+        if donation is None:
+            return None
+        donor_name = self._donor_name(donation['donor_id'])
+        if donor_name is None:
+            return None
+        return dict(
+            request,
+            food_name=donation['food_name'],
+            quantity=donation['quantity'],
+            expiry_date=donation['expiry_date'],
+            donor_name=donor_name
+        )
+
+    def donor_donations_page(self, donor_id, limit, after=None):
+        self.catch_up()
+        keys = _page_keys(self.donations_by_donor.get(donor_id, []), limit, after)
+        return [dict(self.donations[i]) for _, i in keys[:limit]], _continuation_key(keys, limit)
+
+    def recipient_history_page(self, recipient_id, limit, after=None):
+        self.catch_up()
+        keys = _page_keys(self.requests_by_recipient.get(recipient_id, []), limit, after)
+        rows = [row for row in map(self._history_row, keys[:limit]) if row is not None]
+        return rows, _continuation_key(keys, limit)
+
+    def count_donations(self, by='status'):
+        if by not in ('status', 'location'):
+            raise ValueError(f"Cannot count donations by {by}")
+        self.catch_up()
+        counts = {}
+        for donation in self.donations.values():
+            counts[donation[by]] = counts.get(donation[by], 0) + 1
+        return counts
+
+    def count_donations_by_period(self, period='monthly'):
+        date_format = PERIOD_FORMATS.get(period, PERIOD_FORMATS['monthly'])
+        self.catch_up()
+        day_counts = {}
+        for donation in self.donations.values():
+            day = donation['created_at'][:10] if donation['created_at'] else None
+            day_counts[day] = day_counts.get(day, 0) + 1
+        # Format each distinct day once instead of every row
+        counts = {}
+        for day, count in day_counts.items():
+            label = datetime.strptime(day, '%Y-%m-%d').strftime(date_format) if day else None
+            counts[label] = counts.get(label, 0) + count
+        # SQLite sorts NULL first
+        return sorted(counts.items(), key=lambda item: (item[0] is not None, item[0] or ''))
+
+    def add_donation(self, donation):
+        if self.conn is not None:
+            raise sqlite3.NotSupportedError("Write through the database; a followed store is read-only")
+        row = {c: donation.get(c) for c in DONATION_COLUMNS}
+        row['id'] = self.next_ids['donations']
+        row['status'] = row['status'] or 'available'
+        row['created_at'] = row['created_at'] or datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        _check_status('donations', row['status'])
+        self._put_donation(row)
+        return row['id']
+
+    def add_request(self, request):
+        if self.conn is not None:
+            raise sqlite3.NotSupportedError("Write through the database; a followed store is read-only")
+        row = {c: request.get(c) for c in REQUEST_COLUMNS}
+        row['id'] = self.next_ids['requests']
+        row['status'] = row['status'] or 'pending'
+        row['created_at'] = row['created_at'] or datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        _check_status('requests', row['status'])
+        self._put_request(row)
+        return row['id']
+
+    def set_status(self, table, row_id, status):
+        if self.conn is not None:
+            raise sqlite3.NotSupportedError("Write through the database; a followed store is read-only")
+        _check_status(table, status)
+        rows = self.donations if table == 'donations' else self.requests
+        if row_id not in rows:
+            return False
+        row = dict(rows[row_id], status=status)
+        if table == 'donations':
+            self._put_donation(row)
+        else:
+            self._put_request(row)
+        return True
+
+
+def _page_keys(keys, limit, after):
+    """Return up to limit + 1 of the sorted keys below after, newest first."""
+    end = bisect.bisect_left(keys, tuple(after)) if after else len(keys)
+    return keys[max(0, end - limit - 1):end][::-1]
+
+
+def _continuation_key(keys, limit):
+    return keys[limit - 1] if len(keys) > limit else None
+
+
+STORAGE_ENGINES = {
+    'sqlite': SQLiteStorage,
+    'memory': InMemoryStorage.from_sqlite
+}
+
+
+def create_storage(conn, engine='sqlite'):
+    """Create a storage backend over an open connection; 'memory' loads and follows it."""
+    if engine not in STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage engine: {engine}")
+    return STORAGE_ENGINES[engine](conn)
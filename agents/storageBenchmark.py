@@ -0,0 +1,174 @@
+"""
+Storage benchmark: one workload against every storage backend.
+
+Copies the database to a scratch file with the backup API (so the real data
+is never written), loads a detached `InMemoryStorage` from the same copy,
+then replays an identical random mix of matching reads, history lookups,
+grouped counts and writes against each backend. Prints per-operation
+latency percentiles and checks that both backends returned the same rows.
+
+Run with:
+    python agents/storageBenchmark.py --db database/foodcycle.sqlite --operations 5000
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.archivePartitions import ArchivePartitions
+from agents.storage import InMemoryStorage, SQLiteStorage
+
+# Relative frequency of each operation in the workload
+OPERATION_MIX = {
+    'available_donations': 50,
+    'donor_donations': 15,
+    'recipient_history': 15,
+    'count_donations': 5,
+    'count_donations_by_period': 5,
+    'add_donation': 5,
+    'set_status': 5
+}
+
+
+def build_workload(conn, operations, seed=0):
+    """Return a list of (operation, args) drawn from OPERATION_MIX over the database's ids."""
+    rng = random.Random(seed)
+    donor_ids = [row[0] for row in conn.execute("SELECT DISTINCT donor_id FROM donations_all")] or [1]
+    recipient_ids = [row[0] for row in conn.execute("SELECT DISTINCT recipient_id FROM requests_all")] or [1]
+    donation_ids = [row[0] for row in conn.execute("SELECT id FROM donations WHERE status = 'available'")]
+    names, weights = zip(*OPERATION_MIX.items())
+
+    workload = []
+    for _ in range(operations):
+        name = rng.choices(names, weights)[0]
+        if name == 'available_donations':
+            args = (rng.choice((10, 20, 30)),)
+        elif name == 'donor_donations':
+            args = (rng.choice(donor_ids),)
+        elif name == 'recipient_history':
+            args = (rng.choice(recipient_ids),)
+        elif name == 'count_donations':
+            args = (rng.choice(('status', 'location')),)
+        elif name == 'count_donations_by_period':
+            args = (rng.choice(('monthly', 'weekly', 'daily')),)
+        elif name == 'add_donation':
+            args = ({
+                "donor_id": rng.choice(donor_ids),
+                "food_name": rng.choice(("Fresh Apples", "Whole milk", "Rice", "Sourdough bread")),
+                "quantity": f"{rng.randint(1, 10)} kg",
+                "expiry_date": f"2030-01-{rng.randint(1, 28):02d}",
+                "location": "Benchmark",
+                "status": "available",
+                "created_at": f"2029-12-{rng.randint(1, 28):02d} 12:00:00"
+            },)
+        elif donation_ids:
+            name = 'set_status'
+            args = ('donations', donation_ids.pop(rng.randrange(len(donation_ids))), 'reserved')
+        else:
+            name, args = 'available_donations', (20,)
+        workload.append((name, args))
+    return workload
+
+
+def run_workload(backend, workload, commit=None):
+    """Replay a workload; return ({operation: [seconds]}, [result per read operation])."""
+    timings = {}
+    results = []
+    for name, args in workload:
+        start = time.perf_counter()
+        result = getattr(backend, name)(*args)
+        if commit is not None and name in ('add_donation', 'set_status'):
+            commit()
+        timings.setdefault(name, []).append(time.perf_counter() - start)
+        if name not in ('add_donation', 'set_status'):
+            results.append(result)
+    return timings, results
+
+
+def normalize(result):
+    """Make a result comparable across backends that break ordering ties differently."""
+    if isinstance(result, list):
+        return sorted(json.dumps(item, sort_keys=True, default=str) for item in result)
+    if isinstance(result, dict):
+        # Grouped counts can have a None key, which sort_keys cannot order
+        return json.dumps(sorted(result.items(), key=str), default=str)
+    return json.dumps(result, sort_keys=True, default=str)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def benchmark(db_path, operations=2000, seed=0):
+    """Run the workload against both backends and return a summary dict."""
+    scratch_dir = tempfile.mkdtemp(prefix='storage-benchmark-')
+    scratch_path = os.path.join(scratch_dir, os.path.basename(db_path))
+    source = sqlite3.connect(db_path)
+    conn = sqlite3.connect(scratch_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        source.backup(conn)
+        source.close()
+        # Archived months are read from the original database's partition files
+        ArchivePartitions(conn, db_path).open()
+
+        workload = build_workload(conn, operations, seed)
+
+        start = time.perf_counter()
+        memory = InMemoryStorage.from_sqlite(conn, follow=False)
+        load_seconds = time.perf_counter() - start
+
+        summary = {"operations": operations, "memory_load_ms": round(load_seconds * 1000, 1), "backends": {}}
+        outputs = {}
+        for name, backend, commit in (
+            ('sqlite', SQLiteStorage(conn), conn.commit),
+            ('memory', memory, None)
+        ):
+            timings, outputs[name] = run_workload(backend, workload, commit)
+            summary["backends"][name] = {
+                op: {
+                    "count": len(values),
+                    "p50_ms": round(percentile(values, 0.5) * 1000, 3),
+                    "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+                    "total_ms": round(sum(values) * 1000, 1)
+                }
+                for op, values in sorted(timings.items())
+            }
+
+        summary["mismatches"] = sum(
+            normalize(a) != normalize(b) for a, b in zip(outputs['sqlite'], outputs['memory'])
+        )
+        return summary
+    finally:
+        conn.close()
+        os.remove(scratch_path)
+        os.rmdir(scratch_dir)
+
+
+# Benchmark entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the storage backends on one workload.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database to copy")
+    parser.add_argument('--operations', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    summary = benchmark(args.db, args.operations, args.seed)
+    print(f"{args.operations} operations, in-memory load {summary['memory_load_ms']} ms")
+    print(f"{'operation':28} {'backend':8} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'total ms':>10}")
+    for op in sorted(OPERATION_MIX):
+        for backend, stats in summary["backends"].items():
+            if op in stats:
+                s = stats[op]
+                print(f"{op:28} {backend:8} {s['count']:6} {s['p50_ms']:9.3f} {s['p95_ms']:9.3f} {s['total_ms']:10.1f}")
+    print(f"Result mismatches between backends: {summary['mismatches']}")
@@ -0,0 +1,303 @@
+"""
+SupplyForecaster: Seasonal forecasts of donor arrivals and category supply and demand.
+
+`DonorAgent.analyze_donation_patterns` predicts a donor's next donation as
+their last date plus their mean gap, one donor at a time. This module
+forecasts every series at once instead. It builds daily count matrices over
+the last HISTORY_DAYS days with grouped SQL:
+
+- donor arrivals: one row per active donor
+- supply: donations per (category, location), plus a row per category over all
+  locations
+- demand: requests per (category, location) of the requested donation, likewise
+
+It then fits an additive seasonal exponential-smoothing model (level plus a
+weekly season) to all rows of a matrix in one vectorized NumPy pass. Each
+time step updates every series together, so a fit costs HISTORY_DAYS array
+operations whatever the number of series.
+
+Forecasts are cached in memory and rebuilt only when new data arrives, that
+is, when a donation or request has been inserted since the last build, or
+when the day changes. Status changes do not affect the counts, so they do not
+invalidate the cache.
+
+Print the category outlook and expected pickups with:
+    python agents/supplyForecast.py --db database/foodcycle.sqlite --days 7
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+import numpy as np
+
+# Add parent directory to path to access shared modules when run as a script
+if not __package__:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.archivePartitions import ArchivePartitions
+from agents.foodCategories import categorize_basic
+
+# Days of history each model is fitted on
+HISTORY_DAYS = 182
+# Days ahead that are forecast
+HORIZON_DAYS = 14
+# Weekly seasonality
+SEASON_DAYS = 7
+# Smoothing weights of the level and of the seasonal terms
+LEVEL_ALPHA = 0.2
+SEASON_GAMMA = 0.1
+# Location key of the per-category rows that sum every location
+ANY_LOCATION = '*'
+# Expected donations by which a donor is predicted to have donated again
+NEXT_DONATION_THRESHOLD = 0.5
+# SQLite's default limit on bound parameters is 999
+ID_CHUNK_SIZE = 900
+
+
+def fit_seasonal(counts, alpha=LEVEL_ALPHA, gamma=SEASON_GAMMA, season=SEASON_DAYS, horizon=HORIZON_DAYS):
+    """Fit additive level + seasonal exponential smoothing to every row of counts.
+
+    counts has shape (series, days). Returns forecasts of shape
+    (series, horizon) for the days after the last column, clipped at zero.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    series, days = counts.shape
+    if series == 0:
+        return np.zeros((0, horizon))
+    if days < season:
+        return np.repeat(counts.mean(axis=1, keepdims=True), horizon, axis=1) if days else np.zeros((series, horizon))
+
+    # Initial level is the first season's mean and the seasonal terms are its deviations from it
+    level = counts[:, :season].mean(axis=1)
+    seasonal = counts[:, :season] - level[:, None]
+    for t in range(season, days):
+        phase = t % season
+        observed = counts[:, t]
+        new_level = alpha * (observed - seasonal[:, phase]) + (1 - alpha) * level
+        seasonal[:, phase] = gamma * (observed - new_level) + (1 - gamma) * seasonal[:, phase]
+        level = new_level
+
+    phases = (days + np.arange(horizon)) % season
+    return np.maximum(level[:, None] + seasonal[:, phases], 0.0)
+
+
+class SeriesMatrix:
+    """Daily counts for keyed series, filled from (key, day, count) rows."""
+
+    def __init__(self, days):
+        self.days = days
+        self.index = {}
+        self.rows = []
+
+    def add(self, key, day, count):
+        row = self.index.get(key)
+        if row is None:
+            row = self.index[key] = len(self.index)
+        self.rows.append((row, day, count))
+
+    def counts(self):
+        matrix = np.zeros((len(self.index), self.days))
+        if self.rows:
+            rows, days, values = np.array(self.rows, dtype=np.int64).T
+            np.add.at(matrix, (rows, days), values)
+        return matrix
+
+    def keys(self):
+        return list(self.index)
+
+
+class SupplyForecaster:
+    def __init__(self, conn, history_days=HISTORY_DAYS, horizon_days=HORIZON_DAYS):
+        """Initialize the forecaster on an open database connection; models are fitted on first use."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.history_days = history_days
+        self.horizon_days = horizon_days
+        self.cached_version = None
+        self.cached = None
+
+    def data_version(self):
+        """Return what the forecasts depend on: the newest donation and request ids, and today."""
+        self.cursor.execute("SELECT MAX(id) as max_id FROM donations")
+        donation_id = self.cursor.fetchone()['max_id']
+        self.cursor.execute("SELECT MAX(id) as max_id FROM requests")
+        request_id = self.cursor.fetchone()['max_id']
+        return donation_id, request_id, date.today().isoformat()
+
+    def forecasts(self):
+        """Return the fitted forecasts, refitting only if data arrived since the last fit."""
+        version = self.data_version()
+        if version != self.cached_version:
+            self.cached = self.build(date.fromisoformat(version[2]))
+            self.cached_version = version
+        return self.cached
+
+    def build(self, today):
+        """Read the count matrices for the days before today and fit every model."""
+        start = today - timedelta(days=self.history_days)
+        window = (start.isoformat(), today.isoformat())
+        category_of = {}
+
+        def category(food_name):
+            if food_name not in category_of:
+                category_of[food_name] = categorize_basic(food_name)
+            return category_of[food_name]
+
+        donors = SeriesMatrix(self.history_days)
+        supply = SeriesMatrix(self.history_days)
+        self.cursor.execute(
+            """
+            SELECT donor_id, food_name, location,
+                   CAST(julianday(date(created_at)) - julianday(?) AS INTEGER) as day,
+                   COUNT(*) as count
+            FROM donations_all
+            WHERE created_at >= ? AND created_at < ?
+            GROUP BY donor_id, food_name, location, day
+            """,
+            (start.isoformat(), *window)
+        )
+        for row in self.cursor.fetchall():
+            donors.add(row['donor_id'], row['day'], row['count'])
+            cat = category(row['food_name'])
+            supply.add((cat, row['location'] or ''), row['day'], row['count'])
+            supply.add((cat, ANY_LOCATION), row['day'], row['count'])
+
+        # Requests are grouped by donation first; joining donations_all would materialize the view
+        self.cursor.execute(
+            """
+            SELECT donation_id,
+                   CAST(julianday(date(created_at)) - julianday(?) AS INTEGER) as day,
+                   COUNT(*) as count
+            FROM requests_all
+            WHERE created_at >= ? AND created_at < ?
+            GROUP BY donation_id, day
+            """,
+            (start.isoformat(), *window)
+        )
+        request_days = self.cursor.fetchall()
+        donation_ids = list({row['donation_id'] for row in request_days})
+        donations = {}
+        for i in range(0, len(donation_ids), ID_CHUNK_SIZE):
+            chunk = donation_ids[i:i + ID_CHUNK_SIZE]
+            self.cursor.execute(
+                f"SELECT id, food_name, location FROM donations_all WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            donations.update((row['id'], (category(row['food_name']), row['location'] or ''))
+                             for row in self.cursor.fetchall())
+
+        demand = SeriesMatrix(self.history_days)
+        for row in request_days:
+            cell = donations.get(row['donation_id'])
+            if cell is None:
+                continue
+            demand.add(cell, row['day'], row['count'])
+            demand.add((cell[0], ANY_LOCATION), row['day'], row['count'])
+
+        # One vectorized fit per matrix
+        return {
+            "start": today,
+            "donors": (donors.keys(), fit_seasonal(donors.counts(), horizon=self.horizon_days)),
+            "donor_rows": dict(donors.index),
+            "supply": (supply.keys(), fit_seasonal(supply.counts(), horizon=self.horizon_days)),
+            "demand": (demand.keys(), fit_seasonal(demand.counts(), horizon=self.horizon_days))
+        }
+
+    def _horizon(self, days):
+        return max(1, min(int(days), self.horizon_days))
+
+    def category_outlook(self, location=None, days=7):
+        """Return expected donations and requests per category over the next days, biggest shortfall first.
+
+        location=None sums every location.
+        """
+        days = self._horizon(days)
+        forecasts = self.forecasts()
+        cell_location = ANY_LOCATION if location is None else (location or '')
+        expected = {}
+        for side in ('supply', 'demand'):
+            keys, values = forecasts[side]
+            totals = values[:, :days].sum(axis=1)
+            for (cat, loc), total in zip(keys, totals):
+                if loc == cell_location:
+                    expected.setdefault(cat, {'supply': 0.0, 'demand': 0.0})[side] = float(total)
+
+        outlook = [
+            {
+                "category": cat,
+                "expected_donations": round(e['supply'], 1),
+                "expected_requests": round(e['demand'], 1),
+                "shortfall": round(e['demand'] - e['supply'], 1)
+            }
+            for cat, e in expected.items()
+        ]
+        return sorted(outlook, key=lambda x: (-x['shortfall'], x['category']))
+
+    def expected_pickups(self, days=7):
+        """Return expected donations per location and day over the next days, for pickup capacity planning."""
+        days = self._horizon(days)
+        forecasts = self.forecasts()
+        keys, values = forecasts['supply']
+        per_location = {}
+        for (cat, loc), row in zip(keys, values[:, :days]):
+            if loc != ANY_LOCATION:
+                per_location[loc] = per_location.get(loc, 0) + row
+
+        start = forecasts['start']
+        plan = [
+            {
+                "location": loc or "Unknown",
+                "total": round(float(daily.sum()), 1),
+                "daily": [
+                    {"date": (start + timedelta(days=d)).isoformat(), "expected_donations": round(float(v), 2)}
+                    for d, v in enumerate(daily)
+                ]
+            }
+            for loc, daily in per_location.items()
+        ]
+        return sorted(plan, key=lambda x: (-x['total'], x['location']))
+
+    def donor_next_donation(self, donor_id):
+        """Return the first date by which a donor is expected to have donated again, or None.
+
+        None when the donor was inactive over the history window or is not
+        expected to donate within the horizon.
+        """
+        forecasts = self.forecasts()
+        row = forecasts['donor_rows'].get(donor_id)
+        if row is None:
+            return None
+        reached = np.nonzero(np.cumsum(forecasts['donors'][1][row]) >= NEXT_DONATION_THRESHOLD)[0]
+        if reached.size == 0:
+            return None
+        return (forecasts['start'] + timedelta(days=int(reached[0]))).isoformat()
+
+
+# Forecast entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Forecast donation supply and demand.")
+    parser.add_argument('--db', default='database/foodcycle.sqlite', help="SQLite database path")
+    parser.add_argument('--days', type=int, default=7, help="Days ahead to sum over")
+    parser.add_argument('--location', help="Restrict the category outlook to one location")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        # Archived months live in partition files
+        ArchivePartitions(conn, args.db).open()
+        forecaster = SupplyForecaster(conn)
+        print(f"Category outlook, next {args.days} days:")
+        for item in forecaster.category_outlook(args.location, args.days):
+            print(f"  {item['category']:12} donations {item['expected_donations']:8} "
+                  f"requests {item['expected_requests']:8} shortfall {item['shortfall']:8}")
+        print("Expected pickups per location:")
+        for item in forecaster.expected_pickups(args.days):
+            print(f"  {item['location']:20} {item['total']:8}")
+    except sqlite3.Error as e:
+        print(f"Forecast error: {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,209 @@
+"""
+TrendingFoodSketch: Approximate top-k requested foods over sliding time windows.
+
+Requests are folded into per-day SpaceSaving summaries stored in SQLite, so
+every agent process shares the same sketch and it survives restarts. New
+requests are picked up from the change log before each query, and deleted
+requests, or requests on a deleted donation, are taken back out. Each daily
+bucket keeps at most `capacity` foods; when a new food arrives in a
+full bucket it replaces the least counted one and inherits its count as the
+error bound. A window query merges at most window_days * capacity rows, no
+matter how large the requests table grows.
+"""
+
+from datetime import datetime, timedelta
+
+from agents.changeLog import ChangeLog
+from agents.donorProfiles import parse_timestamp
+
+CONSUMER = 'trending_sketch'
+SKETCH_EPOCH = datetime(2020, 1, 1)
+
+
+def day_bucket(timestamp):
+    """Return the day number of a timestamp counted from SKETCH_EPOCH."""
+    if isinstance(timestamp, str):
+        timestamp = parse_timestamp(timestamp)
+    return (timestamp - SKETCH_EPOCH).days
+
+
+class TrendingFoodSketch:
+    # Rows are keyed by stream so other event streams can share the table
+    stream = 'requested_foods'
+
+    def __init__(self, conn, capacity=50, retention_days=90):
+        """Initialize the sketch on an open database connection."""
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.changes = ChangeLog(conn)
+        self.capacity = capacity
+        self.retention_days = retention_days
+        self._pruned_bucket = None
+        self.create_tables()
+
+    def create_tables(self):
+        """Create the sketch tables if they do not exist."""
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS trending_sketch (
+                stream TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                item TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                error INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (stream, bucket, item)
+            )
+            """
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_trending_sketch_count ON trending_sketch (stream, bucket, count)"
+        )
+        # Streams that have been backfilled from history
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS trending_sketch_state (
+                stream TEXT PRIMARY KEY,
+                built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+
+    def sync(self):
+        """Fold requests created since the last sync into the sketch.
+
+        The caller is responsible for committing. Returns the number of events read.
+        """
+        self.ensure_built()
+        # Deleting a donation uncounts its requests
+        processed = self.changes.consume(CONSUMER, self._apply_events)
+
+        today = day_bucket(datetime.utcnow())
+        if today != self._pruned_bucket:
+            # Drop buckets that fell out of retention once per day
+            self._pruned_bucket = today
+            self.cursor.execute(
+                "DELETE FROM trending_sketch WHERE stream = ? AND bucket < ?",
+                (self.stream, today - self.retention_days)
+            )
+        return processed
+
+    def _apply_events(self, events):
+        """Count the requested food of every inserted request in a batch and uncount deleted ones."""
+        for _, request, donation, old_status, new_status in self.changes.request_transitions(events, 'id, food_name'):
+            delta = (new_status is not None) - (old_status is not None)
+            if delta > 0:
+                self._add(day_bucket(request['created_at']), donation['food_name'], 1)
+            elif delta < 0:
+                self._remove(day_bucket(request['created_at']), donation['food_name'])
+
+    def _add(self, bucket, item, weight):
+        """Apply a SpaceSaving update to one bucket."""
+        self.cursor.execute(
+            """
+            UPDATE trending_sketch SET count = count + ?
+            WHERE stream = ? AND bucket = ? AND item = ?
+            """,
+            (weight, self.stream, bucket, item)
+        )
+        if self.cursor.rowcount:
+            return
+
+        self.cursor.execute(
+            "SELECT COUNT(*) as count FROM trending_sketch WHERE stream = ? AND bucket = ?",
+            (self.stream, bucket)
+        )
+        if self.cursor.fetchone()['count'] < self.capacity:
+            self.cursor.execute(
+                "INSERT INTO trending_sketch (stream, bucket, item, count, error) VALUES (?, ?, ?, ?, 0)",
+                (self.stream, bucket, item, weight)
+            )
+            return
+
+        # Bucket is full: the new item takes over the minimum counter
+        self.cursor.execute(
+            """
+            SELECT item, count FROM trending_sketch
+            WHERE stream = ? AND bucket = ?
+            ORDER BY count ASC
+            LIMIT 1
+            """,
+            (self.stream, bucket)
+        )
+        evicted = self.cursor.fetchone()
+        self.cursor.execute(
+            "DELETE FROM trending_sketch WHERE stream = ? AND bucket = ? AND item = ?",
+            (self.stream, bucket, evicted['item'])
+        )
+        self.cursor.execute(
+            "INSERT INTO trending_sketch (stream, bucket, item, count, error) VALUES (?, ?, ?, ?, ?)",
+            (self.stream, bucket, item, evicted['count'] + weight, evicted['count'])
+        )
+
+    def _remove(self, bucket, item):
+        """Take one deleted request back out of a bucket.
+
+        Only a counter the bucket still keeps can be decremented; if the item
+        was evicted, its count is already within the bucket's error bound.
+        """
+        self.cursor.execute(
+            """
+            UPDATE trending_sketch SET count = count - 1
+            WHERE stream = ? AND bucket = ? AND item = ? AND count > 0
+            """,
+            (self.stream, bucket, item)
+        )
+
+    def top(self, k=10, window_days=30, now=None):
+        """Return the k most frequent items over the last window_days.
+
+        Each entry is {item, count, max_error}. count - max_error is a lower
+        bound on the true count. count is an upper bound only over the days
+        whose bucket kept the item: a full bucket that evicted it may hide up
+        to that bucket's smallest count.
+        """
+        self.sync()
+        now = now or datetime.utcnow()
+        self.cursor.execute(
+            """
+            SELECT item, SUM(count) as count, SUM(error) as max_error
+            FROM trending_sketch
+            WHERE stream = ? AND bucket > ?
+            GROUP BY item
+            ORDER BY count DESC
+            LIMIT ?
+            """,
+            (self.stream, day_bucket(now) - window_days, k)
+        )
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def ensure_built(self):
+        """Backfill the sketch from the requests table the first time it is used."""
+        self.cursor.execute(
+            "SELECT 1 FROM trending_sketch_state WHERE stream = ?",
+            (self.stream,)
+        )
+        if not self.cursor.fetchone() or self.changes.get_offset(CONSUMER) is None:
+            self.rebuild()
+
+    def rebuild(self):
+        """Rebuild the sketch from requests within the retention period."""
+        since = (datetime.utcnow() - timedelta(days=self.retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+        # Deleting first takes the write lock, so the log head matches the rows read below
+        self.cursor.execute("DELETE FROM trending_sketch WHERE stream = ?", (self.stream,))
+        self.changes.set_offset(CONSUMER, self.changes.head())
+        self.cursor.execute(
+            """
+            SELECT d.food_name, r.created_at
+            FROM requests_all r
+            JOIN donations_all d ON r.donation_id = d.id
+            WHERE r.created_at >= ?
+            ORDER BY r.created_at
+            """,
+            (since,)
+        )
+        for row in self.cursor.fetchall():
+            self._add(day_bucket(row['created_at']), row['food_name'], 1)
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO trending_sketch_state (stream) VALUES (?)",
+            (self.stream,)
+        )
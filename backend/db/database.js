@@ -40,7 +40,7 @@ function initDatabase() {
       expiry_date TEXT,
       description TEXT,
       location TEXT,
-      status TEXT CHECK(status IN ('available', 'reserved', 'completed')) DEFAULT 'available',
+      status TEXT CHECK(status IN ('available', 'reserved', 'completed', 'expired')) DEFAULT 'available',
       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
       FOREIGN KEY (donor_id) REFERENCES users (id)
     )`);
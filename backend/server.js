@@ -1,6 +1,7 @@
 const express = require('express');
 const cors = require('cors');
 const http = require('http');
+const net = require('net');
 const socketIo = require('socket.io');
 const donationRoutes = require('./routes/donationRoutes');
 const path = require('path');
@@ -55,6 +56,42 @@ io.on('connection', (socket) => {
   });
 });
 
+// Relay donation availability deltas published by agents/availabilityFeed.py
+// The socket sits next to the database rather than in a world-writable directory
+const AVAILABILITY_SOCKET = process.env.AVAILABILITY_SOCKET
+  || path.join(__dirname, '../database/foodcycle-availability.sock');
+
+function subscribeToAvailabilityFeed() {
+  const feed = net.createConnection(AVAILABILITY_SOCKET);
+  let buffered = '';
+
+  feed.setEncoding('utf8');
+  feed.on('data', (chunk) => {
+    buffered += chunk;
+    const lines = buffered.split('\n');
+    buffered = lines.pop();
+    lines.forEach((line) => {
+      if (!line) return;
+      let message;
+      try {
+        message = JSON.parse(line);
+      } catch (err) {
+        console.error('Skipping malformed availability message:', err.message);
+        return;
+      }
+      if (!message || typeof message !== 'object') return;
+      // One emit per batch; clients fetch the full list once on the hello
+      io.emit(message.type === 'hello' ? 'donation_availability_reset' : 'donation_availability', message);
+    });
+  });
+
+  // The feed may start after the server or be restarted; keep retrying
+  feed.on('error', () => {});
+  feed.on('close', () => setTimeout(subscribeToAvailabilityFeed, 2000));
+}
+
+subscribeToAvailabilityFeed();
+
 // Serve static assets if in production
 if (process.env.NODE_ENV === 'production') {
   // Set static folder
@@ -64,6 +64,20 @@ class SocketService {
       this.socket.on('donation_status_update', callback);
     }
   }
+
+  // Batched availability deltas: { offset, deltas: [{ event, id, donation? }] }
+  onDonationAvailability(callback) {
+    if (this.socket) {
+      this.socket.on('donation_availability', callback);
+    }
+  }
+
+  // The feed (re)started; re-fetch the full donation list once
+  onDonationAvailabilityReset(callback) {
+    if (this.socket) {
+      this.socket.on('donation_availability_reset', callback);
+    }
+  }
 }
 
 export default new SocketService(); 
\ No newline at end of file